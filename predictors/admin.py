@@ -56,7 +56,12 @@ class PredictionAdmin(admin.ModelAdmin):
 # Registrazione semplice per gli altri modelli
 admin.site.register(DynamicFactor)
 admin.site.register(OddsMovement)
-admin.site.register(ModelRegistry)
+
+@admin.register(ModelRegistry)
+class ModelRegistryAdmin(admin.ModelAdmin):
+    list_display = ('name', 'version', 'is_active', 'training_rows', 'rolled_back_at', 'created_at')
+    list_filter = ('is_active',)
+    readonly_fields = ('fingerprint', 'metrics')
 
 @admin.register(MatchLineup)
 class MatchLineupAdmin(admin.ModelAdmin):
@@ -0,0 +1,105 @@
+"""
+API JSON di sola lettura per gli strumenti esterni (al posto dello scraping della dashboard).
+
+- /api/rounds/next/          prossima giornata (come la dashboard)
+- /api/rounds/<n>/           giornata n della stagione corrente (?season=<id> per un'altra)
+- /api/matches/<id>/         singola partita
+
+Ogni risposta ha ETag e Last-Modified calcolati da PredictionApiService.version()
+(una query): con If-None-Match / If-Modified-Since il client riceve 304 senza
+che il payload venga costruito.
+
+Le viste sono async: sotto ASGI i gruppi di query del payload girano in
+parallelo (PredictionApiService.abuild), sotto WSGI funzionano comunque.
+"""
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET
+from .models import Match
+from .services import PredictionApiService
+from .standings import StandingsLedger
+
+
+def _round_scope(request, round_number=None):
+    """ (season_id, round_number) richiesti; la prossima giornata se round_number è None. """
+    if round_number is None:
+        scope = PredictionApiService.next_round()
+        if scope is None:
+            raise Http404("Nessuna giornata da giocare")
+        return scope
+    season_id = request.GET.get('season')
+    if season_id is not None:
+        if not season_id.isdigit():
+            raise Http404("Stagione non valida")
+        return int(season_id), round_number
+    season = StandingsLedger.current_season()
+    if season is None:
+        raise Http404("Nessuna stagione")
+    return season.id, round_number
+
+
+def _round_matches(request, round_number=None):
+    # Calcolato una volta per richiesta (usato da ETag, Last-Modified e vista)
+    if not hasattr(request, '_api_round'):
+        season_id, round_number = _round_scope(request, round_number)
+        request._api_round = (season_id, round_number, Match.objects.filter(season_id=season_id, round_number=round_number))
+    return request._api_round
+
+
+def _version(request, matches):
+    if not hasattr(request, '_api_version'):
+        request._api_version = PredictionApiService.version(matches)
+    return request._api_version
+
+
+def _round_version(request, round_number=None):
+    return _version(request, _round_matches(request, round_number)[2])
+
+
+def _match_version(request, match_id):
+    return _version(request, Match.objects.filter(id=match_id))
+
+
+def conditional(version_func):
+    """
+    Come django.views.decorators.http.condition, per viste async: version_func
+    (sincrona, con query) restituisce (etag, last_modified) ed è eseguita in un thread.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag, last_modified = await sync_to_async(version_func)(request, *args, **kwargs)
+            timestamp = int(last_modified.timestamp()) if last_modified else None
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if timestamp and not response.has_header('Last-Modified'):
+                response.headers['Last-Modified'] = http_date(timestamp)
+            if etag:
+                response.headers.setdefault('ETag', etag)
+            return response
+        return inner
+    return decorator
+
+
+@require_GET
+@conditional(_round_version)
+async def round_predictions(request, round_number=None):
+    # Già letto da _round_version (memorizzato sulla richiesta): nessuna query qui
+    season_id, round_number, matches = _round_matches(request, round_number)
+    payload = await PredictionApiService.abuild(matches, with_slip=True)
+    if not payload['matches']:
+        raise Http404("Giornata non trovata")
+    return JsonResponse({'season_id': season_id, 'round': round_number, **payload})
+
+
+@require_GET
+@conditional(_match_version)
+async def match_prediction(request, match_id):
+    payload = await PredictionApiService.abuild(Match.objects.filter(id=match_id))
+    if not payload['matches']:
+        raise Http404("Partita non trovata")
+    return JsonResponse(payload['matches'][0])
@@ -0,0 +1,60 @@
+"""
+Gruppi di query indipendenti eseguiti in parallelo dalle viste async (ASGI).
+
+I metodi async dell'ORM (afirst, alist, ...) passano tutti dallo stesso thread
+(thread_sensitive=True): non bloccano l'event loop ma le query restano in serie.
+gather() esegue invece ogni gruppo in un thread di un pool fisso (POOL_SIZE) con
+la propria connessione al database, quindi la latenza della pagina è quella del
+gruppo più lento e non la somma dei gruppi.
+
+Le connessioni dei thread del pool sono persistenti (CONN_MAX_AGE secondi, con il
+controllo di salute di Django prima del riuso): la dashboard (due fasi da due
+gruppi) non apre quattro connessioni nuove a ogni richiesta. I thread sono al
+massimo POOL_SIZE per processo, quindi le connessioni aperte restano limitate; i
+thread delle richieste mantengono il CONN_MAX_AGE dei settings (0 sotto ASGI).
+
+Un gruppo è una funzione sincrona senza argomenti che esegue le sue query e
+restituisce dati già caricati (liste, dict): niente queryset pigri, che
+verrebbero valutati più tardi nel thread sbagliato.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connections
+
+POOL_SIZE = 5        # gruppi al massimo per gather (match_detail)
+CONN_MAX_AGE = 300   # secondi di vita delle connessioni dei thread del pool
+
+
+@functools.cache
+def _executor():
+    # Creato al primo uso: nessun thread nel master di gunicorn prima del fork
+    return ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='gather')
+
+
+def _persistent_connections():
+    """ Connessioni del thread corrente con CONN_MAX_AGE del pool (i settings sono condivisi: si copia il dict). """
+    for alias in connections:
+        conn = connections[alias]
+        if conn.settings_dict.get('CONN_MAX_AGE') != CONN_MAX_AGE:
+            conn.settings_dict = dict(conn.settings_dict, CONN_MAX_AGE=CONN_MAX_AGE)
+
+
+def _in_worker(group):
+    def run():
+        _persistent_connections()
+        # Come Django a inizio/fine richiesta: chiude solo connessioni scadute o inutilizzabili
+        close_old_connections()
+        try:
+            return group()
+        finally:
+            close_old_connections()
+    return run
+
+
+async def gather(*groups):
+    """ Risultati dei gruppi (nello stesso ordine), eseguiti in parallelo. """
+    return await asyncio.gather(*(
+        sync_to_async(_in_worker(group), thread_sensitive=False, executor=_executor())() for group in groups
+    ))
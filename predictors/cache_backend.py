@@ -0,0 +1,333 @@
+"""
+Cache a due livelli: LRU in memoria del processo davanti alla DatabaseCache.
+
+- Livello locale: per processo (condiviso tra i thread), limitato a
+  LOCAL_MAX_ENTRIES voci e con durata massima LOCAL_TIMEOUT secondi.
+  I valori sono conservati serializzati (come LocMemCache): chi modifica
+  l'oggetto letto non altera la copia in cache.
+- Livello condiviso: la tabella della DatabaseCache (web, worker Django-Q e
+  comandi vedono gli stessi dati). Il backend è una sottoclasse di
+  DatabaseCache, quindi createcachetable e la configurazione restano gli stessi.
+- Invalidazione tra processi: ogni scrittura (set/add/delete/clear) aggiorna
+  nel livello condiviso un contatore di versione per il prefisso della chiave
+  ('match_detail:12' -> 'match_detail'). Il nuovo valore è sempre maggiore di
+  quello letto prima della scrittura e viene riletto dopo: se nel frattempo un
+  altro processo ha aggiornato lo stesso prefisso, le voci locali del prefisso
+  vengono scartate. Ogni processo confronta i contatori dei prefissi che tiene
+  in memoria al massimo ogni SYNC_INTERVAL secondi (una query) e scarta le voci
+  dei prefissi cambiati.
+- Le copie locali dei valori letti dal livello condiviso non durano oltre la
+  scadenza della voce nella tabella.
+- Statistiche per prefisso (hit locali, hit condivisi, miss) in cache.stats().
+
+Configurazione (settings.CACHES['default']['OPTIONS']):
+LOCAL_MAX_ENTRIES, LOCAL_TIMEOUT, SYNC_INTERVAL.
+"""
+import base64
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connections, models, router
+from django.utils.timezone import now as tz_now
+
+VERSION_KEY_PREFIX = '_tier_version:'
+ALL_PREFIXES = '*'  # contatore aggiornato da clear(): invalida tutto il livello locale
+
+# Livelli locali del processo, uno per LOCATION (le istanze del backend sono per thread)
+_local_tiers = {}
+_local_tiers_lock = threading.Lock()
+
+
+def key_prefix(key):
+    """ Prefisso usato per versioni e statistiche: la parte prima del primo ':'. """
+    return str(key).split(':', 1)[0]
+
+
+class LocalTier:
+    """ LRU/TTL in memoria con i contatori di versione noti e le statistiche per prefisso. """
+
+    def __init__(self, max_entries, timeout, sync_interval):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.sync_interval = sync_interval
+        self.entries = OrderedDict()  # chiave completa -> (prefisso, scadenza, valore serializzato)
+        self.versions = {}            # prefisso -> versione letta dal livello condiviso
+        self.counters = {}            # prefisso -> {'local': n, 'shared': n, 'miss': n}
+        self.last_sync = 0.0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ (True, valore) se la voce è presente e non scaduta, altrimenti (False, None). """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[1] <= time.monotonic():
+                del self.entries[key]
+                return False, None
+            self.entries.move_to_end(key)
+            data = entry[2]
+        return True, pickle.loads(data)
+
+    def put(self, key, prefix, value, timeout):
+        if timeout is not None and timeout <= 0:
+            self.discard(key)
+            return
+        timeout = self.timeout if timeout is None else min(timeout, self.timeout)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (prefix, time.monotonic() + timeout, data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def drop_prefixes(self, prefixes):
+        with self.lock:
+            for key in [k for k, entry in self.entries.items() if entry[0] in prefixes]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def count(self, prefix, outcome, n=1):
+        with self.lock:
+            counters = self.counters.setdefault(prefix, {'local': 0, 'shared': 0, 'miss': 0})
+            counters[outcome] += n
+
+    def stats(self):
+        with self.lock:
+            rows = {prefix: dict(c) for prefix, c in self.counters.items()}
+            size = len(self.entries)
+        for c in rows.values():
+            total = c['local'] + c['shared'] + c['miss']
+            c['hit_rate'] = round(100.0 * (c['local'] + c['shared']) / total, 1) if total else 0.0
+        return {'entries': size, 'max_entries': self.max_entries, 'prefixes': rows}
+
+
+class TieredDatabaseCache(DatabaseCache):
+    """ DatabaseCache con un livello LRU locale davanti (vedi docstring del modulo). """
+
+    def __init__(self, table, params):
+        super().__init__(table, params)
+        options = params.get('OPTIONS', {})
+        with _local_tiers_lock:
+            tier = _local_tiers.get(table)
+            if tier is None:
+                tier = _local_tiers[table] = LocalTier(
+                    max_entries=int(options.get('LOCAL_MAX_ENTRIES', 500)),
+                    timeout=float(options.get('LOCAL_TIMEOUT', 60)),
+                    sync_interval=float(options.get('SYNC_INTERVAL', 2)),
+                )
+        self._local = tier
+
+    # ------------------------------------------------------------------
+    # Versioni per prefisso
+    # ------------------------------------------------------------------
+
+    def _read_versions(self, prefixes):
+        """ Versioni correnti dei prefissi nel livello condiviso (una query). """
+        keys = [VERSION_KEY_PREFIX + p for p in prefixes]
+        found = super().get_many(keys)
+        return {p: found.get(VERSION_KEY_PREFIX + p) for p in prefixes}
+
+    def _bump(self, prefixes):
+        """
+        Nuova versione per i prefissi scritti: gli altri processi scarteranno le proprie copie.
+        La versione scritta supera quella letta (mai un passo indietro per orologi diversi) e
+        viene riletta: se il prefisso era già stato aggiornato da un altro processo (prima
+        della lettura o tra scrittura e rilettura) le voci locali del prefisso non sono più
+        affidabili e vengono scartate.
+        """
+        prefixes = list(prefixes)
+        tier = self._local
+        before = self._read_versions(prefixes)
+        written = {}
+        for prefix in prefixes:
+            written[prefix] = max(time.time_ns(), (before[prefix] or 0) + 1)
+            super().set(VERSION_KEY_PREFIX + prefix, written[prefix], None)
+        after = self._read_versions(prefixes)
+
+        with tier.lock:
+            stale = {
+                prefix for prefix in prefixes
+                if before[prefix] != tier.versions.get(prefix) or after[prefix] != written[prefix]
+            }
+            for prefix in prefixes:
+                tier.versions[prefix] = after[prefix]
+        if ALL_PREFIXES in stale:
+            tier.clear()
+        elif stale:
+            tier.drop_prefixes(stale)
+
+    def _sync(self):
+        """ Al massimo ogni sync_interval: scarta le voci dei prefissi aggiornati da altri processi. """
+        tier = self._local
+        now = time.monotonic()
+        with tier.lock:
+            if now - tier.last_sync < tier.sync_interval or not tier.versions:
+                return
+            tier.last_sync = now
+            known = dict(tier.versions)
+
+        current = self._read_versions(list(set(known) | {ALL_PREFIXES}))
+        if current[ALL_PREFIXES] != known.get(ALL_PREFIXES):
+            tier.clear()
+            changed = set(current)
+        else:
+            changed = {p for p, v in known.items() if current[p] != v}
+            tier.drop_prefixes(changed)
+        with tier.lock:
+            for prefix in changed:
+                tier.versions[prefix] = current[prefix]
+
+    def _track(self, prefixes):
+        """ Registra la versione iniziale dei prefissi non ancora visti (prima di leggere i valori). """
+        with self._local.lock:
+            missing = [p for p in prefixes if p not in self._local.versions]
+            if ALL_PREFIXES not in self._local.versions:
+                missing.append(ALL_PREFIXES)
+        if missing:
+            versions = self._read_versions(missing)
+            with self._local.lock:
+                for prefix in missing:
+                    self._local.versions.setdefault(prefix, versions[prefix])
+
+    # ------------------------------------------------------------------
+    # API della cache
+    # ------------------------------------------------------------------
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        if not keys:
+            return {}
+        self._sync()
+
+        result = {}
+        remaining = []
+        for key in keys:
+            full_key = self.make_and_validate_key(key, version=version)
+            found, value = self._local.get(full_key)
+            if found:
+                result[key] = value
+                self._local.count(key_prefix(key), 'local')
+            else:
+                remaining.append(key)
+
+        if remaining:
+            self._track({key_prefix(key) for key in remaining})
+            shared = self._get_many_with_expiry(remaining, version)
+            now = tz_now()
+            for key in remaining:
+                prefix = key_prefix(key)
+                if key in shared:
+                    value, expires = shared[key]
+                    result[key] = value
+                    # La copia locale non sopravvive alla voce condivisa
+                    self._local.put(self.make_and_validate_key(key, version=version), prefix, value, (expires - now).total_seconds())
+                    self._local.count(prefix, 'shared')
+                else:
+                    self._local.count(prefix, 'miss')
+        return result
+
+    def has_key(self, key, version=None):
+        found, _ = self._local.get(self.make_and_validate_key(key, version=version))
+        return found or super().has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        super().set(key, value, timeout, version=version)
+        self._written(key, version, value, timeout)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = super().add(key, value, timeout, version=version)
+        if added:
+            self._written(key, version, value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        # La scadenza locale verrebbe solo allungata: basta riprendere il valore dal livello condiviso
+        self._local.discard(self.make_and_validate_key(key, version=version))
+        return super().touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        deleted = super().delete(key, version=version)
+        self._local.discard(self.make_and_validate_key(key, version=version))
+        self._bump({key_prefix(key)})
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        super().delete_many(keys, version=version)
+        for key in keys:
+            self._local.discard(self.make_and_validate_key(key, version=version))
+        self._bump({key_prefix(key) for key in keys})
+
+    def clear(self):
+        super().clear()
+        self._local.clear()
+        self._bump({ALL_PREFIXES})
+
+    def _written(self, key, version, value, timeout):
+        # Prima la versione (che può scartare le voci del prefisso), poi la copia locale del valore scritto
+        self._bump({key_prefix(key)})
+        self._local.put(self.make_and_validate_key(key, version=version), key_prefix(key), value, self._timeout_seconds(timeout))
+
+    def _get_many_with_expiry(self, keys, version):
+        """ Come DatabaseCache.get_many, ma restituisce {chiave: (valore, scadenza)}. """
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+
+        db = router.db_for_read(self.cache_model_class)
+        connection = connections[db]
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT %s, %s, %s FROM %s WHERE %s IN (%s)" % (
+                    quote_name('cache_key'), quote_name('value'), quote_name('expires'),
+                    quote_name(self._table), quote_name('cache_key'), ", ".join(["%s"] * len(key_map)),
+                ),
+                list(key_map),
+            )
+            rows = cursor.fetchall()
+
+        result = {}
+        expired_keys = []
+        expression = models.Expression(output_field=models.DateTimeField())
+        converters = connection.ops.get_db_converters(expression) + expression.get_db_converters(connection)
+        now = tz_now()
+        for cache_key, value, expires in rows:
+            for converter in converters:
+                expires = converter(expires, expression, connection)
+            if expires < now:
+                expired_keys.append(cache_key)
+            else:
+                value = pickle.loads(base64.b64decode(connection.ops.process_clob(value).encode()))
+                result[key_map[cache_key]] = (value, expires)
+        self._base_delete_many(expired_keys)
+        return result
+
+    def _timeout_seconds(self, timeout):
+        """ Timeout in secondi (None = senza scadenza), come lo interpreta la DatabaseCache. """
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return timeout
+
+    # ------------------------------------------------------------------
+    # Statistiche
+    # ------------------------------------------------------------------
+
+    def stats(self):
+        """ {'entries', 'max_entries', 'prefixes': {prefisso: {'local', 'shared', 'miss', 'hit_rate'}}} del processo. """
+        return self._local.stats()
+
+    def reset_stats(self):
+        with self._local.lock:
+            self._local.counters.clear()
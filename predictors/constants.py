@@ -66,3 +66,36 @@ DEFAULT_MARKET_CONFIG = {
         'reference_line': 3.5
     },
 }
+
+
+# --- TRAINING SET (train_model / training_set / training_scheduler) ---
+# Feature per lato: nome colonna (senza prefisso home_/away_) -> campo TeamFormSnapshot
+SNAPSHOT_FEATURES = [
+    ('last_5_pts', 'last_5_matches_points'),
+    ('rest_days', 'rest_days'),
+    ('elo', 'elo_rating'),
+    ('avg_xg', 'avg_xg_last_5'),
+    ('avg_gf', 'avg_goals_scored_last_5'),
+    ('avg_ga', 'avg_goals_conceded_last_5'),
+    ('xg_ratio', 'xg_ratio_last_5'),
+    ('eff_att', 'efficiency_attack_last_5'),
+    ('eff_def', 'efficiency_defense_last_5'),
+    ('volatility', 'goal_volatility_last_5'),
+    ('is_derby', 'is_derby'),
+    ('pressure_index', 'pressure_index'),
+    ('starters_xg', 'starters_avg_xg_last_5'),
+    ('league_position', 'league_position'),
+    ('points_gap_top', 'points_gap_top'),
+]
+
+# Stesso ordine di colonne del DataFrame di training (e di predict_upcoming)
+FEATURE_COLUMNS = ['match_hour', 'match_dayofweek', 'match_month'] + [
+    f"{side}_{name}" for side in ('home', 'away') for name, _ in SNAPSHOT_FEATURES
+]
+
+TARGET_COLUMNS = [
+    'home_goals', 'home_possession', 'home_total_shots', 'home_shots_on_target', 'home_corners',
+    'home_fouls', 'home_yellow_cards', 'home_offsides',
+    'away_goals', 'away_possession', 'away_total_shots', 'away_shots_on_target', 'away_corners',
+    'away_fouls', 'away_yellow_cards', 'away_offsides'
+]
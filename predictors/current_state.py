@@ -0,0 +1,184 @@
+"""
+Stato corrente di squadre e campionato (TeamCurrentState, LeagueState).
+
+Dashboard, dettaglio partita, pagina squadra, control room e predict_upcoming
+ricalcolavano ognuno gli stessi fatti 'correnti' (ultimo ELO, forma, prossima
+partita, giornata da giocare) con query sullo storico. Qui vengono calcolati
+una volta e salvati nella stessa transazione di chi li cambia:
+- salvataggio o eliminazione di una partita o di un risultato (segnali di Match e
+  MatchResult): le due squadre e la giornata corrente;
+- ricalcolo ELO e feature: tutte le squadre.
+Negli import massivi CurrentState.deferred() raggruppa le squadre toccate in un
+solo ricalcolo. Le letture sono per chiave primaria.
+"""
+import threading
+from contextlib import contextmanager
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Value, Window
+from django.db.models.functions import Coalesce, RowNumber
+from predictors.models import LeagueState, TeamCurrentState
+
+DEFAULT_ELO = 1500.0
+FORM_LENGTH = 5
+
+# Esito per la squadra dal vincitore della partita: (casa, trasferta)
+OUTCOMES = {'1': ('W', 'L'), 'X': ('D', 'D'), '2': ('L', 'W')}
+
+
+def recent_forms(Match, team_ids):
+    """
+    {team_id: forma} sulle ultime FORM_LENGTH partite giocate nella stagione dell'ultima
+    partita (W/D/L, Newest->Oldest, come calculate_advanced_metrics), in due query:
+    le ultime FORM_LENGTH per squadra in casa e in trasferta (numerate con una window function).
+    """
+    played = {}
+    for side, field in enumerate(('home_team_id', 'away_team_id')):
+        rows = Match.objects.filter(
+            **{f'{field}__in': team_ids}, status='FINISHED', result__isnull=False
+        ).annotate(
+            recent=Window(RowNumber(), partition_by=F(field), order_by=(F('date_time').desc(), F('id').desc()))
+        ).filter(recent__lte=FORM_LENGTH).values_list(field, 'date_time', 'id', 'season_id', 'result__winner')
+        for team_id, date_time, match_id, season_id, winner in rows:
+            outcome = OUTCOMES.get(winner, ('', ''))[side]
+            played.setdefault(team_id, []).append(((date_time, match_id), season_id, outcome))
+
+    forms = {}
+    for team_id, entries in played.items():
+        entries.sort(reverse=True)
+        season_id = entries[0][1]
+        forms[team_id] = "".join(outcome for _, s, outcome in entries if s == season_id)[:FORM_LENGTH]
+    return forms
+
+
+def compute_states(registry, team_ids=None):
+    """
+    Stato corrente delle squadre (tutte se team_ids è None) e del campionato, in cinque query.
+    registry: registro dei modelli (django.apps.apps; la migrazione 0037 ne ha una copia congelata).
+    Restituisce ({team_id: {campo: valore}}, {campo: valore} per LeagueState).
+    """
+    Team = registry.get_model('predictors', 'Team')
+    Match = registry.get_model('predictors', 'Match')
+    TeamEloHistory = registry.get_model('predictors', 'TeamEloHistory')
+
+    teams = Team.objects.all()
+    if team_ids is not None:
+        teams = teams.filter(id__in=team_ids)
+
+    def team_matches(status, *order):
+        return Match.objects.filter(
+            Q(home_team=OuterRef('pk')) | Q(away_team=OuterRef('pk')), status=status
+        ).order_by(*order).values('id')[:1]
+
+    last_elo = TeamEloHistory.objects.filter(team=OuterRef('pk')).order_by('-date_time').values('elo_after')[:1]
+    rows = list(teams.annotate(
+        current_elo=Coalesce(Subquery(last_elo, output_field=FloatField()), Value(DEFAULT_ELO)),
+        last_id=Subquery(team_matches('FINISHED', '-date_time', '-id')),
+        next_id=Subquery(team_matches('SCHEDULED', 'date_time', 'id')),
+    ).values_list('id', 'current_elo', 'last_id', 'next_id'))
+
+    match_ids = {match_id for row in rows for match_id in row[2:] if match_id}
+    dates = dict(Match.objects.filter(id__in=match_ids).values_list('id', 'date_time'))
+    forms = recent_forms(Match, [row[0] for row in rows])
+
+    states = {}
+    for team_id, elo, last_id, next_id in rows:
+        states[team_id] = {
+            'elo': elo,
+            'form_sequence': forms.get(team_id, ""),
+            'last_match_id': last_id,
+            'last_match_date': dates.get(last_id),
+            'next_match_id': next_id,
+            'next_match_date': dates.get(next_id),
+        }
+
+    # Stessa definizione usata finora da dashboard e predict_upcoming: la prima partita programmata
+    next_match = Match.objects.filter(status='SCHEDULED').order_by('date_time', 'id').values(
+        'id', 'season_id', 'round_number', 'date_time'
+    ).first() or {}
+    league = {
+        'season_id': next_match.get('season_id'),
+        'current_round': next_match.get('round_number'),
+        'next_match_id': next_match.get('id'),
+        'next_match_date': next_match.get('date_time'),
+    }
+    return states, league
+
+
+class CurrentState:
+    """ Aggiornamento di TeamCurrentState e LeagueState. """
+
+    _state = threading.local()
+
+    @classmethod
+    def on_result_saved(cls, match):
+        """ Le due squadre della partita (forma, ultima/prossima partita) e la giornata corrente. """
+        cls._touch([match.home_team_id, match.away_team_id])
+
+    @classmethod
+    def on_match_saved(cls, match):
+        """ Partita creata, riprogrammata, rinviata o eliminata: prossima/ultima partita e giornata corrente. """
+        cls._touch([match.home_team_id, match.away_team_id])
+
+    @classmethod
+    def _touch(cls, team_ids):
+        pending = getattr(cls._state, 'pending', None)
+        if pending is not None:
+            pending.update(team_ids)
+            return
+        cls.update(team_ids)
+
+    @classmethod
+    @contextmanager
+    def deferred(cls):
+        """ Import massivi: un solo ricalcolo all'uscita per tutte le squadre toccate nel blocco. """
+        if getattr(cls._state, 'pending', None) is not None:
+            yield
+            return
+        cls._state.pending = set()
+        try:
+            yield
+        finally:
+            pending, cls._state.pending = cls._state.pending, None
+            if pending:
+                cls.update(pending)
+
+    @classmethod
+    def update(cls, team_ids=None):
+        """ Ricalcola e salva le righe delle squadre indicate (tutte se None). Restituisce il numero di righe. """
+        states, league = compute_states(apps, team_ids)
+        with transaction.atomic():
+            stale = TeamCurrentState.objects.all()
+            if team_ids is not None:
+                stale = stale.filter(team_id__in=team_ids)
+            stale.delete()
+            TeamCurrentState.objects.bulk_create([
+                TeamCurrentState(team_id=team_id, **fields) for team_id, fields in states.items()
+            ])
+            LeagueState.objects.update_or_create(pk=1, defaults=league)
+        return len(states)
+
+
+def league_state():
+    """ Riga dello stato del campionato (None se mai calcolato). """
+    return LeagueState.objects.filter(pk=1).first()
+
+
+def current_round():
+    """ (season_id, giornata) della prossima giornata da giocare, o None. """
+    league = league_state()
+    if league is None or league.current_round is None:
+        return None
+    return league.season_id, league.current_round
+
+
+def team_state(team_id):
+    """ Stato corrente della squadra con la prossima partita (una query), None se assente. """
+    return TeamCurrentState.objects.select_related(
+        'next_match__home_team', 'next_match__away_team'
+    ).filter(team_id=team_id).first()
+
+
+def form_sequences(team_ids):
+    """ {team_id: form_sequence} delle squadre indicate, in una query. """
+    return dict(TeamCurrentState.objects.filter(team_id__in=team_ids).values_list('team_id', 'form_sequence'))
@@ -0,0 +1,24 @@
+"""
+Semaforo di completezza dei dati di una partita (funzione pura).
+
+Usata da MatchResult.save() per salvare stato e metriche mancanti sul
+risultato (la migrazione 0035 ne ha una copia congelata).
+"""
+
+# Statistiche avanzate controllate (in entrambi i JSON casa/ospite)
+KEY_METRICS = ('xg', 'possession', 'corner', 'falli')
+
+
+def data_completeness(home_stats, away_stats):
+    """
+    (colore, metriche mancanti) di un risultato: 'green' se tutte le KEY_METRICS
+    sono valorizzate per entrambe le squadre, altrimenti 'yellow' (risultato base presente).
+    Una metrica nulla o a zero conta come mancante (spesso indica dato non scaricato).
+    """
+    missing = 0
+    for source in (home_stats or {}, away_stats or {}):
+        for key in KEY_METRICS:
+            value = source.get(key)
+            if not value or float(value) == 0:
+                missing += 1
+    return ('green', 0) if missing == 0 else ('yellow', missing)
@@ -0,0 +1,18 @@
+"""
+Chiave in cache del contesto di match_detail (MatchDetailAssembler).
+
+Sta in un modulo a sé perché la invalidano anche i motori di calcolo
+(feature, ELO, predict_upcoming), che scrivono in bulk senza segnali e non
+devono dipendere dai servizi delle viste.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+CACHE_KEY = 'match_detail:{}'
+
+
+def invalidate_match_detail(match_ids):
+    """ Elimina il contesto in cache delle partite indicate (dopo il commit). """
+    keys = [CACHE_KEY.format(match_id) for match_id in match_ids if match_id]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,195 @@
+import logging
+from django.db import transaction
+from django.db.models import F, FloatField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+from predictors.models import Match, Team, TeamFormSnapshot, TeamEloHistory
+from predictors.elo_index import EloTimeline
+from predictors.current_state import CurrentState
+from predictors.detail_cache import invalidate_match_detail
+
+logger = logging.getLogger(__name__)
+
+
+class EloEngine:
+    """
+    Calcolo incrementale del Rating ELO.
+
+    Lo storico dei rating vive in TeamEloHistory (una riga per squadra per
+    partita). Ogni esecuzione riparte dall'ultima partita elaborata e rigioca
+    solo da lì in avanti; se un risultato già elaborato è stato corretto (o è
+    arrivata una partita con data precedente all'ultima elaborata), lo storico
+    viene troncato a quella data e ricalcolato. Il risultato è identico a un
+    ricalcolo completo da 1500.
+    """
+
+    DEFAULT_ELO = 1500.0
+    K_FACTOR = 30  # Quanto velocemente cambia il rating (30 è standard calcio)
+    BATCH_SIZE = 500
+
+    def __init__(self, from_date=None, full=False):
+        self.from_date = from_date
+        self.full = full
+
+    # ------------------------------------------------------------------
+    # Punto di ripartenza
+    # ------------------------------------------------------------------
+
+    def find_restart_date(self):
+        """
+        Data da cui rigiocare. None = solo le partite nuove dopo l'ultima elaborata.
+        """
+        candidates = []
+        if self.from_date is not None:
+            candidates.append(self.from_date)
+
+        # Risultati corretti (o partite non più valide) dopo l'elaborazione
+        stale = TeamEloHistory.objects.filter(
+            ~Q(match__status='FINISHED') | Q(match__result__isnull=True) | ~Q(winner=F('match__result__winner'))
+        ).order_by('date_time').values_list('date_time', flat=True).first()
+        if stale is not None:
+            candidates.append(stale)
+
+        # Partite entrate in archivio con data precedente all'ultima elaborata (recuperi)
+        last_processed = TeamEloHistory.objects.order_by('-date_time').values_list('date_time', flat=True).first()
+        if last_processed is not None:
+            late = self._finished_matches().filter(
+                date_time__lte=last_processed, elo_history__isnull=True
+            ).order_by('date_time').values_list('date_time', flat=True).first()
+            if late is not None:
+                candidates.append(late)
+
+        return min(candidates) if candidates else None
+
+    @staticmethod
+    def _finished_matches():
+        return Match.objects.filter(status='FINISHED', result__isnull=False)
+
+    def _starting_ratings(self, restart_date):
+        """ Rating di ogni squadra subito prima di restart_date, letti dallo storico (una query). """
+        history = TeamEloHistory.objects.filter(team=OuterRef('pk'))
+        if restart_date is not None:
+            history = history.filter(date_time__lt=restart_date)
+        last_elo = history.order_by('-date_time').values('elo_after')[:1]
+
+        return dict(
+            Team.objects.annotate(
+                elo=Coalesce(Subquery(last_elo, output_field=FloatField()), Value(self.DEFAULT_ELO))
+            ).values_list('id', 'elo')
+        )
+
+    # ------------------------------------------------------------------
+    # Calcolo
+    # ------------------------------------------------------------------
+
+    def run(self):
+        """
+        Aggiorna storico e snapshot. Restituisce {'matches', 'replay_from', 'snapshots'}.
+        'replay_from' è la data da cui lo storico è stato ricalcolato (None se solo partite nuove).
+        """
+        replay_from = None if self.full else self.find_restart_date()
+        truncate = self.full or replay_from is not None
+
+        matches = self._finished_matches()
+        if self.full:
+            team_elos = {}
+        elif replay_from is not None:
+            matches = matches.filter(date_time__gte=replay_from)
+            team_elos = self._starting_ratings(replay_from)
+        else:
+            last_processed = TeamEloHistory.objects.order_by('-date_time').values_list('date_time', flat=True).first()
+            if last_processed is not None:
+                matches = matches.filter(date_time__gt=last_processed)
+            team_elos = self._starting_ratings(None)
+
+        matches = list(matches.select_related('result').order_by('date_time', 'id'))
+
+        history_rows = []
+        for m in matches:
+            elo_home_before = team_elos.get(m.home_team_id, self.DEFAULT_ELO)
+            elo_away_before = team_elos.get(m.away_team_id, self.DEFAULT_ELO)
+            new_elo_home, new_elo_away = self.update_ratings(elo_home_before, elo_away_before, m.result.winner)
+
+            history_rows.append(TeamEloHistory(
+                team_id=m.home_team_id, match=m, date_time=m.date_time,
+                elo_before=elo_home_before, elo_after=new_elo_home, winner=m.result.winner
+            ))
+            history_rows.append(TeamEloHistory(
+                team_id=m.away_team_id, match=m, date_time=m.date_time,
+                elo_before=elo_away_before, elo_after=new_elo_away, winner=m.result.winner
+            ))
+
+            team_elos[m.home_team_id] = new_elo_home
+            team_elos[m.away_team_id] = new_elo_away
+
+        with transaction.atomic():
+            if truncate:
+                stale = TeamEloHistory.objects.all()
+                if replay_from is not None:
+                    stale = stale.filter(date_time__gte=replay_from)
+                stale.delete()
+            TeamEloHistory.objects.bulk_create(history_rows, batch_size=self.BATCH_SIZE)
+            snapshots = self.sync_snapshots([m.id for m in matches])
+            # ELO attuale nello stato corrente delle squadre
+            CurrentState.update()
+
+        if history_rows or snapshots:
+            EloTimeline.invalidate()
+
+        return {'matches': len(matches), 'replay_from': replay_from, 'snapshots': snapshots}
+
+    @classmethod
+    def update_ratings(cls, elo_home_before, elo_away_before, winner):
+        """ Nuovi rating (casa, trasferta) dopo il risultato. """
+        # Risultato reale (1=win, 0.5=draw, 0=loss)
+        if winner == '1':
+            score_home, score_away = 1, 0
+        elif winner == 'X':
+            score_home, score_away = 0.5, 0.5
+        else:  # '2'
+            score_home, score_away = 0, 1
+
+        # Aspettativa matematica (Formula ELO standard)
+        expected_home = 1 / (1 + 10 ** ((elo_away_before - elo_home_before) / 400))
+        expected_away = 1 / (1 + 10 ** ((elo_home_before - elo_away_before) / 400))
+
+        return (
+            elo_home_before + cls.K_FACTOR * (score_home - expected_home),
+            elo_away_before + cls.K_FACTOR * (score_away - expected_away),
+        )
+
+    @classmethod
+    def sync_snapshots(cls, match_ids):
+        """
+        Allinea TeamFormSnapshot.elo_rating all'ELO pre-partita dello storico per le
+        partite indicate (rigiocate da run() o riscritte da calculate_features).
+        Una query per blocco di partite per trovare gli snapshot disallineati e un bulk_update.
+        """
+        elo_before = TeamEloHistory.objects.filter(
+            match=OuterRef('match'), team=OuterRef('team')
+        ).values('elo_before')[:1]
+
+        match_ids = list(match_ids)
+        stale = []
+        for i in range(0, len(match_ids), cls.BATCH_SIZE):
+            stale.extend(
+                TeamFormSnapshot.objects.filter(match_id__in=match_ids[i:i + cls.BATCH_SIZE]).annotate(
+                    history_elo=Subquery(elo_before, output_field=FloatField())
+                ).filter(history_elo__isnull=False).exclude(elo_rating=F('history_elo')).only('id', 'match_id', 'elo_rating')
+            )
+        for snap in stale:
+            snap.elo_rating = snap.history_elo
+
+        TeamFormSnapshot.objects.bulk_update(stale, ['elo_rating'], batch_size=cls.BATCH_SIZE)
+        # bulk_update non invia segnali: il contesto in cache di match_detail va scartato qui
+        invalidate_match_detail({snap.match_id for snap in stale})
+        return len(stale)
+
+    @classmethod
+    def top_teams(cls, limit=5):
+        """ Classifica per ELO attuale (una query). """
+        last_elo = TeamEloHistory.objects.filter(team=OuterRef('pk')).order_by('-date_time').values('elo_after')[:1]
+        return list(
+            Team.objects.annotate(
+                current_elo=Coalesce(Subquery(last_elo, output_field=FloatField()), Value(cls.DEFAULT_ELO))
+            ).order_by('-current_elo')[:limit]
+        )
@@ -0,0 +1,82 @@
+import bisect
+import threading
+import time
+from django.core.cache import cache
+from predictors.models import TeamFormSnapshot
+
+
+class EloTimeline:
+    """
+    Indice temporale dei rating ELO per squadra, costruito dai TeamFormSnapshot.
+
+    Per ogni squadra tiene due array ordinati (date, rating) e risponde a
+    "rating della squadra T subito prima di t" con una ricerca binaria,
+    invece di una query TeamFormSnapshot ... .first() per ogni lookup.
+
+    L'istanza condivisa (get()) viene costruita una volta per processo e
+    ricostruita quando cambia la versione in cache (invalidate(), chiamato da
+    calculate_elo e da chi scrive snapshot).
+    """
+
+    VERSION_KEY = 'elo_timeline_version'
+    CHECK_INTERVAL = 30  # secondi tra due controlli della versione condivisa
+
+    _shared = None
+    _shared_version = None
+    _last_check = 0.0
+    _lock = threading.Lock()
+
+    def __init__(self, rows=()):
+        self.dates = {}
+        self.ratings = {}
+        for team_id, date, rating in rows:
+            self.dates.setdefault(team_id, []).append(date)
+            self.ratings.setdefault(team_id, []).append(rating)
+
+    @classmethod
+    def build(cls):
+        """ Nuova istanza privata (una query). """
+        rows = TeamFormSnapshot.objects.order_by('team_id', 'match__date_time').values_list('team_id', 'match__date_time', 'elo_rating')
+        return cls(rows.iterator())
+
+    @classmethod
+    def get(cls):
+        """ Istanza condivisa del processo, ricostruita se la versione in cache è cambiata. """
+        now = time.monotonic()
+        with cls._lock:
+            if cls._shared is not None and now - cls._last_check < cls.CHECK_INTERVAL:
+                return cls._shared
+
+            version = cache.get(cls.VERSION_KEY)
+            if cls._shared is None or version != cls._shared_version:
+                cls._shared = cls.build()
+                cls._shared_version = version
+            cls._last_check = now
+            return cls._shared
+
+    @classmethod
+    def invalidate(cls):
+        """ Scarta l'indice in questo processo e segnala agli altri processi di ricostruirlo. """
+        with cls._lock:
+            cls._shared = None
+            cls._shared_version = None
+        cache.set(cls.VERSION_KEY, time.time_ns(), None)
+
+    def rating_before(self, team_id, when):
+        """ ELO dell'ultimo snapshot della squadra strettamente prima di 'when' (None se assente). """
+        dates = self.dates.get(team_id)
+        if not dates:
+            return None
+        idx = bisect.bisect_left(dates, when)
+        return self.ratings[team_id][idx - 1] if idx > 0 else None
+
+    def set_rating(self, team_id, when, rating):
+        """ Inserisce o sostituisce il rating della squadra alla data 'when' (uso interno ai motori batch). """
+        dates = self.dates.setdefault(team_id, [])
+        ratings = self.ratings.setdefault(team_id, [])
+        idx = bisect.bisect_left(dates, when)
+        if idx < len(dates) and dates[idx] == when:
+            ratings[idx] = rating
+        else:
+            dates.insert(idx, when)
+            ratings.insert(idx, rating)
@@ -0,0 +1,538 @@
+import bisect
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import Count
+from predictors.models import Match, TeamFormSnapshot, Player, PlayerMatchStat, Rivalry
+from predictors.elo_engine import EloEngine
+from predictors.elo_index import EloTimeline
+from predictors.features import SNAPSHOT_FIELD_MAP, _assemble_features, _get_default_features
+from predictors.detail_cache import invalidate_match_detail
+from predictors.standings import StandingsTimeline
+from predictors.utils import select_probable_starters
+
+logger = logging.getLogger(__name__)
+
+SHARD_SIZE = 200          # partite per shard (le stagioni più lunghe vengono divise)
+SHARD_POLL_INTERVAL = 1.0  # secondi tra due controlli degli shard in coda su Django-Q
+
+
+class BatchFeatureEngine:
+    """
+    Ricalcolo massivo dei TeamFormSnapshot per le partite giocate.
+
+    Produce gli stessi valori di get_team_features_at_date(use_actual_starters=True),
+    ma carica partite, risultati, statistiche giocatori, snapshot e rivalità una
+    sola volta e poi scorre le partite in ordine cronologico tenendo in memoria
+    lo storico di ogni squadra. Scrive solo le righe i cui valori sono cambiati,
+    con bulk_create / bulk_update a blocchi.
+
+    L'unico legame tra una partita e le successive è la timeline ELO, che il
+    calcolo riscrive con l'ELO di ogni snapshot. Viene risolta prima, in un
+    passaggio sequenziale leggero (_resolve_elo): da lì ogni partita è
+    indipendente e il calcolo può essere diviso in shard (stagione, o blocchi di
+    SHARD_SIZE partite) eseguiti in parallelo da FeatureShards.
+    """
+
+    BATCH_SIZE = 500
+    FLOAT_TOLERANCE = 1e-9
+
+    def __init__(self, force=False, match_ids=None, replay_history=False):
+        self.force = force
+        self.match_ids = match_ids
+        # True: la timeline ELO viene rigiocata su tutte le partite con risultato fino
+        # all'ultima da calcolare, come in un ricalcolo completo (--force): un sottoinsieme
+        # di partite (ResultImpact) ottiene gli stessi valori di calculate_features --force
+        self.replay_history = replay_history
+
+    def get_target_matches(self):
+        """ Partite finite con risultato da (ri)calcolare, in ordine cronologico. """
+        matches_qs = Match.objects.filter(
+            status='FINISHED',
+            result__isnull=False
+        ).select_related('season', 'home_team', 'away_team', 'result').order_by('date_time')
+
+        if self.match_ids is not None:
+            matches_qs = matches_qs.filter(id__in=self.match_ids)
+
+        # Se non forziamo, solo le partite che non hanno ancora 2 snapshot
+        if not self.force:
+            matches_qs = matches_qs.annotate(
+                snapshot_count=Count('form_snapshots')
+            ).filter(snapshot_count__lt=2)
+
+        return list(matches_qs)
+
+    def run(self, progress=None, workers=1, shard_size=SHARD_SIZE):
+        """
+        Calcola e salva gli snapshot. progress(done, total) viene chiamato ogni 50 partite
+        (a ogni shard concluso se workers > 1).
+        workers > 1: shard in parallelo (FeatureShards), risultati uniti e scritti qui.
+        Restituisce un riepilogo {'matches', 'created', 'updated', 'unchanged', 'shards'}.
+        """
+        summary = {'matches': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'shards': 1}
+
+        targets = self.get_target_matches()
+        if not targets:
+            summary['shards'] = 0
+            return summary
+
+        self._load_history(targets)
+        self.elo_timeline = EloTimeline.build()
+        self.resolved_elo = self._resolve_elo(self._replay_matches(targets))
+
+        shards = FeatureShards(workers, shard_size)
+        if shards.workers > 1 and len(targets) > shard_size:
+            results = shards.run(targets, self.elo_timeline, self.resolved_elo, progress)
+        else:
+            self._load_details(targets)
+            results = [self.compute_rows(targets, progress)]
+
+        rows = []
+        for result in results:
+            rows.extend(result['rows'])
+            for key in ('matches', 'created', 'updated', 'unchanged'):
+                summary[key] += result[key]
+        summary['shards'] = len(results)
+
+        self._write(rows)
+        return summary
+
+    def compute_rows(self, targets, progress=None):
+        """
+        Feature delle partite indicate confrontate con gli snapshot esistenti, senza scritture.
+        Restituisce {'rows': [(match_id, team_id, snapshot_id|None, valori)], 'matches', 'created', 'updated', 'unchanged'}
+        con le sole righe da creare o aggiornare.
+        """
+        result = {'rows': [], 'matches': 0, 'created': 0, 'updated': 0, 'unchanged': 0}
+        total = len(targets)
+
+        for match in targets:
+            for team in (match.home_team, match.away_team):
+                feats = self.compute_features(match, team)
+                snapshot = self.snapshots.get((match.id, team.id))
+                values, status = self._changes(snapshot, feats)
+                if status != 'unchanged':
+                    result['rows'].append((match.id, team.id, snapshot.pk if snapshot else None, values))
+                result[status] += 1
+
+            result['matches'] += 1
+            if progress and result['matches'] % 50 == 0:
+                progress(result['matches'], total)
+
+        return result
+
+    def _write(self, rows):
+        to_create, to_update = [], []
+        for match_id, team_id, snapshot_id, values in rows:
+            snapshot = TeamFormSnapshot(id=snapshot_id, match_id=match_id, team_id=team_id, **values)
+            (to_update if snapshot_id else to_create).append(snapshot)
+
+        with transaction.atomic():
+            TeamFormSnapshot.objects.bulk_create(to_create, batch_size=self.BATCH_SIZE)
+            TeamFormSnapshot.objects.bulk_update(to_update, list(SNAPSHOT_FIELD_MAP.values()), batch_size=self.BATCH_SIZE)
+            # elo_rating è di calculate_elo: gli snapshot riscritti tornano all'ELO dello storico
+            EloEngine.sync_snapshots({match_id for match_id, _, _, _ in rows})
+            # bulk_create / bulk_update non inviano segnali: il contesto di match_detail va scartato qui
+            invalidate_match_detail({match_id for match_id, _, _, _ in rows})
+
+        if rows:
+            EloTimeline.invalidate()
+
+    # ------------------------------------------------------------------
+    # Caricamento dati
+    # ------------------------------------------------------------------
+
+    def _load(self, targets, elo_timeline=None):
+        self._load_history(targets)
+        self._load_details(targets)
+        self.elo_timeline = elo_timeline if elo_timeline is not None else EloTimeline.build()
+
+    def _load_history(self, targets):
+        last_date = targets[-1].date_time
+
+        # 1. Storico partite finite (tutte le stagioni: H2H e formazioni probabili non si fermano alla stagione)
+        history = Match.objects.filter(
+            status='FINISHED',
+            date_time__lt=last_date
+        ).select_related('result', 'home_team', 'away_team').order_by('date_time')
+
+        self.season_timeline = {}   # (team_id, season_id) -> [Match] Oldest->Newest
+        self.team_timeline = {}     # team_id -> [Match] Oldest->Newest, tutte le stagioni
+        self.pair_timeline = {}     # (team_id, team_id) -> [Match] Oldest->Newest
+        for m in history:
+            for team_id in (m.home_team_id, m.away_team_id):
+                self.season_timeline.setdefault((team_id, m.season_id), []).append(m)
+                self.team_timeline.setdefault(team_id, []).append(m)
+            self.pair_timeline.setdefault(self._pair_key(m.home_team_id, m.away_team_id), []).append(m)
+
+        self.season_dates = {k: [m.date_time for m in v] for k, v in self.season_timeline.items()}
+        self.team_dates = {k: [m.date_time for m in v] for k, v in self.team_timeline.items()}
+        self.pair_dates = {k: [m.date_time for m in v] for k, v in self.pair_timeline.items()}
+
+    def _load_details(self, targets):
+        first_date = targets[0].date_time
+        last_date = targets[-1].date_time
+
+        # 2. Statistiche giocatori (titolari effettivi + storico xG degli ultimi 90 giorni)
+        stats = PlayerMatchStat.objects.filter(
+            match__date_time__gte=first_date - timedelta(days=90),
+            match__date_time__lte=last_date
+        ).order_by('id').values_list('player_id', 'match_id', 'team_id', 'is_starter', 'xg', 'match__date_time')
+
+        self.starters = {}      # (match_id, team_id) -> [player_id]
+        player_history = {}     # player_id -> [(date, xg)]
+        for player_id, match_id, team_id, is_starter, xg, date in stats:
+            if is_starter:
+                self.starters.setdefault((match_id, team_id), []).append(player_id)
+            player_history.setdefault(player_id, []).append((date, xg))
+
+        self.player_dates = {}
+        self.player_xg = {}
+        for player_id, rows in player_history.items():
+            rows.sort(key=lambda r: r[0])
+            self.player_dates[player_id] = [r[0] for r in rows]
+            self.player_xg[player_id] = [r[1] for r in rows]
+
+        # 2b. Formazione probabile di chi non ha titolari registrati (fallback di compute_features)
+        self.probable_starters = self._load_probable_starters(targets)
+
+        # 3. Snapshot esistenti da aggiornare
+        target_ids = {m.id for m in targets}
+        self.snapshots = {
+            (snap.match_id, snap.team_id): snap
+            for snap in TeamFormSnapshot.objects.filter(match__status='FINISHED', match__date_time__gte=first_date, match__date_time__lte=last_date)
+            if snap.match_id in target_ids
+        }
+
+        # 4. Rivalità (stessa priorità di .first(): pk più basso)
+        self.rivalries = {}
+        for r in Rivalry.objects.order_by('pk'):
+            self.rivalries.setdefault(self._pair_key(r.team1_id, r.team2_id), r.intensity)
+
+        # 5. Classifica alla data delle stagioni coinvolte (una query)
+        self.standings = StandingsTimeline.for_seasons({m.season_id for m in targets})
+
+    def _load_probable_starters(self, targets):
+        """
+        Come get_probable_starters per ogni (partita, squadra) senza titolari effettivi,
+        con due query in tutto: minuti delle ultime 3 partite della squadra e giocatori disponibili.
+        """
+        recent = {}  # (match_id, team_id) -> [match_id] ultime 3 partite finite della squadra
+        for match in targets:
+            for team_id in (match.home_team_id, match.away_team_id):
+                if (match.id, team_id) not in self.starters:
+                    end = bisect.bisect_left(self.team_dates.get(team_id, []), match.date_time)
+                    recent[(match.id, team_id)] = [m.id for m in self.team_timeline.get(team_id, [])[max(0, end - 3):end]]
+        if not recent:
+            return {}
+
+        minutes = {}  # (match_id, team_id) -> [(player_id, minuti)]
+        for match_id, team_id, player_id, mins in PlayerMatchStat.objects.filter(
+            match_id__in={match_id for ids in recent.values() for match_id in ids}
+        ).values_list('match_id', 'team_id', 'player_id', 'minutes'):
+            minutes.setdefault((match_id, team_id), []).append((player_id, mins))
+
+        available = Player.objects.filter(
+            id__in={player_id for rows in minutes.values() for player_id, _ in rows}, status='AVAILABLE',
+        ).only('id', 'primary_position').in_bulk()
+
+        probable = {}
+        for (match_id, team_id), match_ids in recent.items():
+            player_minutes = {}
+            for recent_id in match_ids:
+                for player_id, mins in minutes.get((recent_id, team_id), ()):
+                    player_minutes[player_id] = player_minutes.get(player_id, 0) + mins
+            players = [available[player_id] for player_id in sorted(player_minutes) if player_id in available]
+            probable[(match_id, team_id)] = select_probable_starters(player_minutes, players)
+        return probable
+
+    @staticmethod
+    def _pair_key(a, b):
+        return (a, b) if a < b else (b, a)
+
+    # ------------------------------------------------------------------
+    # Calcolo
+    # ------------------------------------------------------------------
+
+    def compute_features(self, match, team):
+        """ Equivalente in memoria di get_team_features_at_date(..., use_actual_starters=True). """
+        date_limit = match.date_time
+
+        # 1. Ultime 15 partite della stagione (Newest->Oldest)
+        key = (team.id, match.season_id)
+        timeline = self.season_timeline.get(key, [])
+        end = bisect.bisect_left(self.season_dates.get(key, []), date_limit)
+        past_matches = timeline[max(0, end - 15):end][::-1]
+
+        if not past_matches:
+            return _get_default_features()
+
+        # 2. Titolari effettivi (fallback: formazione probabile)
+        starters_ids = self.starters.get((match.id, team.id))
+        if not starters_ids:
+            starters_ids = self.probable_starters.get((match.id, team.id), [])
+        starters_xg_avg = self._starters_xg_avg(starters_ids, date_limit)
+
+        # 3. H2H
+        opponent_id = match.away_team_id if team.id == match.home_team_id else match.home_team_id
+        pair_key = self._pair_key(team.id, opponent_id)
+        pair_end = bisect.bisect_left(self.pair_dates.get(pair_key, []), date_limit)
+        h2h_matches = self.pair_timeline.get(pair_key, [])[max(0, pair_end - 5):pair_end][::-1]
+
+        return _assemble_features(
+            team, date_limit, past_matches, starters_xg_avg,
+            current_elo=self.resolved_elo[(match.id, team.id)],
+            is_playing_home=(team.id == match.home_team_id),
+            derby_intensity=self.rivalries.get(self._pair_key(match.home_team_id, match.away_team_id), 0),
+            h2h_matches=h2h_matches,
+            elo_at=self._elo_before,
+            standing=self._standing_before(match.season_id, team.id, date_limit),
+        )
+
+    def _elo_before(self, team_id, date_limit):
+        return self.elo_timeline.rating_before(team_id, date_limit)
+
+    def _replay_matches(self, targets):
+        """ Partite su cui rigiocare la timeline ELO: le sole da calcolare, o tutto lo storico (replay_history). """
+        if not self.replay_history:
+            return targets
+        return list(Match.objects.filter(
+            status='FINISHED', result__isnull=False, date_time__lte=targets[-1].date_time,
+        ).only('id', 'season_id', 'home_team_id', 'away_team_id', 'date_time').order_by('date_time'))
+
+    def _resolve_elo(self, targets):
+        """
+        ELO degli snapshot da calcolare, in ordine cronologico: come nel calcolo
+        per-partita è l'ELO dell'ultimo snapshot precedente della squadra (il default
+        alla prima partita della stagione) e viene scritto nella timeline, dove lo
+        leggono le partite successive.
+        Le letture sono sempre strettamente precedenti alla partita in calcolo, quindi
+        la timeline risultante dà a ogni partita gli stessi valori del calcolo sequenziale.
+        Restituisce {(match_id, team_id): elo}.
+        """
+        default_elo = _get_default_features()['elo']
+        resolved = {}
+        for match in targets:
+            for team_id in (match.home_team_id, match.away_team_id):
+                if bisect.bisect_left(self.season_dates.get((team_id, match.season_id), []), match.date_time) == 0:
+                    elo = default_elo
+                else:
+                    elo = self._elo_before(team_id, match.date_time)
+                    if elo is None:
+                        elo = 1500.0  # come _assemble_features
+                resolved[(match.id, team_id)] = elo
+                self.elo_timeline.set_rating(team_id, match.date_time, elo)
+        return resolved
+
+    def _standing_before(self, season_id, team_id, date_limit):
+        """ Come standings.standing_before, sulla classifica alla data in memoria. """
+        timeline = self.standings.get(season_id)
+        return timeline.before(team_id, date_limit) if timeline else None
+
+    def _starters_xg_avg(self, player_ids, date_limit):
+        """ Come calculate_starters_xg_avg: media delle medie xG (ultime 5 in 90 giorni) dei titolari. """
+        if not player_ids:
+            return 0.0
+
+        start_date = date_limit - timedelta(days=90)
+        total_xg_avg = 0.0
+        valid_players = 0
+
+        for pid in player_ids:
+            dates = self.player_dates.get(pid)
+            if not dates:
+                continue
+            lo = bisect.bisect_left(dates, start_date)
+            hi = bisect.bisect_left(dates, date_limit)
+            # Newest->Oldest, massimo 5
+            stats = self.player_xg[pid][max(lo, hi - 5):hi][::-1]
+            if stats:
+                total_xg_avg += sum(stats) / len(stats)
+                valid_players += 1
+
+        if valid_players > 0:
+            return total_xg_avg / valid_players
+        return 0.0
+
+    # ------------------------------------------------------------------
+    # Scrittura
+    # ------------------------------------------------------------------
+
+    def _changes(self, snapshot, feats):
+        """
+        Valori da scrivere nello snapshot e stato: 'created' | 'updated' | 'unchanged'.
+        I campi uguali entro la tolleranza mantengono il valore salvato.
+        """
+        values = {field: feats[key] for key, field in SNAPSHOT_FIELD_MAP.items()}
+        if snapshot is None:
+            return values, 'created'
+
+        changed = False
+        for field, value in values.items():
+            old = getattr(snapshot, field)
+            if self._same_value(old, value):
+                values[field] = old
+            else:
+                changed = True
+        return values, 'updated' if changed else 'unchanged'
+
+    @classmethod
+    def _same_value(cls, old, new):
+        if isinstance(old, float) or isinstance(new, float):
+            return math.isclose(old, new, rel_tol=cls.FLOAT_TOLERANCE, abs_tol=cls.FLOAT_TOLERANCE)
+        return old == new
+
+
+# ----------------------------------------------------------------------
+# Shard paralleli
+# ----------------------------------------------------------------------
+
+def split_shards(targets, shard_size=SHARD_SIZE):
+    """ [[Match]]: una stagione per shard, le stagioni più lunghe di shard_size in blocchi cronologici. """
+    by_season = {}
+    for match in targets:
+        by_season.setdefault(match.season_id, []).append(match)
+    return [
+        matches[i:i + shard_size]
+        for matches in by_season.values()
+        for i in range(0, len(matches), shard_size)
+    ]
+
+
+def compute_shard(job):
+    """
+    Calcola uno shard (processo del pool o task Django-Q) senza scrivere.
+    job: {'match_ids', 'elo_timeline' (già risolta), 'resolved_elo'}.
+    """
+    engine = BatchFeatureEngine(force=True, match_ids=job['match_ids'])
+    targets = engine.get_target_matches()
+    if not targets:
+        return {'rows': [], 'matches': 0, 'created': 0, 'updated': 0, 'unchanged': 0}
+    engine._load(targets, elo_timeline=job['elo_timeline'])
+    engine.resolved_elo = job['resolved_elo']
+    return engine.compute_rows(targets)
+
+
+def compute_claimed_shard(group, index, job):
+    """ Task Django-Q: calcola lo shard se il coordinatore non l'ha già preso in carico (None). """
+    if not _claim_shard(group, index):
+        return None
+    return compute_shard(job)
+
+
+def _claim_shard(group, index):
+    # cache.add è atomica sulla tabella condivisa: ogni shard è calcolato da un solo processo
+    return cache.add(_shard_key(group, index), True, timeout=settings.Q_CLUSTER.get('timeout', 1800))
+
+
+def _shard_key(group, index):
+    return f'feature-shard:{group}:{index}'
+
+
+def _init_shard_worker():
+    # Con lo start method 'spawn' il processo figlio parte senza Django configurato
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+
+
+class FeatureShards:
+    """
+    Esecuzione parallela degli shard di BatchFeatureEngine; i risultati tornano al
+    coordinatore (BatchFeatureEngine.run), che li unisce e li scrive in una transazione.
+
+    - Processo normale (comando da terminale): pool di processi locali, uno per core.
+    - Worker Django-Q (processo daemon, non può creare processi figli): uno shard per
+      task nello stesso gruppo, eseguiti dagli altri worker del cluster
+      (Q_CLUSTER['workers'] - 1: il coordinatore ne occupa uno). Il coordinatore
+      non resta in attesa: calcola lui gli shard che nessun worker ha ancora preso,
+      così con tutti i worker occupati (es. da altri coordinatori) non si blocca.
+    - Con un solo worker disponibile il calcolo resta nel processo corrente.
+    """
+
+    def __init__(self, workers=None, shard_size=SHARD_SIZE):
+        self.shard_size = shard_size
+        self.in_cluster = multiprocessing.current_process().daemon
+        if self.in_cluster:
+            available = settings.Q_CLUSTER.get('workers', 1) - 1
+        else:
+            available = os.cpu_count() or 1
+        self.workers = max(1, min(workers or available, available))
+
+    def jobs(self, targets, elo_timeline, resolved_elo):
+        for shard in split_shards(targets, self.shard_size):
+            yield {
+                'match_ids': [match.id for match in shard],
+                'elo_timeline': elo_timeline,
+                'resolved_elo': {
+                    (match.id, team_id): resolved_elo[(match.id, team_id)]
+                    for match in shard for team_id in (match.home_team_id, match.away_team_id)
+                },
+            }
+
+    def run(self, targets, elo_timeline, resolved_elo, progress=None):
+        """ Risultati di compute_shard per ogni shard. progress(done, total) a ogni shard concluso. """
+        jobs = list(self.jobs(targets, elo_timeline, resolved_elo))
+        results = []
+
+        def collect(result):
+            results.append(result)
+            if progress:
+                progress(sum(r['matches'] for r in results), len(targets))
+
+        if self.in_cluster:
+            self._run_cluster(jobs, collect)
+        else:
+            self._run_pool(jobs, collect)
+        return results
+
+    def _run_pool(self, jobs, collect):
+        # I processi figli non devono ereditare le connessioni al DB
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_shard_worker) as pool:
+            for future in as_completed([pool.submit(compute_shard, job) for job in jobs]):
+                collect(future.result())
+
+    def _run_cluster(self, jobs, collect):
+        from django_q.humanhash import uuid
+        from django_q.tasks import async_task, delete_group, fetch_group
+
+        group = f"features-{uuid()[1]}"
+        for index, job in enumerate(jobs):
+            async_task('predictors.feature_engine.compute_claimed_shard', group, index, job, group=group, save=True)
+
+        try:
+            local = 0
+            for index, job in enumerate(jobs):
+                if _claim_shard(group, index):
+                    collect(compute_shard(job))
+                    local += 1
+
+            # Restano da attendere solo gli shard già presi dagli altri worker
+            collected = set()
+            deadline = time.monotonic() + settings.Q_CLUSTER.get('timeout', 1800)
+            while local + len(collected) < len(jobs):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Shard feature non conclusi: {local + len(collected)}/{len(jobs)}")
+                time.sleep(SHARD_POLL_INTERVAL)
+                for task in fetch_group(group, failures=True) or []:
+                    if task.id in collected:
+                        continue
+                    if not task.success:
+                        raise RuntimeError(f"Shard feature fallito: {task.result}")
+                    if task.result is None:
+                        continue  # shard calcolato dal coordinatore
+                    collected.add(task.id)
+                    collect(task.result)
+        finally:
+            # Le prenotazioni restano fino alla scadenza: i task ancora in coda le trovano e terminano subito
+            delete_group(group, tasks=True)
@@ -1,27 +1,57 @@
 import logging
 from django.db.models import Q
 from django.utils import timezone
-from predictors.models import Match, TeamFormSnapshot, MatchLineup
-from predictors.utils import calculate_advanced_metrics, get_probable_starters, calculate_starters_xg_avg
+from predictors.models import Match, MatchLineup
+from predictors.utils import calculate_advanced_metrics, get_probable_starters, calculate_starters_xg_avg, is_team_in_derby
+from predictors.rolling_state import get_rolling_matches
+from predictors.elo_index import EloTimeline
+from predictors.standings import standing_before
 
 logger = logging.getLogger(__name__)
 
+# Feature key -> TeamFormSnapshot field
+SNAPSHOT_FIELD_MAP = {
+    'points': 'last_5_matches_points',
+    'rest_days': 'rest_days',
+    'elo': 'elo_rating',
+    'avg_xg': 'avg_xg_last_5',
+    'avg_gf': 'avg_goals_scored_last_5',
+    'avg_ga': 'avg_goals_conceded_last_5',
+    'form_sequence': 'form_sequence',
+    'xg_ratio': 'xg_ratio_last_5',
+    'eff_att': 'efficiency_attack_last_5',
+    'eff_def': 'efficiency_defense_last_5',
+    'volatility': 'goal_volatility_last_5',
+    'is_derby': 'is_derby',
+    'pressure_index': 'pressure_index',
+    'starters_xg': 'starters_avg_xg_last_5',
+    'league_position': 'league_position',
+    'points_gap_top': 'points_gap_top',
+}
+
 def get_team_features_at_date(team, date_limit, season, current_match_home_team, current_match_away_team, use_actual_starters=False, current_match=None):
     """
     Calculates weighted pre-match features for a team at a specific point in time.
+    League position and points gap come from the matches of the season played before date_limit.
     ... (rest of docstring) ...
     """
     
     # 1. Fetch Past Matches (increased pool to allow for venue filtering)
-    past_matches = Match.objects.filter(
-        Q(home_team=team) | Q(away_team=team),
-        date_time__lt=date_limit,
-        season=season,
-        status='FINISHED'
-    ).order_by('-date_time')[:15] # Expanded window to find enough Home/Away games
+    # Prediction mode: the persisted rolling state already holds the last 15 results (one query).
+    past_matches = None
+    if not use_actual_starters:
+        past_matches = get_rolling_matches(team, season, date_limit)
+
+    if past_matches is None:
+        past_matches = list(Match.objects.filter(
+            Q(home_team=team) | Q(away_team=team),
+            date_time__lt=date_limit,
+            season=season,
+            status='FINISHED'
+        ).select_related('result', 'home_team', 'away_team').order_by('-date_time')[:15]) # Expanded window to find enough Home/Away games
 
     # Default if no history
-    if not past_matches.exists():
+    if not past_matches:
         return _get_default_features()
 
     # 2. Calculate Player Metrics
@@ -56,31 +86,59 @@ def get_team_features_at_date(team, date_limit, season, current_match_home_team,
     
     starters_xg_avg = calculate_starters_xg_avg(starters_ids, date_limit)
 
-    # 3. Rest Days (based on absolute last match)
+    # 3. Current ELO
+    current_elo = _snapshot_elo_before(team.id, date_limit)
+
+    # 4. Head-to-Head history
+    opponent = current_match_away_team if team == current_match_home_team else current_match_home_team
+    h2h_matches = _get_h2h_matches(team, opponent, date_limit) if opponent else None
+
+    # 5. League table as of kick-off (only matches played before date_limit: postponed games count when played)
+    standing = standing_before(team.id, season.id, date_limit)
+
+    return _assemble_features(
+        team, date_limit, past_matches, starters_xg_avg, current_elo,
+        is_playing_home=(team == current_match_home_team),
+        derby_intensity=is_team_in_derby(current_match_home_team, current_match_away_team),
+        h2h_matches=h2h_matches,
+        elo_at=_snapshot_elo_before,
+        standing=standing,
+    )
+
+def _assemble_features(team, date_limit, past_matches, starters_xg_avg, current_elo, is_playing_home, derby_intensity, h2h_matches, elo_at, standing=None):
+    """
+    Pure part of the feature calculation: everything here works on data that has
+    already been fetched, so the per-match path (get_team_features_at_date) and
+    the batch engine (feature_engine.BatchFeatureEngine) share the same maths.
+
+    past_matches: up to 15 finished matches of the season, Newest->Oldest.
+    current_elo: ELO of the latest snapshot before date_limit (None if missing).
+    h2h_matches: up to 5 previous meetings, Newest->Oldest (None to skip H2H).
+    elo_at: callable(team_id, date) -> ELO of the latest snapshot before date, or None.
+    standing: (league position, points behind the leader) before kick-off, or None.
+    """
+    # 1. Rest Days (based on absolute last match)
     last_match = past_matches[0]
     rest_days = (date_limit - last_match.date_time).days
 
-    # 4. Current ELO
-    last_snapshot = TeamFormSnapshot.objects.filter(team=team, match__date_time__lt=date_limit).order_by('-match__date_time').first()
-    current_elo = last_snapshot.elo_rating if last_snapshot else 1500.0
+    # 2. Current ELO
+    if current_elo is None:
+        current_elo = 1500.0
 
-    # 5. Venue Weighting Logic
-    is_playing_home = (team == current_match_home_team)
+    # 3. Venue Weighting Logic
     weighted_matches = _select_weighted_matches(past_matches, team, is_playing_home)
 
-    # 6. Basic Metrics Calculation
-    metrics = calculate_advanced_metrics(weighted_matches, team, current_match_home_team, current_match_away_team)
+    # 4. Basic Metrics Calculation
+    metrics = calculate_advanced_metrics(weighted_matches, team)
+    metrics['is_derby'] = derby_intensity
 
-    # 7. Strength of Schedule (SoS) Adjustment
-    avg_gf_sos, avg_ga_sos, avg_xg_sos = _apply_sos_adjustment(weighted_matches, team, metrics)
+    # 5. Strength of Schedule (SoS) Adjustment
+    avg_gf_sos, avg_ga_sos, avg_xg_sos = _apply_sos_adjustment(weighted_matches, team, metrics, elo_at)
 
-    # 8. Head-to-Head (H2H) Adjustment
-    avg_gf_final, avg_ga_final = _apply_h2h_adjustment(
-        team, current_match_home_team, current_match_away_team, date_limit, 
-        avg_gf_sos, avg_ga_sos
-    )
+    # 6. Head-to-Head (H2H) Adjustment
+    avg_gf_final, avg_ga_final = _apply_h2h_adjustment(team, h2h_matches, avg_gf_sos, avg_ga_sos)
 
-    # 9. VISUAL FORM SEQUENCE (Strictly Chronological: Oldest -> Newest)
+    # 7. VISUAL FORM SEQUENCE (Strictly Chronological: Oldest -> Newest)
     # We recalculate this separately because 'metrics' uses weighted_matches (mixed order/prioritized).
     # For display, we want the LAST 5 played matches in order.
     chronological_matches = list(past_matches[:5]) # past_matches is Newest->Oldest
@@ -105,9 +163,16 @@ def get_team_features_at_date(team, date_limit, season, current_match_home_team,
         'pressure_index': metrics['pressure_index'],
         'starters_xg': starters_xg_avg,
         # Use the strictly chronological form for display
-        'form_sequence': visual_form_sequence 
+        'form_sequence': visual_form_sequence,
+        # League table (0 = not available)
+        'league_position': standing[0] if standing else 0,
+        'points_gap_top': standing[1] if standing else 0,
     }
 
+def _snapshot_elo_before(team_id, date_limit):
+    """ ELO of the team's latest snapshot strictly before date_limit (None if no snapshot), from the in-memory index. """
+    return EloTimeline.get().rating_before(team_id, date_limit)
+
 def _get_default_features():
     return {
         'points': 5, 'rest_days': 7, 'elo': 1500.0,
@@ -115,7 +180,8 @@ def _get_default_features():
         'xg_ratio': 0.5, 'eff_att': 0.0, 'eff_def': 0.0, 'volatility': 0.0,
         'is_derby': False, 'pressure_index': 50.0,
         'starters_xg': 0.0,
-        'form_sequence': ''
+        'form_sequence': '',
+        'league_position': 0, 'points_gap_top': 0,
     }
 
 def _select_weighted_matches(past_matches, team, is_playing_home):
@@ -149,7 +215,7 @@ def _select_weighted_matches(past_matches, team, is_playing_home):
         
     return weighted_matches
 
-def _apply_sos_adjustment(weighted_matches, team, metrics):
+def _apply_sos_adjustment(weighted_matches, team, metrics, elo_at=_snapshot_elo_before):
     """
     Adjusts Goal and xG metrics based on the average ELO of opponents faced.
     """
@@ -159,9 +225,9 @@ def _apply_sos_adjustment(weighted_matches, team, metrics):
     for m in weighted_matches:
         opp = m.away_team if m.home_team == team else m.home_team
         # Find opponent's snapshot strictly before this match
-        opp_snap = TeamFormSnapshot.objects.filter(team=opp, match__date_time__lt=m.date_time).order_by('-match__date_time').first()
-        if opp_snap and opp_snap.elo_rating:
-            opponents_elo_sum += opp_snap.elo_rating
+        opp_elo = elo_at(opp.id, m.date_time)
+        if opp_elo:
+            opponents_elo_sum += opp_elo
             valid_opponents += 1
         else:
             opponents_elo_sum += 1500.0
@@ -183,23 +249,23 @@ def _apply_sos_adjustment(weighted_matches, team, metrics):
     
     return avg_gf_sos, avg_ga_sos, avg_xg_sos
 
-def _apply_h2h_adjustment(team, home_team, away_team, date_limit, avg_gf_current, avg_ga_current):
+def _get_h2h_matches(team, opponent, date_limit):
+    """ Last 5 finished meetings between the two teams (any season), Newest->Oldest. """
+    return list(Match.objects.filter(
+        (Q(home_team=team, away_team=opponent) | Q(home_team=opponent, away_team=team)),
+        status='FINISHED',
+        date_time__lt=date_limit
+    ).select_related('result', 'home_team').order_by('-date_time')[:5])
+
+def _apply_h2h_adjustment(team, h2h_matches, avg_gf_current, avg_ga_current):
     """
     Blends recent form with Head-to-Head history.
     Weight: 70% Recent Form, 30% H2H.
     """
-    opponent = away_team if team == home_team else home_team
-    
-    if not opponent:
+    if h2h_matches is None:
         return avg_gf_current, avg_ga_current
 
-    h2h_matches = Match.objects.filter(
-        (Q(home_team=team, away_team=opponent) | Q(home_team=opponent, away_team=team)),
-        status='FINISHED',
-        date_time__lt=date_limit
-    ).order_by('-date_time')[:5]
-    
-    if h2h_matches.count() < 3:
+    if len(h2h_matches) < 3:
         # Not enough H2H history to be significant
         return avg_gf_current, avg_ga_current
         
@@ -213,8 +279,8 @@ def _apply_h2h_adjustment(team, home_team, away_team, date_limit, avg_gf_current
             h2h_gf_sum += h.result.away_goals
             h2h_ga_sum += h.result.home_goals
             
-    avg_gf_h2h = h2h_gf_sum / h2h_matches.count()
-    avg_ga_h2h = h2h_ga_sum / h2h_matches.count()
+    avg_gf_h2h = h2h_gf_sum / len(h2h_matches)
+    avg_ga_h2h = h2h_ga_sum / len(h2h_matches)
     
     avg_gf_final = (avg_gf_current * 0.7) + (avg_gf_h2h * 0.3)
     avg_ga_final = (avg_ga_current * 0.7) + (avg_ga_h2h * 0.3)
@@ -0,0 +1,132 @@
+"""
+Propagazione di un risultato corretto o appena importato (ResultImpact).
+
+Dopo il salvataggio di un MatchResult gli stati per squadra (classifica,
+rolling, stato corrente) sono già aggiornati dai segnali; qui si
+trovano e si ricalcolano solo i record a valle che leggono quel risultato:
+
+- snapshot delle partite successive delle due squadre nella stessa stagione,
+  finché la partita resta nella loro finestra di forma (FORM_WINDOW partite);
+- ELO dalla data della partita in avanti (EloEngine riparte da lì e riscrive
+  elo_rating degli snapshot). Le altre feature non leggono l'ELO ricalcolato: il
+  motore rigioca la timeline ELO come calculate_features --force (replay_history);
+- snapshot dei successivi scontri diretti (H2H_WINDOW, anche in altre stagioni);
+- snapshot la cui posizione / distanza dalla vetta non coincide più con la classifica;
+- previsioni e opportunità delle partite programmate delle squadre coinvolte.
+"""
+import bisect
+from django.core.management import call_command
+from django.db.models import Q
+from predictors.elo_engine import EloEngine
+from predictors.feature_engine import BatchFeatureEngine
+from predictors.models import Match, TeamFormSnapshot
+from predictors.standings import StandingsTimeline
+
+FORM_WINDOW = 15  # partite della stagione lette dalle feature (get_team_features_at_date)
+H2H_WINDOW = 5    # scontri diretti letti dalle feature
+
+
+class ResultImpact:
+    """ Insieme dei record a valle di una o più partite e loro ricalcolo. """
+
+    def __init__(self, matches):
+        self.matches = [m for m in matches if m is not None]
+
+    @classmethod
+    def propagate(cls, matches):
+        """ Ricalcola solo ciò che dipende dalle partite indicate. Restituisce un riepilogo. """
+        return cls(matches).run()
+
+    def run(self):
+        summary = {'matches': len(self.matches), 'snapshots': 0, 'elo_matches': 0, 'predictions': 0}
+        if not self.matches:
+            return summary
+
+        since = min(m.date_time for m in self.matches)
+        self._load_timelines(since)
+
+        # 1. ELO dalla partita più vecchia in avanti (riscrive anche elo_rating degli snapshot)
+        elo = EloEngine(from_date=since).run()
+        summary['elo_matches'] = elo['matches']
+
+        keys = self.affected_snapshots()
+        finished_ids = {m.id for m in self.matches} | {match_id for match_id, _ in keys}
+
+        # 2. Snapshot delle sole partite coinvolte (quelle programmate sono escluse dal motore),
+        # con la timeline ELO rigiocata come in calculate_features --force; il motore riallinea
+        # poi elo_rating allo storico appena ricalcolato
+        features = BatchFeatureEngine(force=True, match_ids=finished_ids, replay_history=True).run()
+        summary['snapshots'] = features['created'] + features['updated']
+
+        # 3. Previsioni e opportunità delle partite programmate delle squadre coinvolte
+        team_ids = {team_id for _, team_id in keys}
+        for m in self.matches:
+            team_ids.update((m.home_team_id, m.away_team_id))
+        upcoming = list(Match.objects.filter(
+            Q(home_team_id__in=team_ids) | Q(away_team_id__in=team_ids),
+            status='SCHEDULED', predictions__isnull=False,
+        ).values_list('id', flat=True).distinct())
+        if upcoming:
+            call_command('predict_upcoming', match_ids=upcoming)
+        summary['predictions'] = len(upcoming)
+        return summary
+
+    # ------------------------------------------------------------------
+    # Insieme dei record coinvolti
+    # ------------------------------------------------------------------
+
+    def _load_timelines(self, since):
+        """ Partite da since in avanti per squadra e stagione: [(data, match_id, avversario)]. """
+        rows = Match.objects.filter(date_time__gte=since).order_by('date_time', 'id').values_list(
+            'id', 'season_id', 'home_team_id', 'away_team_id', 'date_time'
+        )
+        self.timelines = {}
+        self.match_keys = {}  # match_id -> (season_id, data, casa, trasferta)
+        for match_id, season_id, home_id, away_id, date in rows:
+            self.timelines.setdefault((home_id, season_id), []).append((date, match_id, away_id))
+            self.timelines.setdefault((away_id, season_id), []).append((date, match_id, home_id))
+            self.match_keys[match_id] = (season_id, date, home_id, away_id)
+        self.dates = {key: [entry[0] for entry in timeline] for key, timeline in self.timelines.items()}
+
+    def _later(self, team_id, season_id, date):
+        """ Partite della squadra nella stagione dopo date (FORM_WINDOW al massimo). """
+        key = (team_id, season_id)
+        return self.timelines.get(key, [])[bisect.bisect_right(self.dates.get(key, []), date):][:FORM_WINDOW]
+
+    def affected_snapshots(self):
+        """
+        {(match_id, team_id)} degli snapshot (partite giocate e programmate) che leggono
+        direttamente le partite indicate: finestra di forma, scontri diretti, classifica.
+        """
+        keys = set()
+        for match in self.matches:
+            for team_id in (match.home_team_id, match.away_team_id):
+                # Forma, xG, punti: la partita è nella finestra delle successive FORM_WINDOW
+                keys.update((match_id, team_id) for _, match_id, _ in self._later(team_id, match.season_id, match.date_time))
+            keys.update(self._head_to_head(match))
+
+        keys.update(self._standings_mismatches())
+        return keys
+
+    @staticmethod
+    def _head_to_head(match):
+        pair = Q(home_team_id=match.home_team_id, away_team_id=match.away_team_id) | Q(
+            home_team_id=match.away_team_id, away_team_id=match.home_team_id
+        )
+        meetings = Match.objects.filter(pair, date_time__gt=match.date_time).order_by('date_time').values_list('id', flat=True)[:H2H_WINDOW]
+        return {(match_id, team_id) for match_id in meetings for team_id in (match.home_team_id, match.away_team_id)}
+
+    def _standings_mismatches(self):
+        """ Snapshot successivi della stagione la cui classifica salvata non coincide con quella alla data. """
+        keys = set()
+        timelines = StandingsTimeline.for_seasons({m.season_id for m in self.matches})
+        for season_id, timeline in timelines.items():
+            since = min(m.date_time for m in self.matches if m.season_id == season_id)
+            snapshots = TeamFormSnapshot.objects.filter(
+                match__season_id=season_id, match__date_time__gt=since
+            ).values_list('match_id', 'team_id', 'match__date_time', 'league_position', 'points_gap_top')
+            for match_id, team_id, date, position, gap in snapshots:
+                # Come standing_before: classifica prima del calcio d'inizio, (0, 0) se assente
+                if (position, gap) != (timeline.before(team_id, date) or (0, 0)):
+                    keys.add((match_id, team_id))
+        return keys
@@ -1,9 +1,9 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import Match, Team, Season
 from django.utils import timezone
 from datetime import timedelta
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Aggiunge manualmente le partite mancanti Cremonese-Lecce e Pisa-Parma alla Giornata 14.'
 
     def handle(self, *args, **kwargs):
@@ -1,7 +1,7 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import Match
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Check status of matches for Round 13'
 
     def handle(self, *args, **options):
@@ -1,7 +1,7 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import Match
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Debug why matches are red in Control Room'
 
     def handle(self, *args, **options):
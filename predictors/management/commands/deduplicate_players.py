@@ -1,8 +1,8 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.db.models import Count, Min
 from predictors.models import Player, PlayerMatchStat, PlayerAttributes
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Unisce i giocatori duplicati (stesso nome e stessa squadra) in un unico record.'
 
     def handle(self, *args, **kwargs):
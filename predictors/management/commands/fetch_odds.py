@@ -1,9 +1,9 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import Match
 from predictors.odds_service import OddsService
 from django.utils import timezone
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Fetches odds for upcoming matches from TheOddsAPI (Respecting limits)'
 
     def handle(self, *args, **options):
@@ -1,11 +1,11 @@
 import requests
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 from predictors.models import Match, MatchLineup, Team, Player
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Scarica le formazioni UFFICIALI da Football-Data.org (circa 30-60min prima del match)'
 
     def handle(self, *args, **kwargs):
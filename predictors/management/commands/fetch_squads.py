@@ -1,9 +1,9 @@
 import requests
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.conf import settings
 from predictors.models import Team, Player
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Scarica le rose (squads) da Football-Data.org per aggiornare i ruoli dei giocatori.'
 
     def handle(self, *args, **kwargs):
@@ -1,9 +1,9 @@
 import requests
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.conf import settings
 from predictors.models import Player, Team, Season, League, TopScorer
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Scarica la classifica marcatori da Football-Data.org'
 
     def handle(self, *args, **kwargs):
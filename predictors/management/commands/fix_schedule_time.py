@@ -1,8 +1,8 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import Match
 from datetime import timedelta
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Add 1 hour to all matches starting from Round 14 to fix timezone offset'
 
     def handle(self, *args, **options):
@@ -1,8 +1,8 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import Match
 from datetime import timedelta
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Fix match times by adding 1 hour for matches from round 14 onwards.'
 
     def handle(self, *args, **kwargs):
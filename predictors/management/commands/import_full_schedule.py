@@ -2,13 +2,13 @@ import requests
 import re
 import json
 import codecs
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from bs4 import BeautifulSoup
 from predictors.models import Match, Team, Season, League
 from django.utils import timezone
 from datetime import datetime, timedelta
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Imports the full schedule from Understat to ensure no matches are missing.'
 
     def handle(self, *args, **options):
@@ -1,14 +1,21 @@
 import mysql.connector
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.utils import timezone
 from datetime import datetime
 # Importiamo i tuoi modelli Django
 from predictors.models import League, Season, Team, Match, MatchResult
+from predictors.standings import StandingsLedger
+from predictors.current_state import CurrentState
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Importa dati da VentusBet MySQL a Django Postgres'
 
     def handle(self, *args, **kwargs):
+        # Una partita e un risultato per riga: classifica e stato corrente ricalcolati una volta alla fine
+        with StandingsLedger.deferred(), CurrentState.deferred():
+            self.import_data()
+
+    def import_data(self):
         # --- CONFIGURAZIONE MYSQL ---
         DB_CONFIG = {
             'host': 'localhost',
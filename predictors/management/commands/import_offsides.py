@@ -1,11 +1,11 @@
 import csv
 import os
 from datetime import datetime
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.utils.timezone import make_aware
 from predictors.models import Match, MatchResult, Team
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Importa dati storici sui fuorigioco da CSV'
 
     def handle(self, *args, **kwargs):
@@ -1,8 +1,8 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.db.models import Count, Q
 from predictors.models import Player, PlayerMatchStat
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = "Deduce il ruolo dei giocatori analizzando lo storico delle posizioni in campo."
 
     def handle(self, *args, **kwargs):
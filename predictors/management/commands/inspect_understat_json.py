@@ -2,10 +2,10 @@ import requests
 import re
 import json
 import codecs
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from bs4 import BeautifulSoup
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Inspect raw JSON data from Understat for a specific match to find correct stats keys'
 
     def handle(self, *args, **options):
@@ -1,7 +1,7 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import MatchResult
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Normalize JSON keys in MatchResult (e.g. possesso -> possession)'
 
     def handle(self, *args, **options):
@@ -1,159 +1,248 @@
+import logging
 import pandas as pd
 import os
+import time
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
 from predictors.models import Match, Prediction, TeamFormSnapshot
 from predictors.features import get_team_features_at_date
-from predictors.apps import PredictorsConfig # Import the AppConfig
+from predictors.model_store import ModelStore
+from predictors.elo_index import EloTimeline
+from predictors.detail_cache import invalidate_match_detail
+from predictors.services import OpportunityService
+from predictors.pipeline_progress import InstrumentedCommand, report_progress
+from predictors.current_state import current_round
 
-class Command(BaseCommand):
+logger = logging.getLogger(__name__)
+
+# Campi Prediction -> valore di default se il modello del target manca
+PREDICTION_DEFAULTS = {
+    'home_goals': 0,
+    'home_possession': 50,
+    'home_total_shots': 0,
+    'home_shots_on_target': 0,
+    'home_corners': 0,
+    'home_fouls': 0,
+    'home_yellow_cards': 0,
+    'home_offsides': 0,
+
+    'away_goals': 0,
+    'away_possession': 50,
+    'away_total_shots': 0,
+    'away_shots_on_target': 0,
+    'away_corners': 0,
+    'away_fouls': 0,
+    'away_yellow_cards': 0,
+    'away_offsides': 0,
+}
+
+# Campi TeamFormSnapshot -> chiave della riga feature (prefissata con home_/away_)
+SNAPSHOT_ROW_KEYS = {
+    'last_5_matches_points': 'last_5_pts',
+    'rest_days': 'rest_days',
+    'elo_rating': 'elo',
+    'avg_xg_last_5': 'avg_xg',
+    'avg_goals_scored_last_5': 'avg_gf',
+    'avg_goals_conceded_last_5': 'avg_ga',
+
+    'xg_ratio_last_5': 'xg_ratio',
+    'efficiency_attack_last_5': 'eff_att',
+    'efficiency_defense_last_5': 'eff_def',
+    'goal_volatility_last_5': 'volatility',
+
+    'is_derby': 'is_derby',
+    'pressure_index': 'pressure_index',
+    'starters_avg_xg_last_5': 'starters_xg',
+    'league_position': 'league_position',
+    'points_gap_top': 'points_gap_top',
+}
+
+class Command(InstrumentedCommand):
     help = 'Genera previsioni statistiche complete per le partite programmate'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--match-ids', dest='match_ids', type=int, nargs='+', default=None, help='Solo le partite programmate indicate (ricalcolo dopo un risultato corretto)')
+
     def handle(self, *args, **kwargs):
-        # 1. CARICAMENTO MODELLI (Ora da AppConfig)
-        models_dict = PredictorsConfig.ml_models
+        # 1. CARICAMENTO MODELLI (versione attiva in ModelRegistry, caricata al primo uso)
+        models_dict = ModelStore.get()
         if models_dict is None:
-            self.stdout.write(self.style.ERROR("Modelli ML non caricati in memoria! Verificare il file ml_stats_models.pkl e il ready() dell'AppConfig."))
+            self.stdout.write(self.style.ERROR("Modelli ML non disponibili! Eseguire train_model o verificare ModelRegistry."))
             return
 
-        self.stdout.write(f"Caricati {len(models_dict)} modelli statistici dalla memoria.")
+        self.stdout.write(f"Caricati {len(models_dict)} modelli statistici (versione {ModelStore.version() or 'legacy'}).")
 
-        # 2. RECUPERO PARTITE PROGRAMMATE (SOLO PROSSIMA GIORNATA)
-        # Trova la prima partita non ancora giocata per identificare la prossima giornata
-        next_match = Match.objects.filter(status='SCHEDULED').order_by('date_time').first()
-        
-        if not next_match:
-            self.stdout.write("Nessuna partita programmata trovata.")
-            return
+        # 2. RECUPERO PARTITE PROGRAMMATE (SOLO PROSSIMA GIORNATA, o le partite indicate)
+        if kwargs.get('match_ids'):
+            upcoming_matches = Match.objects.filter(
+                status='SCHEDULED',
+                id__in=kwargs['match_ids']
+            ).select_related('season', 'home_team', 'away_team')
+            self.stdout.write(f"Trovate {upcoming_matches.count()} partite da ripredire.")
+        else:
+            # Giornata della prima partita non ancora giocata (stato del campionato aggiornato da update_fixtures)
+            league_round = current_round()
 
-        target_round = next_match.round_number
-        self.stdout.write(f"Prossima giornata individuata: {target_round}")
-        
-        upcoming_matches = Match.objects.filter(
-            status='SCHEDULED',
-            round_number=target_round
-        ).select_related('home_team', 'away_team')
+            if not league_round:
+                self.stdout.write("Nessuna partita programmata trovata.")
+                return
 
-        self.stdout.write(f"Trovate {upcoming_matches.count()} partite da predire per la giornata {target_round}.")
+            target_round = league_round[1]
+            self.stdout.write(f"Prossima giornata individuata: {target_round}")
 
-        count = 0
-        for match in upcoming_matches:
-            # 3. CALCOLO FEATURES PRE-MATCH
+            upcoming_matches = Match.objects.filter(
+                status='SCHEDULED',
+                round_number=target_round
+            ).select_related('season', 'home_team', 'away_team')
+
+            self.stdout.write(f"Trovate {upcoming_matches.count()} partite da predire per la giornata {target_round}.")
+
+        timings = {}
+
+        # 3. CALCOLO FEATURES PRE-MATCH (tutta la giornata)
+        stage_start = time.perf_counter()
+        round_rows = []
+        for done, match in enumerate(upcoming_matches, start=1):
             features_row = self.get_pre_match_features(match)
-            
+            report_progress(done, len(upcoming_matches))
+
             if not features_row:
                 self.stdout.write(self.style.WARNING(f"Saltata {match}: dati storici insufficienti."))
                 continue
-            
-            # 4. SALVATAGGIO SNAPSHOTS (Per Visualizzazione UI)
-            # Estrarre i dati dal dizionario calcolato per salvarli nel DB
-            self.save_snapshots(match, features_row)
+            round_rows.append((match, features_row))
+        timings['features'] = time.perf_counter() - stage_start
+
+        if not round_rows:
+            self.stdout.write(self.style.SUCCESS("Generate 0 previsioni."))
+            return
+
+        # 4. PREDIZIONE: una sola chiamata per target su tutta la giornata
+        stage_start = time.perf_counter()
+        round_preds = self.predict_round(models_dict, round_rows)
+        timings['inference'] = time.perf_counter() - stage_start
+
+        # 5. SALVATAGGIO PREVISIONI E SNAPSHOTS (bulk, una transazione)
+        stage_start = time.perf_counter()
+        with transaction.atomic():
+            predictions = self.save_predictions(round_rows, round_preds)
+            self.save_snapshots(round_rows)
+        timings['write'] = time.perf_counter() - stage_start
+
+        # 6. OPPORTUNITÀ: calcolate una volta qui, dashboard e schedina leggono la tabella
+        stage_start = time.perf_counter()
+        OpportunityService.refresh(predictions)
+        timings['opportunities'] = time.perf_counter() - stage_start
+
+        count = len(round_rows)
+
+        # Nuovi snapshot scritti: l'indice ELO condiviso va ricostruito
+        if count:
+            EloTimeline.invalidate()
 
-            # Create a clean copy for ML input (remove non-numerical form strings)
-            ml_input_row = features_row.copy()
-            if 'home_form_sequence' in ml_input_row:
-                del ml_input_row['home_form_sequence']
-            if 'away_form_sequence' in ml_input_row:
-                del ml_input_row['away_form_sequence']
-
-            # Preparazione DataFrame (1 riga)
-            X_input = pd.DataFrame([ml_input_row])
-
-            # 5. PREDIZIONE PER OGNI TARGET
-            preds = {}
-            for target_name, model in models_dict.items():
-                # XGBoost vuole le colonne nello stesso ordine del training.
-                # Assicuriamoci che X_input abbia le colonne giuste.
-                # (I nomi feature coincidono con train_model.py)
-                try:
-                    val = model.predict(X_input)[0]
-                    # Arrotondamento intelligente
-                    if 'goals' in target_name or 'cards' in target_name or 'offsides' in target_name:
-                        preds[target_name] = int(round(max(0, val))) # Interi non negativi
-                    else:
-                        preds[target_name] = int(round(max(0, val))) # Anche tiri e corner meglio interi
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Errore predizione {target_name} per {match}: {e}"))
-                    preds[target_name] = 0
-
-            # 6. SALVATAGGIO PREVISIONE NEL DB
-            Prediction.objects.update_or_create(
-                match=match,
-                defaults={
-                    'home_goals': preds.get('home_goals', 0),
-                    'home_possession': preds.get('home_possession', 50),
-                    'home_total_shots': preds.get('home_total_shots', 0),
-                    'home_shots_on_target': preds.get('home_shots_on_target', 0),
-                    'home_corners': preds.get('home_corners', 0),
-                    'home_fouls': preds.get('home_fouls', 0),
-                    'home_yellow_cards': preds.get('home_yellow_cards', 0),
-                    'home_offsides': preds.get('home_offsides', 0),
-                    
-                    'away_goals': preds.get('away_goals', 0),
-                    'away_possession': preds.get('away_possession', 50),
-                    'away_total_shots': preds.get('away_total_shots', 0),
-                    'away_shots_on_target': preds.get('away_shots_on_target', 0),
-                    'away_corners': preds.get('away_corners', 0),
-                    'away_fouls': preds.get('away_fouls', 0),
-                    'away_yellow_cards': preds.get('away_yellow_cards', 0),
-                    'away_offsides': preds.get('away_offsides', 0),
-                }
-            )
-            count += 1
-            
         self.stdout.write(self.style.SUCCESS(f"Generate {count} previsioni."))
+        self.stdout.write("Tempi: " + ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in timings.items()))
 
-    def save_snapshots(self, match, feats):
+    def predict_round(self, models_dict, round_rows):
         """
-        Salva i TeamFormSnapshot per visualizzare le statistiche pre-match (barre, indici) nella dashboard.
+        Impila le feature della giornata in un'unica matrice e chiama ogni modello una volta.
+        Restituisce una lista di dict {target: valore} nello stesso ordine di round_rows.
         """
-        # --- HOME SNAPSHOT ---
-        TeamFormSnapshot.objects.update_or_create(
-            match=match,
-            team=match.home_team,
-            defaults={
-                'last_5_matches_points': feats['home_last_5_pts'],
-                'rest_days': feats['home_rest_days'],
-                'elo_rating': feats['home_elo'],
-                'avg_xg_last_5': feats['home_avg_xg'],
-                'avg_goals_scored_last_5': feats['home_avg_gf'],
-                'avg_goals_conceded_last_5': feats['home_avg_ga'],
-                
-                'xg_ratio_last_5': feats['home_xg_ratio'],
-                'efficiency_attack_last_5': feats['home_eff_att'],
-                'efficiency_defense_last_5': feats['home_eff_def'],
-                'goal_volatility_last_5': feats['home_volatility'],
-                
-                'is_derby': feats['home_is_derby'],
-                'pressure_index': feats['home_pressure_index'],
-                'starters_avg_xg_last_5': feats['home_starters_xg'],
-                'form_sequence': feats.get('home_form_sequence', '')
-            }
-        )
+        # Copia pulita per l'input ML (senza le stringhe di forma)
+        ml_rows = []
+        for _, features_row in round_rows:
+            ml_input_row = features_row.copy()
+            ml_input_row.pop('home_form_sequence', None)
+            ml_input_row.pop('away_form_sequence', None)
+            ml_rows.append(ml_input_row)
 
-        # --- AWAY SNAPSHOT ---
-        TeamFormSnapshot.objects.update_or_create(
-            match=match,
-            team=match.away_team,
-            defaults={
-                'last_5_matches_points': feats['away_last_5_pts'],
-                'rest_days': feats['away_rest_days'],
-                'elo_rating': feats['away_elo'],
-                'avg_xg_last_5': feats['away_avg_xg'],
-                'avg_goals_scored_last_5': feats['away_avg_gf'],
-                'avg_goals_conceded_last_5': feats['away_avg_ga'],
-                
-                'xg_ratio_last_5': feats['away_xg_ratio'],
-                'efficiency_attack_last_5': feats['away_eff_att'],
-                'efficiency_defense_last_5': feats['away_eff_def'],
-                'goal_volatility_last_5': feats['away_volatility'],
-                
-                'is_derby': feats['away_is_derby'],
-                'pressure_index': feats['away_pressure_index'],
-                'starters_avg_xg_last_5': feats['away_starters_xg'],
-                'form_sequence': feats.get('away_form_sequence', '')
+        # XGBoost vuole le colonne nello stesso ordine del training
+        # (I nomi feature coincidono con train_model.py)
+        X_input = pd.DataFrame(ml_rows)
+
+        round_preds = [{} for _ in round_rows]
+        for target_name, model in models_dict.items():
+            # Solo le colonne viste in training (modelli di versioni con meno feature)
+            feature_names = getattr(model, 'feature_names_in_', None)
+            X_model = X_input[list(feature_names)] if feature_names is not None else X_input
+            try:
+                values = model.predict(X_model)
+            except Exception:
+                # Si riprova partita per partita: l'errore resta confinato alle righe che lo causano
+                logger.exception("Predizione %s fallita per la giornata, ripiego partita per partita", target_name)
+                values = self.predict_each(target_name, model, X_model, round_rows)
+
+            for preds, val in zip(round_preds, values):
+                # None = target non predetto per quella partita: save_predictions usa PREDICTION_DEFAULTS
+                if val is not None:
+                    # Interi non negativi (goal, tiri, corner, cartellini...)
+                    preds[target_name] = int(round(max(0, val)))
+        return round_preds
+
+    def predict_each(self, target_name, model, X_model, round_rows):
+        """ Predizione del target riga per riga; None per le partite in cui il modello fallisce. """
+        values = []
+        for i, (match, _) in enumerate(round_rows):
+            try:
+                values.append(model.predict(X_model.iloc[[i]])[0])
+            except Exception as e:
+                logger.error("Errore predizione %s per %s (id %s): %s", target_name, match, match.id, e)
+                self.stdout.write(self.style.ERROR(f"Errore predizione {target_name} per {match}: {e}"))
+                values.append(None)
+        return values
+
+    def save_predictions(self, round_rows, round_preds):
+        """ Upsert delle Prediction della giornata: un bulk_update e un bulk_create. Restituisce le Prediction salvate. """
+        match_ids = [match.id for match, _ in round_rows]
+        existing = {}
+        for pred in Prediction.objects.filter(match_id__in=match_ids).order_by('id'):
+            existing.setdefault(pred.match_id, pred)
+
+        to_create, to_update = [], []
+        now = timezone.now()
+        for (match, _), preds in zip(round_rows, round_preds):
+            values = {
+                field: preds.get(field, default)
+                for field, default in PREDICTION_DEFAULTS.items()
             }
+            pred = existing.get(match.id)
+            if pred is None:
+                to_create.append(Prediction(match=match, **values))
+            else:
+                for field, value in values.items():
+                    setattr(pred, field, value)
+                pred.updated_at = now  # bulk_update non applica auto_now
+                to_update.append(pred)
+
+        Prediction.objects.bulk_update(to_update, [*PREDICTION_DEFAULTS, 'updated_at'], batch_size=500)
+        Prediction.objects.bulk_create(to_create, batch_size=500)
+        # Le scritture bulk non inviano segnali: contesto di match_detail scartato qui
+        invalidate_match_detail(match_ids)
+        return to_update + to_create
+
+    def save_snapshots(self, round_rows):
+        """
+        Salva i TeamFormSnapshot per visualizzare le statistiche pre-match (barre, indici) nella dashboard.
+        Un solo INSERT ... ON CONFLICT (match, team) DO UPDATE per tutta la giornata.
+        """
+        snapshots = []
+        for match, feats in round_rows:
+            for side, team in (('home', match.home_team), ('away', match.away_team)):
+                snapshots.append(TeamFormSnapshot(
+                    match=match,
+                    team=team,
+                    **{field: feats[f"{side}_{key}"] for field, key in SNAPSHOT_ROW_KEYS.items()},
+                    form_sequence=feats.get(f"{side}_form_sequence", '')
+                ))
+
+        TeamFormSnapshot.objects.bulk_create(
+            snapshots,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['match', 'team'],
+            update_fields=list(SNAPSHOT_ROW_KEYS) + ['form_sequence'],
         )
+        invalidate_match_detail([match.id for match, _ in round_rows])
 
     def get_pre_match_features(self, match):
         """
@@ -204,6 +293,9 @@ class Command(BaseCommand):
         row['home_is_derby'] = stats_home['is_derby']
         row['home_pressure_index'] = stats_home['pressure_index']
         row['home_starters_xg'] = stats_home['starters_xg']
+        # --- Classifica ---
+        row['home_league_position'] = stats_home['league_position']
+        row['home_points_gap_top'] = stats_home['points_gap_top']
         row['home_form_sequence'] = stats_home.get('form_sequence', '')
 
         row['away_last_5_pts'] = stats_away['points']
@@ -221,6 +313,9 @@ class Command(BaseCommand):
         row['away_is_derby'] = stats_away['is_derby']
         row['away_pressure_index'] = stats_away['pressure_index']
         row['away_starters_xg'] = stats_away['starters_xg']
+        # --- Classifica ---
+        row['away_league_position'] = stats_away['league_position']
+        row['away_points_gap_top'] = stats_away['points_gap_top']
         row['away_form_sequence'] = stats_away.get('form_sequence', '')
 
         return row
\ No newline at end of file
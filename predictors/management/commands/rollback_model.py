@@ -0,0 +1,38 @@
+from django.core.management.base import CommandError
+from predictors.pipeline_progress import InstrumentedCommand
+from predictors.model_store import ModelStore
+from predictors.models import ModelRegistry
+
+
+class Command(InstrumentedCommand):
+    help = 'Riattiva la versione precedente dei modelli (o quella indicata) ritirando quella attiva'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model_version', nargs='?', default=None, help='Versione da riattivare (default: la precedente)')
+        parser.add_argument('--list', action='store_true', help='Elenca le versioni salvate con il MAE di validazione')
+
+    def handle(self, *args, **options):
+        if options['list']:
+            self._list()
+            return
+
+        try:
+            retired, active = ModelStore.rollback(options['model_version'])
+        except (ModelRegistry.DoesNotExist, FileNotFoundError) as e:
+            raise CommandError(str(e))
+
+        if retired is not None and retired.pk != active.pk:
+            self.stdout.write(f"Versione {retired.version} ritirata: train_model non la riaddestrerà sugli stessi dati.")
+        self.stdout.write(self.style.SUCCESS(f"Versione attiva: {active.version}. I processi attivi la caricheranno senza riavvio."))
+
+    def _list(self):
+        for registry in ModelRegistry.objects.exclude(version='').order_by('-created_at'):
+            if registry.is_active:
+                state = "ATTIVA"
+            elif registry.rolled_back_at:
+                state = f"ritirata il {registry.rolled_back_at:%d/%m/%Y %H:%M}"
+            else:
+                state = ""
+            mae = ", ".join(f"{target} {value:.2f}" for target, value in sorted(registry.metrics.items())) or "MAE n/d"
+            files = "" if ModelStore.has_artifacts(registry) else " [file assenti]"
+            self.stdout.write(f"{registry.version} | {registry.training_rows} partite | {state}{files}\n    {mae}")
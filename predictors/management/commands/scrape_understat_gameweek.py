@@ -2,15 +2,15 @@ import requests
 import re
 import json
 import codecs
-from django.core.management.base import BaseCommand
 from bs4 import BeautifulSoup
 from predictors.models import Match, MatchResult, Team, League, Season, Player, PlayerMatchStat
+from predictors.impact import ResultImpact
+from predictors.pipeline_progress import InstrumentedCommand, report_progress
 from django.db import transaction
 from django.utils import timezone
-from django.core.cache import cache
 from datetime import datetime
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Scrape match stats (Goals, xG, Shots, Yellow Cards) for a specific gameweek from Understat.'
 
     def add_arguments(self, parser):
@@ -101,7 +101,10 @@ class Command(BaseCommand):
 
         # 3. Process each local match and find it in Understat data
         count_updated = 0
-        for local_match in target_matches:
+        updated_matches = []
+        total_matches = len(target_matches)
+        for done, local_match in enumerate(target_matches, start=1):
+            report_progress(done, total_matches)
             db_home = local_match.home_team.name
             db_away = local_match.away_team.name
             
@@ -200,14 +203,19 @@ class Command(BaseCommand):
                         local_match.save()
                         
                         count_updated += 1
+                        updated_matches.append(local_match)
                         self.stdout.write(self.style.SUCCESS(f"  -> New Result! Score: {u_home_goals}-{u_away_goals}"))
                     else:
                         # Match result exists, but we just ran scrape_match_details so players are updated.
                         self.stdout.write(f"  -> Match result exists. Players updated/verified.")
 
-        if count_updated > 0:
-            cache.delete('performance_trend_data_v1')
-            self.stdout.write("Performance cache invalidated.")
+        # Ricalcolo mirato di snapshot, ELO e previsioni toccati dai nuovi risultati
+        if updated_matches:
+            impact = ResultImpact.propagate(updated_matches)
+            self.stdout.write(
+                f"Propagation: {impact['snapshots']} snapshots, ELO replayed on {impact['elo_matches']} matches, "
+                f"{impact['predictions']} predictions refreshed."
+            )
 
         self.stdout.write(self.style.SUCCESS(f"\nOperation completed. Updated {count_updated} matches."))
 
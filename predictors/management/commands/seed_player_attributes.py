@@ -1,8 +1,8 @@
 import random
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import Player, PlayerAttributes
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Popola gli attributi dei giocatori (pace, shooting, defending, etc.) con dati di base realistici.'
 
     def handle(self, *args, **kwargs):
@@ -1,8 +1,8 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.db.models import Count
 from predictors.models import Player, PlayerMatchStat
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Deduce e assegna il ruolo principale ai giocatori basandosi sullo storico partite.'
 
     def handle(self, *args, **kwargs):
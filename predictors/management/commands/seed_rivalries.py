@@ -1,7 +1,7 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import Team, Rivalry
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Popola il database con le rivalità storiche della Serie A'
 
     def handle(self, *args, **kwargs):
@@ -1,9 +1,9 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from predictors.models import Match, Prediction, Team
 from predictors.utils import get_multi_market_opportunities
 from unittest.mock import MagicMock
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Test the new Tactical Mismatch Engine logic'
 
     def handle(self, *args, **kwargs):
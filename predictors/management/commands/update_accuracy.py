@@ -1,10 +1,12 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.core.cache import cache
+from django.db import transaction
 from predictors.models import Match, Prediction, AccuracyProfile
 from predictors.utils import get_betting_config
+from predictors.services import OpportunityService
 from django.db.models import Q
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Analizza lo storico e aggiorna il profilo di accuratezza del modello per ogni mercato.'
 
     def handle(self, *args, **options):
@@ -88,20 +90,22 @@ class Command(BaseCommand):
                     stats_registry[label][direction]['ok'] += 1
 
         # --- 3. SALVATAGGIO NEL DB ---
+        # Un solo ricalcolo delle opportunità materializzate alla fine (non uno per profilo)
         count = 0
-        for stat_key, markets in stats_registry.items():
-            for market_key, data in markets.items():
-                if data['tot'] > 0:
-                    acc = (data['ok'] / data['tot']) * 100.0
-                    AccuracyProfile.objects.update_or_create(
-                        stat_type=stat_key,
-                        market_type=market_key,
-                        defaults={
-                            'accuracy': acc,
-                            'sample_size': data['tot']
-                        }
-                    )
-                    count += 1
+        with OpportunityService.deferred_refresh(), transaction.atomic():
+            for stat_key, markets in stats_registry.items():
+                for market_key, data in markets.items():
+                    if data['tot'] > 0:
+                        acc = (data['ok'] / data['tot']) * 100.0
+                        AccuracyProfile.objects.update_or_create(
+                            stat_type=stat_key,
+                            market_type=market_key,
+                            defaults={
+                                'accuracy': acc,
+                                'sample_size': data['tot']
+                            }
+                        )
+                        count += 1
         
         # 4. CACHE INVALIDATION (CRITICAL FIX)
         cache.delete('accuracy_profiles')
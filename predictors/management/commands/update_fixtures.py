@@ -1,14 +1,20 @@
 import requests
-from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.utils import timezone
 from datetime import datetime
 from predictors.models import Match, Team, Season, League, Referee
+from predictors.pipeline_progress import InstrumentedCommand, report_progress
+from predictors.current_state import CurrentState
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Scarica le prossime partite da Football-Data.org'
 
     def handle(self, *args, **kwargs):
+        # Prossime partite e giornata corrente: un ricalcolo alla fine per le squadre delle partite salvate
+        with CurrentState.deferred():
+            self.sync_fixtures()
+
+    def sync_fixtures(self):
         # --- CONFIGURAZIONE ---
         API_KEY = settings.FOOTBALL_DATA_API_KEY
         if not API_KEY:
@@ -41,7 +47,8 @@ class Command(BaseCommand):
             return
 
         count_new = 0
-        for m in matches_data:
+        for done, m in enumerate(matches_data, start=1):
+            report_progress(done, len(matches_data))
             # Dati dall'API
             home_name = m['homeTeam']['name']
             away_name = m['awayTeam']['name']
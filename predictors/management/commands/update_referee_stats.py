@@ -1,8 +1,8 @@
-from django.core.management.base import BaseCommand
+from predictors.pipeline_progress import InstrumentedCommand
 from django.db.models import Count
 from predictors.models import Referee, Match, MatchResult
 
-class Command(BaseCommand):
+class Command(InstrumentedCommand):
     help = 'Calcola e aggiorna le statistiche storiche degli arbitri (media cartellini).'
 
     def handle(self, *args, **kwargs):
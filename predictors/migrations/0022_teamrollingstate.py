@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0021_referee_match_referee_topscorer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamRollingState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('home_results', models.JSONField(blank=True, default=list, verbose_name='Ultime partite in casa')),
+                ('away_results', models.JSONField(blank=True, default=list, verbose_name='Ultime partite in trasferta')),
+                ('totals', models.JSONField(blank=True, default=dict, verbose_name='Somme ultime 5 (totale/casa/trasferta)')),
+                ('last_match_date', models.DateTimeField(blank=True, null=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='predictors.season')),
+                ('team', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rolling_state', to='predictors.team')),
+            ],
+            options={
+                'verbose_name': 'Stato Rolling Squadra',
+                'verbose_name_plural': 'Stati Rolling Squadre',
+            },
+        ),
+    ]
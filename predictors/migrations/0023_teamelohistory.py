@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0022_teamrollingstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamEloHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_time', models.DateTimeField(verbose_name='Data Match')),
+                ('elo_before', models.FloatField(verbose_name='ELO Pre-Match')),
+                ('elo_after', models.FloatField(verbose_name='ELO Post-Match')),
+                ('winner', models.CharField(help_text='Se il risultato viene corretto, il calcolo riparte da questa partita', max_length=1, verbose_name='Esito usato nel calcolo')),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='elo_history', to='predictors.match')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='elo_history', to='predictors.team')),
+            ],
+            options={
+                'verbose_name': 'Storico ELO',
+                'verbose_name_plural': 'Storico ELO',
+                'indexes': [models.Index(fields=['team', 'date_time'], name='predictors__team_id_7cbf6b_idx')],
+                'unique_together': {('match', 'team')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0023_teamelohistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modelregistry',
+            name='artifact_dir',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Cartella Modelli'),
+        ),
+        migrations.AddField(
+            model_name='modelregistry',
+            name='targets',
+            field=models.JSONField(blank=True, default=list, verbose_name='Target'),
+        ),
+        migrations.AddField(
+            model_name='modelregistry',
+            name='version',
+            field=models.CharField(blank=True, db_index=True, help_text='I processi in esecuzione ricaricano i modelli quando cambia la versione attiva', max_length=50, verbose_name='Versione'),
+        ),
+    ]
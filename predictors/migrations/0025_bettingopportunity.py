@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0024_modelregistry_artifacts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='opportunities_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Opportunità aggiornate il'),
+        ),
+        migrations.CreateModel(
+            name='BettingOpportunity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.IntegerField(help_text='0 = migliore', verbose_name='Posizione')),
+                ('label', models.CharField(max_length=100, verbose_name='Mercato')),
+                ('category', models.CharField(max_length=50, verbose_name='Categoria')),
+                ('stat_type', models.CharField(max_length=20, verbose_name='Statistica')),
+                ('market_type', models.CharField(blank=True, max_length=10, verbose_name='Tipo Mercato')),
+                ('score', models.FloatField(verbose_name='Punteggio')),
+                ('raw_score', models.FloatField(verbose_name='Punteggio Base')),
+                ('multiplier', models.FloatField(default=1.0, verbose_name='Moltiplicatore Accuratezza')),
+                ('reasoning', models.TextField(blank=True, verbose_name='Motivazione')),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opportunities', to='predictors.match')),
+                ('prediction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='opportunities', to='predictors.prediction')),
+            ],
+            options={
+                'verbose_name': 'Opportunità',
+                'verbose_name_plural': 'Opportunità',
+                'ordering': ['prediction', 'rank'],
+                'indexes': [models.Index(fields=['prediction', 'rank'], name='predictors__predict_6a0704_idx')],
+            },
+        ),
+    ]
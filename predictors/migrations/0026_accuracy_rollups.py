@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0025_bettingopportunity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoundAccuracy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round_number', models.IntegerField(unique=True, verbose_name='Giornata')),
+                ('matches_count', models.IntegerField(default=0, verbose_name='Partite')),
+                ('global_score_avg', models.FloatField(default=0)),
+                ('acc_1x2', models.FloatField(default=0)),
+                ('acc_total_goals', models.FloatField(default=0)),
+                ('acc_total_shots', models.FloatField(default=0)),
+                ('acc_shots_ot', models.FloatField(default=0)),
+                ('acc_corners', models.FloatField(default=0)),
+                ('acc_fouls', models.FloatField(default=0)),
+                ('acc_cards', models.FloatField(default=0)),
+                ('acc_offsides', models.FloatField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Accuratezza Giornata',
+                'verbose_name_plural': 'Accuratezza Giornate',
+                'ordering': ['round_number'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MatchAccuracy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round_number', models.IntegerField(db_index=True, verbose_name='Giornata')),
+                ('score_1x2', models.FloatField()),
+                ('score_goals', models.FloatField()),
+                ('score_shots', models.FloatField()),
+                ('score_shots_ot', models.FloatField()),
+                ('score_corners', models.FloatField()),
+                ('score_fouls', models.FloatField()),
+                ('score_cards', models.FloatField()),
+                ('score_offsides', models.FloatField()),
+                ('score', models.FloatField(verbose_name='Media Partita')),
+                ('color', models.CharField(choices=[('green', 'Verde'), ('yellow', 'Giallo'), ('red', 'Rosso')], max_length=10)),
+                ('is_correct_1x2', models.BooleanField(default=False, verbose_name='Segno Corretto')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('match', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='accuracy', to='predictors.match')),
+                ('prediction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='predictors.prediction')),
+            ],
+            options={
+                'verbose_name': 'Accuratezza Partita',
+                'verbose_name_plural': 'Accuratezza Partite',
+            },
+        ),
+    ]
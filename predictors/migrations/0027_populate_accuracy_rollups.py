@@ -0,0 +1,108 @@
+from django.db import migrations
+from django.utils import timezone
+
+# Copia congelata di utils.score_match_accuracy / average_accuracy_metrics:
+# le migrazioni non importano il codice dell'app, che può cambiare dopo.
+ACCURACY_METRIC_SCORES = {
+    'acc_1x2': 'score_1x2',
+    'acc_total_goals': 'score_goals',
+    'acc_total_shots': 'score_shots',
+    'acc_shots_ot': 'score_shots_ot',
+    'acc_corners': 'score_corners',
+    'acc_fouls': 'score_fouls',
+    'acc_cards': 'score_cards',
+    'acc_offsides': 'score_offsides',
+}
+SCORE_FIELDS = list(ACCURACY_METRIC_SCORES.values()) + ['score', 'color', 'is_correct_1x2']
+
+# (campo previsione casa, campo previsione trasferta, chiave statistica, tolleranza, scarto massimo)
+STAT_SCORES = {
+    'score_shots': ('home_total_shots', 'away_total_shots', 'tiri_totali', 2.0, 10.0),
+    'score_shots_ot': ('home_shots_on_target', 'away_shots_on_target', 'tiri_porta', 1.5, 6.0),
+    'score_corners': ('home_corners', 'away_corners', 'corner', 1.5, 6.0),
+    'score_fouls': ('home_fouls', 'away_fouls', 'falli', 2.0, 10.0),
+    'score_cards': ('home_yellow_cards', 'away_yellow_cards', 'gialli', 1.0, 4.0),
+    'score_offsides': ('home_offsides', 'away_offsides', 'fuorigioco', 1.0, 4.0),
+}
+
+
+def get_acc(pred_val, real_val, tolerance, max_diff):
+    diff = abs(pred_val - real_val)
+    if diff <= tolerance:
+        return 100.0
+    return max(0.0, 100.0 - ((diff / max_diff) * 100.0))
+
+
+def score_match_accuracy(pred, res):
+    pred_winner = 'X'
+    if pred.home_goals > pred.away_goals:
+        pred_winner = '1'
+    elif pred.away_goals > pred.home_goals:
+        pred_winner = '2'
+
+    home_stats, away_stats = res.home_stats or {}, res.away_stats or {}
+    scores = {
+        'score_1x2': 100 if pred_winner == res.winner else 0,
+        'score_goals': get_acc(pred.home_goals + pred.away_goals, res.home_goals + res.away_goals, 0.5, 3.0),
+    }
+    for field, (home_field, away_field, stat, tolerance, max_diff) in STAT_SCORES.items():
+        predicted = getattr(pred, home_field) + getattr(pred, away_field)
+        real = home_stats.get(stat, 0) + away_stats.get(stat, 0)
+        scores[field] = get_acc(predicted, real, tolerance, max_diff)
+
+    match_avg = sum(scores[field] for field in ACCURACY_METRIC_SCORES.values()) / 8.0
+    scores['score'] = round(match_avg, 1)
+    scores['color'] = 'green' if match_avg >= 80 else ('yellow' if match_avg >= 60 else 'red')
+    scores['is_correct_1x2'] = pred_winner == res.winner
+    return scores
+
+
+def average_accuracy_metrics(match_scores):
+    count = len(match_scores)
+    metrics = {k: round(sum(s[score_key] for s in match_scores) / count, 1) for k, score_key in ACCURACY_METRIC_SCORES.items()}
+    metrics['global_score_avg'] = round(sum(metrics.values()) / len(metrics), 1)
+    return metrics
+
+
+def populate_rollups(apps, schema_editor):
+    # Primo popolamento: poi le righe vengono aggiornate da AccuracyRollupService
+    Match = apps.get_model('predictors', 'Match')
+    Prediction = apps.get_model('predictors', 'Prediction')
+    MatchAccuracy = apps.get_model('predictors', 'MatchAccuracy')
+    RoundAccuracy = apps.get_model('predictors', 'RoundAccuracy')
+
+    latest = {}
+    for pred in Prediction.objects.filter(match__status='FINISHED').order_by('created_at', 'id'):
+        latest[pred.match_id] = pred
+
+    rows = []
+    scores_by_round = {}
+    for match in Match.objects.filter(status='FINISHED', result__isnull=False).select_related('result').order_by('date_time'):
+        pred = latest.get(match.id)
+        if pred is None:
+            continue
+        scores = score_match_accuracy(pred, match.result)
+        rows.append(MatchAccuracy(
+            match=match,
+            prediction=pred,
+            round_number=match.round_number,
+            **{field: scores[field] for field in SCORE_FIELDS}
+        ))
+        scores_by_round.setdefault(match.round_number, []).append(scores)
+
+    MatchAccuracy.objects.bulk_create(rows, batch_size=500)
+    now = timezone.now()
+    RoundAccuracy.objects.bulk_create([
+        RoundAccuracy(round_number=r, matches_count=len(scores), updated_at=now, **average_accuracy_metrics(scores))
+        for r, scores in scores_by_round.items()
+    ], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0026_accuracy_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-16 22:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0027_populate_accuracy_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='teamformsnapshot',
+            name='league_position',
+            field=models.IntegerField(default=0, help_text='0 = classifica non disponibile', verbose_name='Posizione in Classifica'),
+        ),
+        migrations.AddField(
+            model_name='teamformsnapshot',
+            name='points_gap_top',
+            field=models.IntegerField(default=0, verbose_name='Punti dalla Vetta'),
+        ),
+        migrations.CreateModel(
+            name='StandingEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round_number', models.IntegerField(verbose_name='Giornata')),
+                ('position', models.IntegerField(verbose_name='Posizione')),
+                ('played', models.IntegerField(default=0, verbose_name='Giocate')),
+                ('won', models.IntegerField(default=0, verbose_name='Vinte')),
+                ('drawn', models.IntegerField(default=0, verbose_name='Pareggiate')),
+                ('lost', models.IntegerField(default=0, verbose_name='Perse')),
+                ('gf', models.IntegerField(default=0, verbose_name='Goal Fatti')),
+                ('ga', models.IntegerField(default=0, verbose_name='Goal Subiti')),
+                ('points', models.IntegerField(default=0, verbose_name='Punti')),
+                ('points_gap_top', models.IntegerField(default=0, verbose_name='Punti dalla Vetta')),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standings', to='predictors.season')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='standings', to='predictors.team')),
+            ],
+            options={
+                'verbose_name': 'Classifica (Giornata)',
+                'verbose_name_plural': 'Classifiche (Giornata)',
+                'ordering': ['season', 'round_number', 'position'],
+                'indexes': [models.Index(fields=['season', 'team', 'round_number'], name='predictors__season__e22b07_idx')],
+                'unique_together': {('season', 'round_number', 'team')},
+            },
+        ),
+    ]
@@ -0,0 +1,68 @@
+from django.db import migrations
+
+TOTAL_FIELDS = ('played', 'won', 'drawn', 'lost', 'gf', 'ga', 'points')
+
+
+def compute_tables(team_ids, results):
+    # Copia congelata di standings.compute_tables: le migrazioni non importano il codice dell'app
+    by_round = {}
+    for row in results:
+        by_round.setdefault(row[0], []).append(row)
+    if not by_round:
+        return {}
+
+    totals = {team_id: dict.fromkeys(TOTAL_FIELDS, 0) for team_id in team_ids}
+    tables = {}
+    for round_number in range(min(by_round), max(by_round) + 1):
+        for _, home_id, away_id, home_goals, away_goals, winner in by_round.get(round_number, []):
+            for team_id, gf, ga, outcome in (
+                (home_id, home_goals, away_goals, {'1': 'won', 'X': 'drawn', '2': 'lost'}[winner]),
+                (away_id, away_goals, home_goals, {'1': 'lost', 'X': 'drawn', '2': 'won'}[winner]),
+            ):
+                t = totals.setdefault(team_id, dict.fromkeys(TOTAL_FIELDS, 0))
+                t['played'] += 1
+                t[outcome] += 1
+                t['gf'] += gf
+                t['ga'] += ga
+                t['points'] += {'won': 3, 'drawn': 1, 'lost': 0}[outcome]
+
+        ranking = sorted(
+            totals.items(),
+            key=lambda item: (-item[1]['points'], -(item[1]['gf'] - item[1]['ga']), -item[1]['gf'], item[0])
+        )
+        leader_points = ranking[0][1]['points']
+        tables[round_number] = [
+            dict(t, team_id=team_id, position=position, points_gap_top=leader_points - t['points'])
+            for position, (team_id, t) in enumerate(ranking, start=1)
+        ]
+    return tables
+
+def populate_standings(apps, schema_editor):
+    # Primo popolamento del ledger: poi aggiornato da StandingsLedger a ogni risultato
+    Season = apps.get_model('predictors', 'Season')
+    Match = apps.get_model('predictors', 'Match')
+    StandingEntry = apps.get_model('predictors', 'StandingEntry')
+
+    for season in Season.objects.all():
+        matches = Match.objects.filter(season=season)
+        team_ids = set()
+        for home_id, away_id in matches.values_list('home_team_id', 'away_team_id'):
+            team_ids.update((home_id, away_id))
+        results = matches.filter(status='FINISHED', result__isnull=False).values_list(
+            'round_number', 'home_team_id', 'away_team_id', 'result__home_goals', 'result__away_goals', 'result__winner'
+        )
+        StandingEntry.objects.bulk_create([
+            StandingEntry(season=season, round_number=round_number, **row)
+            for round_number, table in compute_tables(team_ids, results).items()
+            for row in table
+        ], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0028_standings_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_standings, migrations.RunPython.noop),
+    ]
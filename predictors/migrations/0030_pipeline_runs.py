@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0029_populate_standings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('pipeline', 'Pipeline completa'), ('scraping', 'Scraping Understat')], default='pipeline', max_length=20, verbose_name='Tipo')),
+                ('state', models.CharField(choices=[('queued', 'In coda'), ('running', 'In corso'), ('completed', 'Completato'), ('error', 'Errore')], default='queued', max_length=20, verbose_name='Stato')),
+                ('message', models.CharField(blank=True, max_length=255, verbose_name='Messaggio')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Esecuzione Pipeline',
+                'verbose_name_plural': 'Esecuzioni Pipeline',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['kind', '-created_at'], name='predictors__kind_f72665_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StageRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.IntegerField(default=0)),
+                ('name', models.CharField(max_length=50, verbose_name='Fase')),
+                ('label', models.CharField(blank=True, max_length=255)),
+                ('weight', models.FloatField(default=1.0, help_text='Peso della fase nella percentuale complessiva')),
+                ('state', models.CharField(choices=[('pending', 'In attesa'), ('running', 'In corso'), ('completed', 'Completata'), ('error', 'Errore')], default='pending', max_length=20, verbose_name='Stato')),
+                ('done', models.IntegerField(default=0, verbose_name='Elementi elaborati')),
+                ('total', models.IntegerField(default=0, help_text='0 = avanzamento non disponibile', verbose_name='Elementi totali')),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('wall_time', models.FloatField(blank=True, null=True, verbose_name='Tempo (s)')),
+                ('query_count', models.IntegerField(blank=True, null=True, verbose_name='Query SQL')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stages', to='predictors.pipelinerun')),
+            ],
+            options={
+                'verbose_name': 'Fase Pipeline',
+                'verbose_name_plural': 'Fasi Pipeline',
+                'ordering': ['run', 'order'],
+                'unique_together': {('run', 'name')},
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0030_pipeline_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamSeasonAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('home_played', models.IntegerField(default=0, verbose_name='Giocate Casa')),
+                ('home_won', models.IntegerField(default=0, verbose_name='Vinte Casa')),
+                ('home_drawn', models.IntegerField(default=0, verbose_name='Pareggiate Casa')),
+                ('home_lost', models.IntegerField(default=0, verbose_name='Perse Casa')),
+                ('home_gf', models.IntegerField(default=0, verbose_name='Goal Fatti Casa')),
+                ('home_ga', models.IntegerField(default=0, verbose_name='Goal Subiti Casa')),
+                ('home_xg_for', models.FloatField(default=0.0, verbose_name='xG Fatti Casa')),
+                ('home_xg_against', models.FloatField(default=0.0, verbose_name='xG Subiti Casa')),
+                ('away_played', models.IntegerField(default=0, verbose_name='Giocate Trasferta')),
+                ('away_won', models.IntegerField(default=0, verbose_name='Vinte Trasferta')),
+                ('away_drawn', models.IntegerField(default=0, verbose_name='Pareggiate Trasferta')),
+                ('away_lost', models.IntegerField(default=0, verbose_name='Perse Trasferta')),
+                ('away_gf', models.IntegerField(default=0, verbose_name='Goal Fatti Trasferta')),
+                ('away_ga', models.IntegerField(default=0, verbose_name='Goal Subiti Trasferta')),
+                ('away_xg_for', models.FloatField(default=0.0, verbose_name='xG Fatti Trasferta')),
+                ('away_xg_against', models.FloatField(default=0.0, verbose_name='xG Subiti Trasferta')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Statistiche Squadra (Stagione)',
+                'verbose_name_plural': 'Statistiche Squadre (Stagione)',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['home_team', 'status', 'date_time', 'id'], name='match_home_calendar_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['away_team', 'status', 'date_time', 'id'], name='match_away_calendar_idx'),
+        ),
+        migrations.AddField(
+            model_name='teamseasonaggregate',
+            name='season',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='team_aggregates', to='predictors.season'),
+        ),
+        migrations.AddField(
+            model_name='teamseasonaggregate',
+            name='team',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='season_aggregates', to='predictors.team'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='teamseasonaggregate',
+            unique_together={('team', 'season')},
+        ),
+    ]
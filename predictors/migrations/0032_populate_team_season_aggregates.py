@@ -0,0 +1,53 @@
+from django.db import migrations
+
+# Copia congelata di team_stats.compute_aggregates: le migrazioni non importano il codice dell'app
+SIDE_FIELDS = ('played', 'won', 'drawn', 'lost', 'gf', 'ga', 'xg_for', 'xg_against')
+AGGREGATE_FIELDS = tuple(f"{side}_{field}" for side in ('home', 'away') for field in SIDE_FIELDS)
+RESULT_COLUMNS = (
+    'season_id', 'home_team_id', 'away_team_id',
+    'result__home_goals', 'result__away_goals', 'result__winner',
+    'result__home_stats', 'result__away_stats',
+)
+
+
+def _xg(stats):
+    return float((stats or {}).get('xg') or 0.0)
+
+
+def compute_aggregates(results):
+    totals = {}
+    for season_id, home_id, away_id, home_goals, away_goals, winner, home_stats, away_stats in results:
+        home_xg, away_xg = _xg(home_stats), _xg(away_stats)
+        for side, team_id, gf, ga, xg_for, xg_against, outcome in (
+            ('home', home_id, home_goals, away_goals, home_xg, away_xg, {'1': 'won', 'X': 'drawn', '2': 'lost'}[winner]),
+            ('away', away_id, away_goals, home_goals, away_xg, home_xg, {'1': 'lost', 'X': 'drawn', '2': 'won'}[winner]),
+        ):
+            t = totals.setdefault((team_id, season_id), dict.fromkeys(AGGREGATE_FIELDS, 0))
+            t[f'{side}_played'] += 1
+            t[f'{side}_{outcome}'] += 1
+            t[f'{side}_gf'] += gf
+            t[f'{side}_ga'] += ga
+            t[f'{side}_xg_for'] += xg_for
+            t[f'{side}_xg_against'] += xg_against
+    return totals
+
+def populate_team_aggregates(apps, schema_editor):
+    # Primo popolamento: poi aggiornato da TeamSeasonStats a ogni risultato
+    Match = apps.get_model('predictors', 'Match')
+    TeamSeasonAggregate = apps.get_model('predictors', 'TeamSeasonAggregate')
+
+    results = Match.objects.filter(status='FINISHED', result__isnull=False).values_list(*RESULT_COLUMNS)
+    TeamSeasonAggregate.objects.bulk_create([
+        TeamSeasonAggregate(team_id=team_id, season_id=season_id, **fields)
+        for (team_id, season_id), fields in compute_aggregates(results).items()
+    ], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0031_team_season_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_team_aggregates, migrations.RunPython.noop),
+    ]
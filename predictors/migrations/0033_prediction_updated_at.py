@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0032_populate_team_season_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prediction',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Aggiornata il'),
+        ),
+    ]
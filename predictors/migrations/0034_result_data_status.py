@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0033_prediction_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchresult',
+            name='data_status',
+            field=models.CharField(choices=[('yellow', 'Parziale'), ('green', 'Completo')], default='yellow', editable=False, max_length=10, verbose_name='Completezza Dati'),
+        ),
+        migrations.AddField(
+            model_name='matchresult',
+            name='missing_metrics',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Metriche Mancanti'),
+        ),
+        migrations.AddIndex(
+            model_name='matchresult',
+            index=models.Index(fields=['data_status'], name='predictors__data_st_a879db_idx'),
+        ),
+    ]
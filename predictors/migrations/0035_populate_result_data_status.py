@@ -0,0 +1,32 @@
+from django.db import migrations
+
+# Copia congelata di data_status.data_completeness: le migrazioni non importano il codice dell'app
+KEY_METRICS = ('xg', 'possession', 'corner', 'falli')
+
+
+def data_completeness(home_stats, away_stats):
+    missing = 0
+    for source in (home_stats or {}, away_stats or {}):
+        for key in KEY_METRICS:
+            value = source.get(key)
+            if not value or float(value) == 0:
+                missing += 1
+    return ('green', 0) if missing == 0 else ('yellow', missing)
+
+def populate_data_status(apps, schema_editor):
+    # Risultati già presenti: d'ora in poi lo stato è calcolato da MatchResult.save()
+    MatchResult = apps.get_model('predictors', 'MatchResult')
+    results = list(MatchResult.objects.only('id', 'home_stats', 'away_stats'))
+    for result in results:
+        result.data_status, result.missing_metrics = data_completeness(result.home_stats, result.away_stats)
+    MatchResult.objects.bulk_update(results, ['data_status', 'missing_metrics'], batch_size=500)
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0034_result_data_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_data_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0035_populate_result_data_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeagueState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_round', models.IntegerField(blank=True, null=True, verbose_name='Giornata Corrente')),
+                ('next_match_date', models.DateTimeField(blank=True, null=True, verbose_name='Data Prossima Partita')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('next_match', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='predictors.match', verbose_name='Prossima Partita')),
+                ('season', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='predictors.season')),
+            ],
+            options={
+                'verbose_name': 'Stato Campionato',
+                'verbose_name_plural': 'Stato Campionato',
+            },
+        ),
+        migrations.CreateModel(
+            name='TeamCurrentState',
+            fields=[
+                ('team', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='current_state', serialize=False, to='predictors.team')),
+                ('elo', models.FloatField(default=1500.0, verbose_name='ELO Attuale')),
+                ('form_sequence', models.CharField(blank=True, default='', max_length=20, verbose_name='Sequenza Forma')),
+                ('last_match_date', models.DateTimeField(blank=True, null=True, verbose_name='Data Ultima Partita')),
+                ('next_match_date', models.DateTimeField(blank=True, null=True, verbose_name='Data Prossima Partita')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_match', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='predictors.match', verbose_name='Ultima Partita')),
+                ('next_match', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='predictors.match', verbose_name='Prossima Partita')),
+            ],
+            options={
+                'verbose_name': 'Stato Corrente Squadra',
+                'verbose_name_plural': 'Stati Correnti Squadre',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0037_populate_team_current_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagerun',
+            name='fingerprint',
+            field=models.CharField(blank=True, max_length=40, verbose_name='Impronta input'),
+        ),
+        migrations.AlterField(
+            model_name='stagerun',
+            name='state',
+            field=models.CharField(choices=[('pending', 'In attesa'), ('running', 'In corso'), ('completed', 'Completata'), ('skipped', 'Saltata (input invariati)'), ('error', 'Errore')], default='pending', max_length=20, verbose_name='Stato'),
+        ),
+        migrations.AddIndex(
+            model_name='stagerun',
+            index=models.Index(fields=['name', '-finished_at'], name='predictors__name_dc21eb_idx'),
+        ),
+    ]
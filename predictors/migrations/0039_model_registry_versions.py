@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0038_stage_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='modelregistry',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, max_length=40, verbose_name='Impronta training'),
+        ),
+        migrations.AddField(
+            model_name='modelregistry',
+            name='metrics',
+            field=models.JSONField(blank=True, default=dict, help_text='{target: MAE} misurato in addestramento', verbose_name='MAE di validazione'),
+        ),
+        migrations.AddField(
+            model_name='modelregistry',
+            name='rolled_back_at',
+            field=models.DateTimeField(blank=True, help_text='Versione disattivata con rollback_model: non viene riaddestrata sugli stessi dati', null=True, verbose_name='Ritirato il'),
+        ),
+        migrations.AddField(
+            model_name='modelregistry',
+            name='training_rows',
+            field=models.IntegerField(default=0, verbose_name='Partite di training'),
+        ),
+    ]
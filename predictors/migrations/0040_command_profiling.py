@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0039_model_registry_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagerun',
+            name='cpu_time',
+            field=models.FloatField(blank=True, help_text='Thread della fase più processi figli terminati', null=True, verbose_name='Tempo CPU (s)'),
+        ),
+        migrations.AddField(
+            model_name='stagerun',
+            name='sql_time',
+            field=models.FloatField(blank=True, null=True, verbose_name='Tempo SQL (s)'),
+        ),
+        migrations.AddField(
+            model_name='stagerun',
+            name='top_queries',
+            field=models.JSONField(blank=True, default=list, help_text='[{sql, count, time}] per forma di query', verbose_name='Query più ripetute'),
+        ),
+        migrations.AlterField(
+            model_name='pipelinerun',
+            name='kind',
+            field=models.CharField(choices=[('pipeline', 'Pipeline completa'), ('scraping', 'Scraping Understat'), ('command', 'Comando singolo')], default='pipeline', max_length=20, verbose_name='Tipo'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+ACCURACY_METRIC_SCORES = {
+    'acc_1x2': 'score_1x2',
+    'acc_total_goals': 'score_goals',
+    'acc_total_shots': 'score_shots',
+    'acc_shots_ot': 'score_shots_ot',
+    'acc_corners': 'score_corners',
+    'acc_fouls': 'score_fouls',
+    'acc_cards': 'score_cards',
+    'acc_offsides': 'score_offsides',
+}
+
+
+def rebuild_rollups(apps, schema_editor):
+    # I rollup esistenti mescolavano le stagioni: ricalcolati per (stagione, giornata) dalle MatchAccuracy
+    MatchAccuracy = apps.get_model('predictors', 'MatchAccuracy')
+    RoundAccuracy = apps.get_model('predictors', 'RoundAccuracy')
+
+    scores_by_round = {}
+    rows = MatchAccuracy.objects.order_by('match__date_time').values('match__season_id', 'round_number', *ACCURACY_METRIC_SCORES.values())
+    for row in rows:
+        scores_by_round.setdefault((row['match__season_id'], row['round_number']), []).append(row)
+
+    rollups = []
+    now = timezone.now()
+    for (season_id, round_number), scores in scores_by_round.items():
+        metrics = {
+            k: round(sum(s[score_key] for s in scores) / len(scores), 1)
+            for k, score_key in ACCURACY_METRIC_SCORES.items()
+        }
+        metrics['global_score_avg'] = round(sum(metrics.values()) / len(metrics), 1)
+        rollups.append(RoundAccuracy(season_id=season_id, round_number=round_number, matches_count=len(scores), updated_at=now, **metrics))
+
+    RoundAccuracy.objects.all().delete()
+    RoundAccuracy.objects.bulk_create(rollups, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0040_command_profiling'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='roundaccuracy',
+            name='round_number',
+            field=models.IntegerField(verbose_name='Giornata'),
+        ),
+        migrations.AddField(
+            model_name='roundaccuracy',
+            name='season',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='round_accuracies', to='predictors.season'),
+        ),
+        migrations.RunPython(rebuild_rollups, migrations.RunPython.noop),
+    ]
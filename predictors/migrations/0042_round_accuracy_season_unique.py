@@ -0,0 +1,25 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0041_round_accuracy_season'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='roundaccuracy',
+            name='season',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='round_accuracies', to='predictors.season'),
+        ),
+        migrations.AlterModelOptions(
+            name='roundaccuracy',
+            options={'ordering': ['season', 'round_number'], 'verbose_name': 'Accuratezza Giornata', 'verbose_name_plural': 'Accuratezza Giornate'},
+        ),
+        migrations.AlterUniqueTogether(
+            name='roundaccuracy',
+            unique_together={('season', 'round_number')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0042_round_accuracy_season_unique'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stagerun',
+            name='cpu_time',
+            field=models.FloatField(blank=True, help_text="Thread della fase più processi figli terminati (solo se nessun'altra fase era in corso)", null=True, verbose_name='Tempo CPU (s)'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:30
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('predictors', '0043_stage_run_cpu_time_help'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='teamrollingstate',
+            name='totals',
+        ),
+    ]
@@ -0,0 +1,234 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import joblib
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from predictors.models import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class ModelStore:
+    """
+    Set di modelli XGBoost (un regressore per target) caricato in modo pigro.
+
+    - Nessun caricamento all'import dell'app: web worker che non predicono e
+      comandi come migrate non toccano i modelli.
+    - Ogni target è salvato nel formato binario nativo di XGBoost (.ubj) in
+      ML_MODELS_DIR/<versione>/. Ogni processo che predice (predict_upcoming,
+      eseguito dal worker qcluster) ne carica una propria copia al primo uso:
+      i worker web non predicono e non caricano i modelli.
+    - La versione attiva è in ModelRegistry: ogni processo la ricontrolla al
+      massimo ogni CHECK_INTERVAL secondi e, se è cambiata, carica il nuovo set
+      per intero e lo sostituisce in un colpo solo. Niente riavvio dopo train_model.
+    - Le versioni precedenti restano su disco: rollback() riattiva la precedente
+      cambiando solo la riga attiva in ModelRegistry.
+    """
+
+    CHECK_INTERVAL = 30  # secondi tra due controlli della versione attiva
+    FILE_EXTENSION = '.ubj'
+    LEGACY_PATH_NAME = 'ml_stats_models.pkl'
+    TRAINING_IDS_FILE = 'training_match_ids.npy'
+    TRAINING_CHECKSUMS_FILE = 'training_checksums.npy'
+
+    _models = None
+    _version = None
+    _last_check = 0.0
+    _lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        """ Dizionario {target: modello} della versione attiva (None se non ci sono modelli). """
+        now = time.monotonic()
+        if cls._models is not None and now - cls._last_check < cls.CHECK_INTERVAL:
+            return cls._models
+
+        with cls._lock:
+            if cls._models is not None and now - cls._last_check < cls.CHECK_INTERVAL:
+                return cls._models
+
+            active = cls.active_registry()
+            version = active.version if active else None
+            if cls._models is None or version != cls._version:
+                models_dict = cls._load(active)
+                if models_dict is not None:
+                    # Swap atomico: chi ha già il vecchio dizionario continua a usarlo
+                    cls._models, cls._version = models_dict, version
+            cls._last_check = now
+            return cls._models
+
+    @classmethod
+    def version(cls):
+        return cls._version
+
+    @classmethod
+    def invalidate(cls):
+        """ Forza il controllo della versione alla prossima get(). """
+        with cls._lock:
+            cls._last_check = 0.0
+
+    @staticmethod
+    def active_registry():
+        return ModelRegistry.objects.filter(is_active=True).exclude(version='').order_by('-created_at').first()
+
+    @staticmethod
+    def models_root():
+        return str(getattr(settings, 'ML_MODELS_DIR', os.path.join(settings.BASE_DIR, 'ml_models')))
+
+    @classmethod
+    def _load(cls, registry):
+        if registry is None:
+            return cls._load_legacy()
+
+        from xgboost import XGBRegressor
+
+        directory = os.path.join(cls.models_root(), registry.artifact_dir)
+        models_dict = {}
+        try:
+            for target in registry.targets:
+                model = XGBRegressor()
+                model.load_model(os.path.join(directory, f"{target}{cls.FILE_EXTENSION}"))
+                models_dict[target] = model
+        except Exception as e:
+            logger.error(f"Errore caricamento modelli versione {registry.version}: {e}")
+            return None
+
+        logger.info(f"Modelli ML versione {registry.version} caricati ({len(models_dict)} target).")
+        return models_dict
+
+    @classmethod
+    def _load_legacy(cls):
+        """ Fallback per installazioni senza modelli versionati: il vecchio pickle joblib. """
+        model_path = os.path.join(settings.BASE_DIR, cls.LEGACY_PATH_NAME)
+        if not os.path.exists(model_path):
+            logger.warning(f"Nessun modello attivo in ModelRegistry e file {model_path} assente.")
+            return None
+        try:
+            return joblib.load(model_path)
+        except Exception as e:
+            logger.error(f"Error loading ML models: {e}")
+            return None
+
+    @classmethod
+    def artifact_path(cls, registry, target):
+        return os.path.join(cls.models_root(), registry.artifact_dir, f"{target}{cls.FILE_EXTENSION}")
+
+    @classmethod
+    def training_rows(cls, registry):
+        """ (match_ids, checksums) delle righe usate per addestrare la versione (None se non salvate). """
+        directory = os.path.join(cls.models_root(), registry.artifact_dir)
+        try:
+            return (
+                np.load(os.path.join(directory, cls.TRAINING_IDS_FILE)),
+                np.load(os.path.join(directory, cls.TRAINING_CHECKSUMS_FILE)),
+            )
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def has_artifacts(cls, registry):
+        return bool(registry.targets) and all(os.path.exists(cls.artifact_path(registry, target)) for target in registry.targets)
+
+    @staticmethod
+    def trained_on(fingerprint):
+        """
+        Versione già addestrata con la stessa impronta da non rifare: quella attiva
+        oppure una ritirata con rollback_model (stessi dati, stesso modello scartato).
+        """
+        if not fingerprint:
+            return None
+        return ModelRegistry.objects.filter(fingerprint=fingerprint).exclude(version='').filter(
+            Q(is_active=True) | Q(rolled_back_at__isnull=False)
+        ).order_by('-is_active', '-created_at').first()
+
+    @classmethod
+    def activate(cls, registry, retire_current=False):
+        """
+        Rende attiva una versione già salvata (i processi la caricano al prossimo controllo).
+        retire_current=True segna la versione attiva come ritirata (rollback).
+        """
+        if not cls.has_artifacts(registry):
+            raise FileNotFoundError(f"File della versione {registry.version} assenti in {cls.models_root()}")
+
+        with transaction.atomic():
+            current = ModelRegistry.objects.filter(is_active=True).exclude(version='').exclude(pk=registry.pk)
+            if retire_current:
+                current.update(is_active=False, rolled_back_at=timezone.now())
+            else:
+                current.update(is_active=False)
+            ModelRegistry.objects.filter(pk=registry.pk).update(is_active=True, rolled_back_at=None)
+
+        cls.invalidate()
+        registry.refresh_from_db()
+        return registry
+
+    @classmethod
+    def rollback(cls, version=None):
+        """
+        Ritira la versione attiva e riattiva version (default: la versione
+        precedente con i file ancora su disco). Restituisce (ritirata, attivata).
+        """
+        current = cls.active_registry()
+        candidates = ModelRegistry.objects.exclude(version='').order_by('-created_at')
+        if version is not None:
+            target = candidates.filter(version=version).first()
+            if target is None:
+                raise ModelRegistry.DoesNotExist(f"Versione {version} inesistente")
+        else:
+            if current is not None:
+                candidates = candidates.filter(created_at__lt=current.created_at)
+            target = next((registry for registry in candidates.filter(rolled_back_at__isnull=True) if cls.has_artifacts(registry)), None)
+            if target is None:
+                raise ModelRegistry.DoesNotExist("Nessuna versione precedente disponibile")
+        return current, cls.activate(target, retire_current=True)
+
+    @classmethod
+    def publish(cls, models_dict, description='', training_set=None, fingerprint='', metrics=None):
+        """
+        Salva un nuovo set di modelli e lo rende attivo.
+        I file vengono scritti in una cartella temporanea e rinominati nella
+        cartella definitiva prima di registrare la versione: un processo che
+        vede la nuova versione trova sempre tutti i file.
+        Con training_set vengono salvati anche id e checksum delle righe usate
+        (servono al warm start dell'addestramento successivo). fingerprint e
+        metrics ({target: MAE}) sono registrati sulla versione.
+        """
+        version = timezone.now().strftime('%Y%m%d%H%M%S%f')
+        root = cls.models_root()
+        os.makedirs(root, exist_ok=True)
+
+        tmp_dir = tempfile.mkdtemp(prefix=f".{version}-", dir=root)
+        try:
+            for target, model in models_dict.items():
+                model.save_model(os.path.join(tmp_dir, f"{target}{cls.FILE_EXTENSION}"))
+            if training_set is not None:
+                np.save(os.path.join(tmp_dir, cls.TRAINING_IDS_FILE), np.asarray(training_set.match_ids))
+                np.save(os.path.join(tmp_dir, cls.TRAINING_CHECKSUMS_FILE), np.asarray(training_set.checksums))
+            os.replace(tmp_dir, os.path.join(root, version))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        with transaction.atomic():
+            ModelRegistry.objects.filter(is_active=True).exclude(version='').update(is_active=False)
+            registry = ModelRegistry.objects.create(
+                name=f"XGBoost_{version}",
+                description=description,
+                is_active=True,
+                version=version,
+                artifact_dir=version,
+                targets=list(models_dict.keys()),
+                fingerprint=fingerprint,
+                metrics=metrics or {},
+                training_rows=len(training_set) if training_set is not None else 0,
+            )
+
+        cls.invalidate()
+        return registry
@@ -1,6 +1,7 @@
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.postgres.fields import ArrayField 
+from predictors.data_status import data_completeness
 
 # ==========================================
 # 1. MODULO ANAGRAFICA (Statico)
@@ -171,6 +172,11 @@ class Match(models.Model):
         verbose_name = "Match"
         verbose_name_plural = "Match"
         ordering = ['date_time']
+        indexes = [
+            # Calendario di una squadra a pagine (keyset su data, id)
+            models.Index(fields=['home_team', 'status', 'date_time', 'id'], name='match_home_calendar_idx'),
+            models.Index(fields=['away_team', 'status', 'date_time', 'id'], name='match_away_calendar_idx'),
+        ]
 
 class MatchResult(models.Model):
     """
@@ -189,12 +195,24 @@ class MatchResult(models.Model):
     home_stats = models.JSONField(default=dict, blank=True, verbose_name="Stats Casa (JSON)")
     away_stats = models.JSONField(default=dict, blank=True, verbose_name="Stats Ospite (JSON)")
 
+    # Semaforo completezza dati, ricalcolato a ogni save() (vedi predictors.data_status)
+    DATA_STATUS_CHOICES = [('yellow', 'Parziale'), ('green', 'Completo')]
+    data_status = models.CharField(max_length=10, choices=DATA_STATUS_CHOICES, default='yellow', editable=False, verbose_name="Completezza Dati")
+    missing_metrics = models.IntegerField(default=0, editable=False, verbose_name="Metriche Mancanti")
+
     def __str__(self):
         return f"Risultato {self.match}: {self.home_goals}-{self.away_goals}"
 
+    def save(self, *args, **kwargs):
+        self.data_status, self.missing_metrics = data_completeness(self.home_stats, self.away_stats)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'data_status', 'missing_metrics'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = "Risultato Match"
         verbose_name_plural = "Risultati Match"
+        indexes = [models.Index(fields=['data_status'])]
 
 class PlayerMatchStat(models.Model):
     """
@@ -366,11 +384,177 @@ class TeamFormSnapshot(models.Model):
     starters_avg_rating_last_5 = models.FloatField(default=6.0, verbose_name="Media Voto Titolari (last 5)")
     key_players_impact_score = models.FloatField(default=1.0, verbose_name="Impatto Giocatori Chiave (0-1)")
 
+    # --- CLASSIFICA (partite della stagione giocate prima del calcio d'inizio) ---
+    league_position = models.IntegerField(default=0, verbose_name="Posizione in Classifica", help_text="0 = classifica non disponibile")
+    points_gap_top = models.IntegerField(default=0, verbose_name="Punti dalla Vetta")
+
     class Meta:
         verbose_name = "Snapshot Forma"
         verbose_name_plural = "Snapshot Forma"
         unique_together = ('match', 'team')
 
+class TeamRollingState(models.Model):
+    """
+    Stato 'rolling' persistente di una squadra nella stagione in corso.
+    Ring buffer delle ultime N partite divise per campo (Newest->Oldest).
+    Aggiornato a ogni salvataggio o cancellazione di un MatchResult
+    (vedi predictors.rolling_state), evita di rileggere lo storico per le feature.
+    """
+    BUFFER_SIZE = 15
+
+    team = models.OneToOneField(Team, on_delete=models.CASCADE, related_name='rolling_state')
+    season = models.ForeignKey(Season, on_delete=models.CASCADE)
+    home_results = models.JSONField(default=list, blank=True, verbose_name="Ultime partite in casa")
+    away_results = models.JSONField(default=list, blank=True, verbose_name="Ultime partite in trasferta")
+    last_match_date = models.DateTimeField(null=True, blank=True)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Stato Rolling Squadra"
+        verbose_name_plural = "Stati Rolling Squadre"
+
+    def __str__(self):
+        return f"Rolling {self.team} ({self.season})"
+
+class TeamCurrentState(models.Model):
+    """
+    Fatti 'correnti' di una squadra in una riga: ultimo ELO, forma, ultima e prossima partita.
+    Aggiornata con i risultati, i calendari e il ricalcolo ELO (vedi predictors.current_state):
+    dashboard, dettaglio partita e pagina squadra la leggono per chiave primaria.
+    """
+    team = models.OneToOneField(Team, on_delete=models.CASCADE, primary_key=True, related_name='current_state')
+    elo = models.FloatField(default=1500.0, verbose_name="ELO Attuale")
+    form_sequence = models.CharField(max_length=20, default="", blank=True, verbose_name="Sequenza Forma")
+    last_match = models.ForeignKey(Match, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Ultima Partita")
+    last_match_date = models.DateTimeField(null=True, blank=True, verbose_name="Data Ultima Partita")
+    next_match = models.ForeignKey(Match, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Prossima Partita")
+    next_match_date = models.DateTimeField(null=True, blank=True, verbose_name="Data Prossima Partita")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Stato Corrente Squadra"
+        verbose_name_plural = "Stati Correnti Squadre"
+
+    @property
+    def rest_days(self):
+        """ Giorni di riposo tra l'ultima e la prossima partita (None se manca una delle due). """
+        if self.last_match_date is None or self.next_match_date is None:
+            return None
+        return (self.next_match_date - self.last_match_date).days
+
+    def __str__(self):
+        return f"Stato {self.team} (ELO {self.elo:.0f}, {self.form_sequence or '-'})"
+
+class LeagueState(models.Model):
+    """
+    Stato corrente del campionato (una sola riga): prossima partita da giocare e sua giornata.
+    Aggiornato insieme a TeamCurrentState (vedi predictors.current_state).
+    """
+    season = models.ForeignKey(Season, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    current_round = models.IntegerField(null=True, blank=True, verbose_name="Giornata Corrente")
+    next_match = models.ForeignKey(Match, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Prossima Partita")
+    next_match_date = models.DateTimeField(null=True, blank=True, verbose_name="Data Prossima Partita")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Stato Campionato"
+        verbose_name_plural = "Stato Campionato"
+
+    def __str__(self):
+        return f"Giornata corrente: {self.current_round or '-'}"
+
+class StandingEntry(models.Model):
+    """
+    Classifica progressiva: una riga per squadra per giornata della stagione,
+    con i totali di tutte le partite giocate fino a quella giornata compresa.
+    Aggiornata dalla giornata del risultato salvato in poi (vedi predictors.standings).
+    """
+    season = models.ForeignKey(Season, on_delete=models.CASCADE, related_name='standings')
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='standings')
+    round_number = models.IntegerField(verbose_name="Giornata")
+
+    position = models.IntegerField(verbose_name="Posizione")
+    played = models.IntegerField(default=0, verbose_name="Giocate")
+    won = models.IntegerField(default=0, verbose_name="Vinte")
+    drawn = models.IntegerField(default=0, verbose_name="Pareggiate")
+    lost = models.IntegerField(default=0, verbose_name="Perse")
+    gf = models.IntegerField(default=0, verbose_name="Goal Fatti")
+    ga = models.IntegerField(default=0, verbose_name="Goal Subiti")
+    points = models.IntegerField(default=0, verbose_name="Punti")
+    points_gap_top = models.IntegerField(default=0, verbose_name="Punti dalla Vetta")
+
+    class Meta:
+        verbose_name = "Classifica (Giornata)"
+        verbose_name_plural = "Classifiche (Giornata)"
+        unique_together = ('season', 'round_number', 'team')
+        ordering = ['season', 'round_number', 'position']
+        indexes = [models.Index(fields=['season', 'team', 'round_number'])]
+
+    @property
+    def gd(self):
+        return self.gf - self.ga
+
+    def __str__(self):
+        return f"{self.team} G{self.round_number}: {self.position}° ({self.points} pt)"
+
+class TeamSeasonAggregate(models.Model):
+    """
+    Totali di una squadra in una stagione, divisi casa/trasferta (pagina squadra).
+    Ricalcolati per le due squadre a ogni risultato salvato (vedi predictors.team_stats).
+    """
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='season_aggregates')
+    season = models.ForeignKey(Season, on_delete=models.CASCADE, related_name='team_aggregates')
+
+    home_played = models.IntegerField(default=0, verbose_name="Giocate Casa")
+    home_won = models.IntegerField(default=0, verbose_name="Vinte Casa")
+    home_drawn = models.IntegerField(default=0, verbose_name="Pareggiate Casa")
+    home_lost = models.IntegerField(default=0, verbose_name="Perse Casa")
+    home_gf = models.IntegerField(default=0, verbose_name="Goal Fatti Casa")
+    home_ga = models.IntegerField(default=0, verbose_name="Goal Subiti Casa")
+    home_xg_for = models.FloatField(default=0.0, verbose_name="xG Fatti Casa")
+    home_xg_against = models.FloatField(default=0.0, verbose_name="xG Subiti Casa")
+
+    away_played = models.IntegerField(default=0, verbose_name="Giocate Trasferta")
+    away_won = models.IntegerField(default=0, verbose_name="Vinte Trasferta")
+    away_drawn = models.IntegerField(default=0, verbose_name="Pareggiate Trasferta")
+    away_lost = models.IntegerField(default=0, verbose_name="Perse Trasferta")
+    away_gf = models.IntegerField(default=0, verbose_name="Goal Fatti Trasferta")
+    away_ga = models.IntegerField(default=0, verbose_name="Goal Subiti Trasferta")
+    away_xg_for = models.FloatField(default=0.0, verbose_name="xG Fatti Trasferta")
+    away_xg_against = models.FloatField(default=0.0, verbose_name="xG Subiti Trasferta")
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Statistiche Squadra (Stagione)"
+        verbose_name_plural = "Statistiche Squadre (Stagione)"
+        unique_together = ('team', 'season')
+
+    def __str__(self):
+        return f"{self.team} ({self.season})"
+
+class TeamEloHistory(models.Model):
+    """
+    Storico dei rating ELO: una riga per squadra per partita elaborata.
+    Permette a calculate_elo di ripartire dall'ultima partita elaborata
+    invece di rigiocare tutto lo storico da 1500.
+    """
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, related_name='elo_history')
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='elo_history')
+    date_time = models.DateTimeField(verbose_name="Data Match")
+    elo_before = models.FloatField(verbose_name="ELO Pre-Match")
+    elo_after = models.FloatField(verbose_name="ELO Post-Match")
+    winner = models.CharField(max_length=1, verbose_name="Esito usato nel calcolo", help_text="Se il risultato viene corretto, il calcolo riparte da questa partita")
+
+    class Meta:
+        verbose_name = "Storico ELO"
+        verbose_name_plural = "Storico ELO"
+        unique_together = ('match', 'team')
+        indexes = [models.Index(fields=['team', 'date_time'])]
+
+    def __str__(self):
+        return f"{self.team} {self.elo_before:.1f} -> {self.elo_after:.1f} ({self.match})"
+
 class OddsMovement(models.Model):
     match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='odds')
     bookmaker = models.CharField(max_length=50)
@@ -484,6 +668,17 @@ class ModelRegistry(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
 
+    # Set di modelli salvato da train_model (un file XGBoost nativo per target)
+    version = models.CharField(max_length=50, blank=True, db_index=True, verbose_name="Versione", help_text="I processi in esecuzione ricaricano i modelli quando cambia la versione attiva")
+    artifact_dir = models.CharField(max_length=255, blank=True, verbose_name="Cartella Modelli")
+    targets = models.JSONField(default=list, blank=True, verbose_name="Target")
+
+    # Impronta di dati e iperparametri: train_model non riaddestra se coincide con la versione attiva
+    fingerprint = models.CharField(max_length=40, blank=True, db_index=True, verbose_name="Impronta training")
+    metrics = models.JSONField(default=dict, blank=True, verbose_name="MAE di validazione", help_text="{target: MAE} misurato in addestramento")
+    training_rows = models.IntegerField(default=0, verbose_name="Partite di training")
+    rolled_back_at = models.DateTimeField(null=True, blank=True, verbose_name="Ritirato il", help_text="Versione disattivata con rollback_model: non viene riaddestrata sugli stessi dati")
+
     def __str__(self):
         return self.name
 
@@ -511,9 +706,224 @@ class Prediction(models.Model):
     away_yellow_cards = models.IntegerField(default=0)
     away_offsides = models.IntegerField(default=0)
 
+    # Ultimo calcolo delle BettingOpportunity (None = mai calcolate)
+    opportunities_updated_at = models.DateTimeField(null=True, blank=True, verbose_name="Opportunità aggiornate il")
+    # Ultimo ricalcolo dei valori previsti (versione per ETag/Last-Modified dell'API)
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Aggiornata il")
+
     def __str__(self):
         return f"Pred {self.match}: {self.home_goals}-{self.away_goals}"
 
     class Meta:
         verbose_name = "Previsione Statistica"
-        verbose_name_plural = "Previsioni Statistiche"
\ No newline at end of file
+        verbose_name_plural = "Previsioni Statistiche"
+
+class BettingOpportunity(models.Model):
+    """
+    Opportunità di scommessa calcolate per una Prediction (output di get_multi_market_opportunities).
+    Scritte da predict_upcoming e ricalcolate solo quando cambiano quote,
+    BettingConfiguration o AccuracyProfile: dashboard e schedina le leggono e basta.
+    """
+    prediction = models.ForeignKey(Prediction, on_delete=models.CASCADE, related_name='opportunities')
+    match = models.ForeignKey(Match, on_delete=models.CASCADE, related_name='opportunities')
+    rank = models.IntegerField(verbose_name="Posizione", help_text="0 = migliore")
+
+    label = models.CharField(max_length=100, verbose_name="Mercato")
+    category = models.CharField(max_length=50, verbose_name="Categoria")
+    stat_type = models.CharField(max_length=20, verbose_name="Statistica")
+    market_type = models.CharField(max_length=10, blank=True, verbose_name="Tipo Mercato")
+    score = models.FloatField(verbose_name="Punteggio")
+    raw_score = models.FloatField(verbose_name="Punteggio Base")
+    multiplier = models.FloatField(default=1.0, verbose_name="Moltiplicatore Accuratezza")
+    reasoning = models.TextField(blank=True, verbose_name="Motivazione")
+
+    class Meta:
+        verbose_name = "Opportunità"
+        verbose_name_plural = "Opportunità"
+        ordering = ['prediction', 'rank']
+        indexes = [models.Index(fields=['prediction', 'rank'])]
+
+    def __str__(self):
+        return f"{self.label} ({self.score}) - {self.match}"
+
+    def as_dict(self):
+        """ Stesso formato dei dizionari restituiti da get_multi_market_opportunities. """
+        return {
+            'label': self.label,
+            'category': self.category,
+            'score': self.score,
+            'raw_score': self.raw_score,
+            'multiplier': self.multiplier,
+            'reasoning': self.reasoning,
+            'stat_type': self.stat_type,
+            'market_type': self.market_type or None,
+        }
+class MatchAccuracy(models.Model):
+    """
+    Accuratezza dell'ultima previsione di una partita giocata (righe di dettaglio
+    della pagina Performance). Aggiornata quando cambiano risultato o previsione.
+    """
+    COLOR_CHOICES = [('green', 'Verde'), ('yellow', 'Giallo'), ('red', 'Rosso')]
+
+    match = models.OneToOneField(Match, on_delete=models.CASCADE, related_name='accuracy')
+    prediction = models.ForeignKey(Prediction, on_delete=models.CASCADE, related_name='+')
+    round_number = models.IntegerField(db_index=True, verbose_name="Giornata")
+
+    score_1x2 = models.FloatField()
+    score_goals = models.FloatField()
+    score_shots = models.FloatField()
+    score_shots_ot = models.FloatField()
+    score_corners = models.FloatField()
+    score_fouls = models.FloatField()
+    score_cards = models.FloatField()
+    score_offsides = models.FloatField()
+
+    score = models.FloatField(verbose_name="Media Partita")
+    color = models.CharField(max_length=10, choices=COLOR_CHOICES)
+    is_correct_1x2 = models.BooleanField(default=False, verbose_name="Segno Corretto")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Accuratezza Partita"
+        verbose_name_plural = "Accuratezza Partite"
+
+    def __str__(self):
+        return f"{self.match}: {self.score}"
+
+class RoundAccuracy(models.Model):
+    """
+    Rollup per giornata e stagione delle MatchAccuracy (grafico trend e riepilogo della pagina Performance).
+    Ricalcolato solo per le giornate toccate da un risultato o una previsione.
+    """
+    season = models.ForeignKey(Season, on_delete=models.CASCADE, related_name='round_accuracies')
+    round_number = models.IntegerField(verbose_name="Giornata")
+    matches_count = models.IntegerField(default=0, verbose_name="Partite")
+
+    global_score_avg = models.FloatField(default=0)
+    acc_1x2 = models.FloatField(default=0)
+    acc_total_goals = models.FloatField(default=0)
+    acc_total_shots = models.FloatField(default=0)
+    acc_shots_ot = models.FloatField(default=0)
+    acc_corners = models.FloatField(default=0)
+    acc_fouls = models.FloatField(default=0)
+    acc_cards = models.FloatField(default=0)
+    acc_offsides = models.FloatField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Accuratezza Giornata"
+        verbose_name_plural = "Accuratezza Giornate"
+        unique_together = ('season', 'round_number')
+        ordering = ['season', 'round_number']
+
+    def __str__(self):
+        return f"Giornata {self.round_number}: {self.global_score_avg}"
+
+class PipelineRun(models.Model):
+    """
+    Esecuzione della pipeline (o dello scraping) lanciata dalla Control Room,
+    oppure di un singolo comando lanciato fuori dalla pipeline (kind 'command').
+    Le fasi (StageRun) conservano tempi e query: lo storico permette di confrontare le esecuzioni.
+    """
+    KIND_CHOICES = [('pipeline', 'Pipeline completa'), ('scraping', 'Scraping Understat'), ('command', 'Comando singolo')]
+    STATE_CHOICES = [('queued', 'In coda'), ('running', 'In corso'), ('completed', 'Completato'), ('error', 'Errore')]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='pipeline', verbose_name="Tipo")
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='queued', verbose_name="Stato")
+    message = models.CharField(max_length=255, blank=True, verbose_name="Messaggio")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Esecuzione Pipeline"
+        verbose_name_plural = "Esecuzioni Pipeline"
+        ordering = ['-created_at']
+        indexes = [models.Index(fields=['kind', '-created_at'])]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.state})"
+
+    @property
+    def wall_time(self):
+        if self.started_at and self.finished_at:
+            return (self.finished_at - self.started_at).total_seconds()
+        return None
+
+    def as_dict(self, stages=None):
+        """ Stato serializzabile (eventi SSE e endpoint JSON). progress: 0-100 pesato sulle fasi. """
+        stages = list(self.stages.all()) if stages is None else stages
+        total_weight = sum(s.weight for s in stages) or 1.0
+        done_weight = sum(s.weight * s.fraction_done for s in stages)
+        return {
+            'id': self.pk,
+            'kind': self.kind,
+            'state': self.state,
+            'message': self.message,
+            'progress': 100 if self.state == 'completed' else int(100 * done_weight / total_weight),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'wall_time': self.wall_time,
+            'stages': [s.as_dict() for s in stages],
+        }
+
+class StageRun(models.Model):
+    """
+    Fase di una PipelineRun: avanzamento (done/total), tempo reale e CPU, numero
+    e tempo delle query SQL, forme di query più ripetute (top_queries: N+1).
+    fingerprint: impronta degli input della fase a fine esecuzione; se alla
+    esecuzione successiva è invariata la fase viene saltata (stato 'skipped').
+    """
+    STATE_CHOICES = [
+        ('pending', 'In attesa'), ('running', 'In corso'), ('completed', 'Completata'),
+        ('skipped', 'Saltata (input invariati)'), ('error', 'Errore'),
+    ]
+
+    run = models.ForeignKey(PipelineRun, on_delete=models.CASCADE, related_name='stages')
+    order = models.IntegerField(default=0)
+    name = models.CharField(max_length=50, verbose_name="Fase")
+    label = models.CharField(max_length=255, blank=True)
+    weight = models.FloatField(default=1.0, help_text="Peso della fase nella percentuale complessiva")
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default='pending', verbose_name="Stato")
+
+    done = models.IntegerField(default=0, verbose_name="Elementi elaborati")
+    total = models.IntegerField(default=0, verbose_name="Elementi totali", help_text="0 = avanzamento non disponibile")
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    wall_time = models.FloatField(null=True, blank=True, verbose_name="Tempo (s)")
+    query_count = models.IntegerField(null=True, blank=True, verbose_name="Query SQL")
+    cpu_time = models.FloatField(null=True, blank=True, verbose_name="Tempo CPU (s)", help_text="Thread della fase più processi figli terminati (solo se nessun'altra fase era in corso)")
+    sql_time = models.FloatField(null=True, blank=True, verbose_name="Tempo SQL (s)")
+    top_queries = models.JSONField(default=list, blank=True, verbose_name="Query più ripetute", help_text="[{sql, count, time}] per forma di query")
+    fingerprint = models.CharField(max_length=40, blank=True, verbose_name="Impronta input")
+
+    class Meta:
+        verbose_name = "Fase Pipeline"
+        verbose_name_plural = "Fasi Pipeline"
+        ordering = ['run', 'order']
+        unique_together = ('run', 'name')
+        indexes = [models.Index(fields=['name', '-finished_at'])]
+
+    def __str__(self):
+        return f"{self.run_id}/{self.name} ({self.state})"
+
+    @property
+    def fraction_done(self):
+        if self.state in ('completed', 'skipped'):
+            return 1.0
+        if self.state == 'running' and self.total:
+            return min(self.done / self.total, 1.0)
+        return 0.0
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'label': self.label,
+            'state': self.state,
+            'done': self.done,
+            'total': self.total,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'query_count': self.query_count,
+            'sql_time': self.sql_time,
+        }
@@ -0,0 +1,236 @@
+"""
+Pipeline completa come grafo di fasi con input dichiarati (PipelineDAG).
+
+Ogni fase (Stage) è un comando di management con:
+- after: le fasi che devono concludersi (eseguite o saltate) prima di lei;
+- inputs: funzione che restituisce l'impronta dei dati letti dal comando
+  (poche query aggregate: righe, id massimo, somme delle colonne usate,
+  versione del modello attivo). None = sorgente esterna (API): la fase
+  viene sempre eseguita;
+- written: funzione che restituisce l'impronta degli input scritti dal
+  comando stesso (es. l'ELO riscritto negli snapshot, il modello attivo).
+
+Prima di eseguire una fase se ne calcola l'impronta: se è uguale a quella
+registrata dall'ultima esecuzione riuscita, la fase è saltata. Si registra
+l'impronta degli input letta prima dell'esecuzione: i dati scritti nel
+frattempo da altre fasi o processi la fanno ripartire la volta dopo. Solo la
+parte written è ricalcolata a fine fase, così le scritture del comando sui
+propri input non la fanno ripartire la notte dopo.
+Poiché l'impronta si calcola dopo le fasi da cui dipende, una fase a monte che
+cambia i dati letti fa ripartire anche quelle a valle.
+
+Le fasi pronte nello stesso momento (quote, formazioni e feature dopo il
+calendario) girano in parallelo, ognuna in un thread con la propria connessione.
+"""
+import hashlib
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.core.management import call_command
+from django.db import connections
+from django.db.models import Count, FloatField, Max, Sum
+from predictors.models import (
+    Match, MatchAbsence, MatchLineup, MatchResult, PlayerMatchStat, Rivalry,
+    StageRun, TeamFormSnapshot,
+)
+
+MAX_PARALLEL = 3  # fasi eseguite contemporaneamente
+
+Stage = namedtuple('Stage', 'name label weight after inputs written', defaults=(None,))
+
+
+# ----------------------------------------------------------------------
+# Impronte degli input
+# ----------------------------------------------------------------------
+
+def _totals(queryset, *columns):
+    """ (righe, id massimo, somme delle colonne) in una query aggregata. """
+    aggregates = {'rows': Count('pk'), 'last_id': Max('pk')}
+    for i, column in enumerate(columns):
+        aggregates[f'sum_{i}'] = Sum(column, output_field=FloatField())
+    values = queryset.aggregate(**aggregates)
+    return tuple(round(value, 4) if isinstance(value, float) else value for value in values.values())
+
+
+def _rows(queryset, *fields):
+    """ Digest delle colonne indicate riga per riga (tabelle piccole o colonne non sommabili). """
+    digest = hashlib.sha1()
+    for row in queryset.order_by('pk').values_list('pk', *fields).iterator(chunk_size=2000):
+        digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+def _matches():
+    return _rows(Match.objects.all(), 'season_id', 'home_team_id', 'away_team_id', 'date_time', 'round_number', 'status', 'referee_id')
+
+
+def _results():
+    # Contenuto delle statistiche, non la lunghezza: una correzione (corner 5 -> 7) cambia l'impronta
+    return _rows(
+        MatchResult.objects.all(), 'match_id', 'home_goals', 'away_goals', 'winner',
+        'home_stats', 'away_stats', 'missing_metrics',
+    )
+
+
+def _finished_snapshots(*columns):
+    return _totals(TeamFormSnapshot.objects.filter(match__status='FINISHED'), *columns)
+
+
+def _active_model():
+    from predictors.model_store import ModelStore
+    active = ModelStore.active_registry()
+    return active.version if active else None
+
+
+def features_inputs():
+    # Lo storico ELO letto dalle feature è scritto a valle da calculate_elo, che riparte
+    # solo quando cambiano partite o risultati: non è un input (sarebbe un ciclo)
+    return (
+        _matches(), _results(),
+        _totals(PlayerMatchStat.objects.all(), 'match_id', 'player_id', 'minutes', 'goals', 'assists', 'shots', 'xg'),
+        _totals(Rivalry.objects.all(), 'intensity'),
+    )
+
+
+def features_written():
+    # Snapshot mancanti (cancellati a mano) fanno ripartire le feature
+    return _finished_snapshots()
+
+
+def elo_inputs():
+    return _matches(), _results()
+
+
+def elo_written():
+    return _finished_snapshots('elo_rating')
+
+
+def train_inputs():
+    # Stessa impronta della cache del training set (snapshot e risultati delle partite concluse)
+    from predictors.training_set import TrainingSetCache
+    cache = TrainingSetCache()
+    return cache.fingerprint(cache.fetch_checksums())
+
+
+def train_written():
+    # Un rollback del modello attivo fa ripartire l'addestramento (train_model salta le versioni ritirate)
+    return _active_model()
+
+
+def predict_inputs():
+    upcoming = {'match__status': 'SCHEDULED'}
+    return (
+        _matches(), _results(), _active_model(),
+        _finished_snapshots('elo_rating', 'avg_xg_last_5', 'last_5_matches_points'),
+        _totals(PlayerMatchStat.objects.all(), 'match_id', 'player_id', 'minutes'),
+        _rows(MatchLineup.objects.filter(**upcoming), 'team_id', 'status', 'formation', 'starting_xi'),
+        _rows(MatchAbsence.objects.filter(**upcoming), 'team_id', 'player_id', 'type'),
+    )
+
+
+def fingerprint(parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def stage_fingerprint(stage, inputs):
+    """ Impronta della fase: input letti (inputs) più la parte scritta dalla fase stessa, riletta ora. """
+    return fingerprint((inputs, stage.written() if stage.written else None))
+
+
+def last_fingerprint(name):
+    """ Impronta dell'ultima esecuzione riuscita (o saltata) della fase, '' se assente. """
+    return StageRun.objects.filter(
+        name=name, run__kind='pipeline', state__in=('completed', 'skipped'),
+    ).exclude(fingerprint='').order_by('-finished_at').values_list('fingerprint', flat=True).first() or ''
+
+
+# ----------------------------------------------------------------------
+# Esecuzione
+# ----------------------------------------------------------------------
+
+class PipelineDAG:
+    """ Esegue le fasi in ordine di dipendenza, in parallelo dove possibile, saltando quelle con input invariati. """
+
+    def __init__(self, stages):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            unknown = set(stage.after) - set(self.stages)
+            if unknown:
+                raise ValueError(f"Fase {stage.name}: dipendenze sconosciute {sorted(unknown)}")
+
+    def stage_rows(self):
+        """ [(nome, etichetta, peso)] per PipelineTracker.create. """
+        return [(stage.name, stage.label, stage.weight) for stage in self.stages.values()]
+
+    def run(self, tracker, force=False, max_parallel=MAX_PARALLEL):
+        """
+        Esegue la pipeline. force=True esegue tutte le fasi ignorando le impronte.
+        Se una fase fallisce non ne partono altre; quelle in corso vengono attese
+        e il primo errore viene rilanciato. Restituisce {fase: 'completed'|'skipped'}.
+        """
+        pending = dict(self.stages)
+        outcomes, running, error = {}, {}, None
+
+        with ThreadPoolExecutor(max_workers=max_parallel) as pool:
+            while True:
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if all(dep in outcomes for dep in stage.after):
+                            del pending[name]
+                            running[pool.submit(self._run_stage, tracker, stage, force)] = name
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        outcomes[name] = future.result()
+                    except Exception as e:
+                        error = error or e
+
+        if error is not None:
+            raise error
+        return outcomes
+
+    @staticmethod
+    def _run_stage(tracker, stage, force):
+        try:
+            if stage.inputs is not None:
+                inputs = stage.inputs()
+                current = stage_fingerprint(stage, inputs)
+                if not force and current == last_fingerprint(stage.name):
+                    tracker.skip(stage.name, current)
+                    return 'skipped'
+
+            with tracker.stage(stage.name):
+                call_command(stage.name)
+
+            if stage.inputs is not None:
+                # Input letti prima della fase: quelli scritti intanto da fasi parallele non vengono assorbiti
+                tracker.record_fingerprint(stage.name, stage_fingerprint(stage, inputs))
+            return 'completed'
+        finally:
+            # Connessioni aperte da questo thread del pool
+            connections.close_all()
+
+
+PIPELINE = PipelineDAG([
+    Stage('update_fixtures', '📡 Scaricamento dati API (Match e Risultati)...', 1, (), None),
+    Stage('fetch_odds', '💰 Aggiornamento quote...', 1, ('update_fixtures',), None),
+    Stage('fetch_official_lineups', '📋 Formazioni ufficiali...', 1, ('update_fixtures',), None),
+    Stage(
+        'calculate_features', '🧮 Calcolo statistiche avanzate e snapshot...', 2, ('update_fixtures',),
+        features_inputs, features_written,
+    ),
+    Stage(
+        'calculate_elo', '📈 Aggiornamento Rating ELO storico...', 1, ('calculate_features',),
+        elo_inputs, elo_written,
+    ),
+    Stage(
+        'train_model', '🧠 Addestramento Intelligenza Artificiale (XGBoost)...', 3, ('calculate_elo',),
+        train_inputs, train_written,
+    ),
+    Stage(
+        'predict_upcoming', '🔮 Generazione nuove previsioni...', 1,
+        ('train_model', 'fetch_odds', 'fetch_official_lineups'), predict_inputs,
+    ),
+])
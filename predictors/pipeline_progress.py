@@ -0,0 +1,389 @@
+"""
+Avanzamento delle esecuzioni lanciate dalla Control Room (PipelineRun/StageRun).
+
+Il task (worker Django-Q) apre le fasi con PipelineTracker.stage(), anche più
+di una in parallelo (PipelineDAG): ogni fase registra tempo reale e CPU, numero
+e tempo delle query SQL eseguite dal suo comando e le forme di query più
+ripetute (N+1). Le fasi con input invariati sono 'skipped'.
+I comandi riportano l'avanzamento reale con report_progress(done, total),
+che non fa nulla quando il comando non è eseguito dentro una fase tracciata.
+
+I comandi di predictors derivano da InstrumentedCommand: lanciati fuori dalla
+pipeline (cron, shell, task) registrano comunque una PipelineRun 'command' con
+una sola fase, così ogni esecuzione è confrontabile con la precedente.
+
+Il browser riceve gli aggiornamenti in push da event_stream() (Server-Sent
+Events): lo stream rilegge l'esecuzione ogni POLL_INTERVAL secondi sul server
+e invia un evento solo quando qualcosa cambia.
+"""
+import asyncio
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from predictors.models import PipelineRun, StageRun
+
+POLL_INTERVAL = 0.5        # secondi tra due letture dell'esecuzione nello stream
+HEARTBEAT_INTERVAL = 15    # secondi senza eventi prima di un commento keep-alive
+QUEUED_TIMEOUT = 300       # secondi in coda (worker fermo?) prima di chiudere lo stream con 'stalled'
+STREAM_MAX_LIFETIME = 1800  # secondi di vita di uno stream: poi si chiude e EventSource si riconnette
+PROGRESS_INTERVAL = 0.5    # secondi minimi tra due scritture dell'avanzamento di una fase
+FINAL_STATES = ('completed', 'error')
+TOP_QUERIES = 5            # forme di query salvate per fase
+SHAPE_MAX_LENGTH = 300     # caratteri salvati per forma di query
+REGRESSION_RATIO = 1.2     # query in più del 20% rispetto all'esecuzione precedente...
+REGRESSION_MIN_QUERIES = 20  # ...e almeno 20 in più: segnalata in Control Room
+
+try:
+    import resource  # CPU dei processi figli (pool di training e feature); assente su Windows
+except ImportError:
+    resource = None
+
+# Tracker e fase in corso nel thread (i comandi sono eseguiti con call_command nel thread della fase)
+_active = threading.local()
+
+# Fasi aperte nel processo -> True finché la fase non se n'è sovrapposta un'altra
+_open_stages = {}
+_open_lock = threading.Lock()
+
+
+def report_progress(done, total):
+    """ Avanzamento della fase in corso (no-op fuori da una pipeline tracciata). """
+    tracker = getattr(_active, 'tracker', None)
+    if tracker is not None:
+        tracker.progress(done, total)
+
+
+def _children_cpu():
+    """ CPU dei processi figli già terminati (di tutto il processo, non del thread). """
+    if resource is None:
+        return 0.0
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return children.ru_utime + children.ru_stime
+
+
+def _open_stage(token):
+    with _open_lock:
+        alone = not _open_stages
+        for other in _open_stages:
+            _open_stages[other] = False
+        _open_stages[token] = alone
+
+
+def _close_stage(token):
+    """ True se la fase è rimasta l'unica aperta nel processo: i figli terminati sono suoi. """
+    with _open_lock:
+        return _open_stages.pop(token)
+
+
+_LITERALS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),                       # stringhe
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), 'N'),                     # numeri (LIMIT, OFFSET, costanti)
+    (re.compile(r'\((?:\s*(?:%s|\?|N)\s*,)+\s*(?:%s|\?|N)\s*\)'), '(...)'),  # liste IN / VALUES
+    (re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+'), '(...)'),          # righe multiple di VALUES
+]
+
+
+# BEGIN/COMMIT/SAVEPOINT di atomic(): contati tra le query ma non tra le forme
+_TRANSACTION = re.compile(r'\s*(?:BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b', re.IGNORECASE)
+
+
+def query_shape(sql):
+    """ Forma della query: letterali e liste di parametri sostituiti, così le N+1 hanno la stessa forma. """
+    for pattern, replacement in _LITERALS:
+        sql = pattern.sub(replacement, sql)
+    return sql[:SHAPE_MAX_LENGTH]
+
+
+class QueryCounter:
+    """
+    Execute wrapper che conta e cronometra le query della connessione (anche con
+    DEBUG=False), raggruppate per forma: top() restituisce le più ripetute.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.paused = False
+        self.shapes = defaultdict(lambda: [0, 0.0])  # forma -> [esecuzioni, secondi]
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.paused:
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.time += elapsed
+            if not _TRANSACTION.match(sql):
+                shape = self.shapes[query_shape(sql)]
+                shape[0] += 1
+                shape[1] += elapsed
+
+    def top(self, limit=TOP_QUERIES):
+        ranked = sorted(self.shapes.items(), key=lambda item: (-item[1][0], -item[1][1]))[:limit]
+        return [{'sql': sql, 'count': count, 'time': round(elapsed, 4)} for sql, (count, elapsed) in ranked]
+
+
+class PipelineTracker:
+    """
+    Registra fasi, tempi e avanzamento di una PipelineRun.
+    Più fasi possono essere aperte insieme da thread diversi (PipelineDAG):
+    ogni fase ha il proprio contatore di query sulla connessione del suo thread.
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.stages = {stage.name: stage for stage in run.stages.all()}
+        self._run_lock = threading.Lock()
+        self._last_write = {}
+
+    @staticmethod
+    def create(kind, stages):
+        """ Nuova esecuzione in coda. stages: [(nome, etichetta, peso)] nell'ordine di esecuzione. """
+        run = PipelineRun.objects.create(kind=kind, message='In coda...')
+        StageRun.objects.bulk_create([
+            StageRun(run=run, order=order, name=name, label=label, weight=weight)
+            for order, (name, label, weight) in enumerate(stages)
+        ])
+        return run
+
+    @classmethod
+    def for_run(cls, run_id, kind, stages):
+        """ Tracker dell'esecuzione creata dalla vista (o di una nuova, se il task è lanciato a mano). """
+        run = PipelineRun.objects.filter(pk=run_id).first() if run_id else None
+        if run is None:
+            run = cls.create(kind, stages)
+        tracker = cls(run)
+        tracker._save_run(state='running', started_at=timezone.now(), message='Inizializzazione...')
+        return tracker
+
+    @contextmanager
+    def stage(self, name):
+        stage = self.stages[name]
+        self._save_stage(stage, state='running', started_at=timezone.now())
+        self._save_run(message=stage.label)
+
+        counter = QueryCounter()
+        wall_start, cpu_start, children_start = time.perf_counter(), time.thread_time(), _children_cpu()
+        _open_stage(counter)
+        _active.tracker, _active.stage, _active.counter = self, stage, counter
+        state = 'error'
+        try:
+            with connection.execute_wrapper(counter):
+                yield stage
+            state = 'completed'
+        finally:
+            _active.tracker = _active.stage = None
+            cpu_time = time.thread_time() - cpu_start
+            if _close_stage(counter):
+                # Con fasi in parallelo i figli terminati (pool di training) non sono attribuibili
+                cpu_time += _children_cpu() - children_start
+            self._save_stage(
+                stage,
+                state=state,
+                finished_at=timezone.now(),
+                wall_time=time.perf_counter() - wall_start,
+                cpu_time=cpu_time,
+                query_count=counter.count,
+                sql_time=counter.time,
+                top_queries=counter.top(),
+                done=stage.total if state == 'completed' and stage.total else stage.done,
+            )
+            _active.counter = None
+
+    def skip(self, name, fingerprint):
+        """ Fase non eseguita perché i suoi input non sono cambiati dall'ultima esecuzione. """
+        now = timezone.now()
+        self._save_stage(
+            self.stages[name], state='skipped', started_at=now, finished_at=now,
+            wall_time=0.0, query_count=0, fingerprint=fingerprint,
+        )
+
+    def record_fingerprint(self, name, fingerprint):
+        self._save_stage(self.stages[name], fingerprint=fingerprint)
+
+    def progress(self, done, total):
+        """ Aggiorna done/total della fase in corso nel thread (al massimo una scrittura ogni PROGRESS_INTERVAL). """
+        stage = getattr(_active, 'stage', None)
+        if stage is None:
+            return
+        stage.done, stage.total = done, total
+        now = time.monotonic()
+        if done >= total or now - self._last_write.get(stage.name, 0.0) >= PROGRESS_INTERVAL:
+            self._last_write[stage.name] = now
+            self._save_stage(stage)
+
+    def finish(self, message):
+        self._save_run(state='completed', finished_at=timezone.now(), message=message)
+
+    def fail(self, message):
+        self._save_run(state='error', finished_at=timezone.now(), message=message[:255])
+
+    @staticmethod
+    @contextmanager
+    def _uncounted():
+        # Le scritture del tracker non entrano nel conteggio delle query della fase
+        counter = getattr(_active, 'counter', None)
+        if counter is None:
+            yield
+            return
+        counter.paused = True
+        try:
+            yield
+        finally:
+            counter.paused = False
+
+    def _save_stage(self, stage, **fields):
+        for field, value in fields.items():
+            setattr(stage, field, value)
+        with self._uncounted():
+            stage.save(update_fields=list(fields) or ['done', 'total'])
+
+    def _save_run(self, **fields):
+        with self._run_lock, self._uncounted():
+            for field, value in fields.items():
+                setattr(self.run, field, value)
+            self.run.save(update_fields=list(fields))
+
+
+class InstrumentedCommand(BaseCommand):
+    """
+    Base dei comandi di predictors. Dentro una fase tracciata (pipeline, scraping)
+    le misure sono già della fase; altrimenti il comando apre una PipelineRun
+    'command' con una sola fase che ne registra tempi, query e forme più ripetute.
+    """
+
+    def execute(self, *args, **options):
+        if getattr(_active, 'stage', None) is not None:
+            return super().execute(*args, **options)
+
+        name = self.__module__.rsplit('.', 1)[-1]
+        tracker = PipelineTracker.for_run(None, 'command', [(name, name, 1)])
+        try:
+            with tracker.stage(name) as stage:
+                output = super().execute(*args, **options)
+        except BaseException as e:
+            tracker.fail(f"{name}: {e}")
+            raise
+        tracker.finish(f"{name}: {stage.wall_time:.1f}s, {stage.query_count} query")
+        return output
+
+
+def command_profiles(days=30):
+    """
+    Ultima esecuzione di ogni comando (come fase della pipeline o da solo) negli
+    ultimi days giorni, con la differenza di query rispetto alla precedente.
+    Due query. [{stage, previous, query_delta, regression}] per nome.
+    """
+    since = timezone.now() - timedelta(days=days)
+    recent = StageRun.objects.filter(
+        finished_at__gte=since, state__in=('completed', 'error'), query_count__isnull=False,
+    ).defer('top_queries').select_related('run').order_by('-finished_at')[:1000]
+
+    latest, previous = {}, {}
+    for stage in recent:
+        if stage.name not in latest:
+            latest[stage.name] = stage
+        elif stage.name not in previous:
+            previous[stage.name] = stage
+
+    top = dict(StageRun.objects.filter(pk__in=[s.pk for s in latest.values()]).values_list('pk', 'top_queries'))
+    profiles = []
+    for name in sorted(latest):
+        stage, before = latest[name], previous.get(name)
+        stage.top_queries = top.get(stage.pk, [])
+        delta = stage.query_count - before.query_count if before is not None else None
+        profiles.append({
+            'stage': stage,
+            'previous': before,
+            'query_delta': delta,
+            'regression': is_query_regression(stage.query_count, before.query_count if before else None),
+        })
+    return profiles
+
+
+def is_query_regression(count, previous_count):
+    """ True se le query sono cresciute oltre REGRESSION_RATIO e REGRESSION_MIN_QUERIES. """
+    if count is None or previous_count is None:
+        return False
+    return count > previous_count * REGRESSION_RATIO and count - previous_count >= REGRESSION_MIN_QUERIES
+
+
+def run_snapshot(run_id):
+    """ Stato corrente dell'esecuzione (None se non esiste). Due query. """
+    run = PipelineRun.objects.filter(pk=run_id).first()
+    if run is None:
+        return None
+    return run.as_dict(list(run.stages.all()))
+
+
+def latest_status(kind):
+    """ Stato dell'ultima esecuzione del tipo indicato, nel formato dei vecchi endpoint di polling. """
+    run = PipelineRun.objects.filter(kind=kind).first()
+    if run is None:
+        return {'state': 'idle', 'progress': 0, 'message': 'In attesa...'}
+    return run.as_dict()
+
+
+def _format_event(payload):
+    return f"event: progress\ndata: {json.dumps(payload)}\n\n"
+
+
+def event_stream(run_id, asynchronous=True):
+    """
+    Iteratore SSE dell'esecuzione: un evento 'progress' a ogni cambiamento,
+    un commento keep-alive ogni HEARTBEAT_INTERVAL secondi, fine allo stato finale.
+    Non resta aperto all'infinito: un evento 'stalled' chiude lo stream se l'esecuzione
+    è ancora in coda dopo QUEUED_TIMEOUT secondi (nessun worker la prende), e dopo
+    STREAM_MAX_LIFETIME secondi lo stream termina senza evento (il browser si riconnette).
+    asynchronous=True sotto ASGI (non occupa un thread), False sotto WSGI/runserver.
+    """
+    def step(state, payload, now):
+        """ Chunk da inviare (o None) e se lo stream è concluso. """
+        if payload is None:
+            return "event: missing\ndata: {}\n\n", True
+        elapsed = now - state['started_at']
+        if payload['state'] == 'queued' and elapsed >= QUEUED_TIMEOUT:
+            return f"event: stalled\ndata: {json.dumps(payload)}\n\n", True
+        if elapsed >= STREAM_MAX_LIFETIME:
+            return None, True
+        if payload != state['last']:
+            state['last'], state['sent_at'] = payload, now
+            return _format_event(payload), payload['state'] in FINAL_STATES
+        if now - state['sent_at'] >= HEARTBEAT_INTERVAL:
+            state['sent_at'] = now
+            return ": keep-alive\n\n", False
+        return None, False
+
+    async def async_events():
+        state = {'last': None, 'sent_at': 0.0, 'started_at': time.monotonic()}
+        snapshot = sync_to_async(run_snapshot)
+        while True:
+            chunk, finished = step(state, await snapshot(run_id), time.monotonic())
+            if chunk:
+                yield chunk
+            if finished:
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def sync_events():
+        state = {'last': None, 'sent_at': 0.0, 'started_at': time.monotonic()}
+        while True:
+            chunk, finished = step(state, run_snapshot(run_id), time.monotonic())
+            if chunk:
+                yield chunk
+            if finished:
+                return
+            time.sleep(POLL_INTERVAL)
+
+    return async_events() if asynchronous else sync_events()
@@ -0,0 +1,201 @@
+"""
+Stato rolling per squadra (TeamRollingState).
+
+Ogni voce dei ring buffer contiene solo i dati usati dalle feature:
+{'match_id', 'date', 'home_team_id', 'away_team_id', 'home_goals', 'away_goals', 'winner', 'home_xg', 'away_xg'}
+Come lo storico letto da get_team_features_at_date, lo stato contiene tutte le
+partite FINISHED: quelle senza risultato hanno goal, esito e xG a None.
+
+Aggiornato solo dai segnali di MatchResult e Match (predictors.signals):
+record_match a ogni salvataggio, forget_match se la partita non è più FINISHED.
+"""
+from datetime import datetime
+from django.db.models import Q
+from predictors.models import Match, MatchResult, Season, Team, TeamRollingState
+
+
+def _entry(match, result):
+    entry = {
+        'match_id': match.id,
+        'date': match.date_time.isoformat(),
+        'home_team_id': match.home_team_id,
+        'away_team_id': match.away_team_id,
+        'home_goals': None, 'away_goals': None, 'winner': None, 'home_xg': None, 'away_xg': None,
+    }
+    if result is not None:
+        entry.update(
+            home_goals=result.home_goals,
+            away_goals=result.away_goals,
+            winner=result.winner,
+            home_xg=(result.home_stats or {}).get('xg', 0.0),
+            away_xg=(result.away_stats or {}).get('xg', 0.0),
+        )
+    return entry
+
+
+def _result(match):
+    """ Risultato già caricato con select_related (None se la partita non ce l'ha). """
+    try:
+        return match.result
+    except MatchResult.DoesNotExist:
+        return None
+
+
+def _entry_date(entry):
+    return datetime.fromisoformat(entry['date'])
+
+
+def _apply_entry(state, team_id, entry):
+    """
+    Inserisce (o sostituisce) una partita nel buffer del campo giusto.
+    Il buffer ha dimensione fissa: il costo non dipende dalla lunghezza dello storico.
+    """
+    key = 'home_results' if entry['home_team_id'] == team_id else 'away_results'
+    buffer = [e for e in getattr(state, key) if e['match_id'] != entry['match_id']]
+
+    buffer.append(entry)
+    buffer.sort(key=_entry_date, reverse=True)
+    setattr(state, key, buffer[:TeamRollingState.BUFFER_SIZE])
+
+    newest = _merged(state)
+    state.last_match_date = _entry_date(newest[0]) if newest else None
+
+
+def _merged(state):
+    """ Ultime BUFFER_SIZE partite (casa + trasferta), Newest->Oldest. """
+    merged = sorted(state.home_results + state.away_results, key=_entry_date, reverse=True)
+    return merged[:TeamRollingState.BUFFER_SIZE]
+
+
+def _accepts(state, match):
+    """ Una partita entra nello stato solo se della stessa stagione o di una più recente. """
+    if state.pk is None or state.season_id == match.season_id:
+        return True
+    return state.last_match_date is None or match.date_time > state.last_match_date
+
+
+def record_match(match):
+    """
+    Aggiorna lo stato rolling di entrambe le squadre dopo il salvataggio (o la
+    cancellazione) del MatchResult o della partita. Il risultato è riletto: quello
+    in cache sull'istanza può essere appena stato cancellato.
+    Costo costante: tre letture e due scritture, indipendentemente dallo storico.
+    """
+    if match.status != 'FINISHED':
+        forget_match(match)
+        return
+
+    entry = _entry(match, MatchResult.objects.filter(match_id=match.id).first())
+    states = {s.team_id: s for s in TeamRollingState.objects.filter(team_id__in=[match.home_team_id, match.away_team_id])}
+
+    for team_id in (match.home_team_id, match.away_team_id):
+        state = states.get(team_id) or TeamRollingState(team_id=team_id, season_id=match.season_id)
+        if not _accepts(state, match):
+            continue
+        if state.season_id != match.season_id:
+            # Nuova stagione: si riparte da buffer vuoti
+            state.season_id = match.season_id
+            state.home_results = []
+            state.away_results = []
+        elif entry in state.home_results + state.away_results:
+            continue  # Match salvato di nuovo (es. update_fixtures) senza cambiare il risultato
+        _apply_entry(state, team_id, entry)
+        state.save()
+
+
+def forget_match(match):
+    """
+    Toglie la partita (cancellata o non più FINISHED) dallo stato delle due squadre.
+    Il buffer perde una voce: quella che rientra nelle ultime BUFFER_SIZE si rilegge
+    dallo storico (una query per squadra, solo se la partita era nello stato).
+    """
+    for state in TeamRollingState.objects.filter(team_id__in=[match.home_team_id, match.away_team_id]):
+        entries = state.home_results + state.away_results
+        if state.season_id != match.season_id or all(e['match_id'] != match.id for e in entries):
+            continue
+        _reload(state)
+        state.save()
+
+
+def _reload(state):
+    """ Buffer della squadra riletti dallo storico della stagione dello stato. """
+    state.home_results, state.away_results, state.last_match_date = [], [], None
+    recent = Match.objects.filter(
+        Q(home_team_id=state.team_id) | Q(away_team_id=state.team_id),
+        season_id=state.season_id,
+        status='FINISHED'
+    ).select_related('result').order_by('-date_time')[:TeamRollingState.BUFFER_SIZE]
+    for m in recent:
+        _apply_entry(state, state.team_id, _entry(m, _result(m)))
+
+
+def rebuild_rolling_states():
+    """
+    Ricostruisce da zero gli stati delle squadre delle stagioni correnti (una query).
+    Usato dalla pipeline per riallineare lo stato a eventuali import esterni.
+    """
+    seasons = list(Season.objects.filter(is_current=True))
+    if not seasons:
+        latest = Season.objects.order_by('-year_start').first()
+        seasons = [latest] if latest else []
+    if not seasons:
+        return 0
+
+    matches = Match.objects.filter(
+        season__in=seasons,
+        status='FINISHED'
+    ).select_related('result').order_by('date_time')
+
+    states = {}
+    for m in matches:
+        entry = _entry(m, _result(m))
+        for team_id in (m.home_team_id, m.away_team_id):
+            state = states.get(team_id)
+            if state is None or state.season_id != m.season_id:
+                state = TeamRollingState(team_id=team_id, season_id=m.season_id)
+                states[team_id] = state
+            _apply_entry(state, team_id, entry)
+
+    existing = {s.team_id: s for s in TeamRollingState.objects.filter(team_id__in=states.keys())}
+    to_create, to_update = [], []
+    for team_id, state in states.items():
+        if team_id in existing:
+            state.pk = existing[team_id].pk
+            to_update.append(state)
+        else:
+            to_create.append(state)
+
+    TeamRollingState.objects.bulk_create(to_create)
+    TeamRollingState.objects.bulk_update(to_update, ['season', 'home_results', 'away_results', 'last_match_date'])
+    return len(states)
+
+
+def get_rolling_matches(team, season, date_limit):
+    """
+    Ultime partite della squadra (Newest->Oldest, max 15) lette dallo stato rolling,
+    come oggetti Match/MatchResult in memoria utilizzabili dalle funzioni di features.py.
+    Restituisce None se lo stato non copre la richiesta (stagione diversa o
+    partite già giocate dopo date_limit): il chiamante ripiega sullo storico.
+    """
+    state = TeamRollingState.objects.filter(team=team).first()
+    if not state or state.season_id != season.id or state.last_match_date is None:
+        return None
+    if state.last_match_date >= date_limit:
+        return None
+
+    teams = {}
+    def team_stub(team_id):
+        return team if team_id == team.id else teams.setdefault(team_id, Team(id=team_id))
+
+    past_matches = []
+    for e in _merged(state):
+        m = Match(id=e['match_id'], season_id=season.id, date_time=_entry_date(e), status='FINISHED')
+        m.home_team = team_stub(e['home_team_id'])
+        m.away_team = team_stub(e['away_team_id'])
+        if e['winner'] is not None:
+            m.result = MatchResult(
+                home_goals=e['home_goals'], away_goals=e['away_goals'], winner=e['winner'],
+                home_stats={'xg': e['home_xg']}, away_stats={'xg': e['away_xg']}
+            )
+        past_matches.append(m)
+    return past_matches
@@ -0,0 +1,147 @@
+"""
+Matrice dei risultati esatti (Poisson indipendente) e mercati derivati.
+
+La matrice M[i, j] è la probabilità che la partita finisca i-j, con i, j in
+0..max_goals, normalizzata a 1 (stessa normalizzazione del vecchio
+calcolo 1X2 a ciclo). Le funzioni di mercato lavorano sugli ultimi due assi,
+quindi accettano sia una singola matrice (G, G) sia un batch (N, G, G).
+"""
+import numpy as np
+
+MAX_GOALS = 10
+
+
+def _goal_grids(size):
+    home = np.arange(size)[:, None]
+    away = np.arange(size)[None, :]
+    return home - away, home + away
+
+
+def poisson_pmf(lambdas, max_goals=MAX_GOALS):
+    """ P(k; lambda) per k = 0..max_goals, per ogni lambda. Shape (N, max_goals + 1). """
+    lambdas = np.atleast_1d(np.asarray(lambdas, dtype=float))
+    goals = np.arange(max_goals + 1)
+    factorials = np.concatenate(([1.0], np.cumprod(np.arange(1, max_goals + 1, dtype=float))))
+
+    safe = np.clip(lambdas, 0.0, None)[:, None]
+    pmf = np.power(safe, goals) * np.exp(-safe) / factorials
+    # Lambda negativa = nessuna probabilità (come poisson_probability)
+    pmf[lambdas < 0] = 0.0
+    return pmf
+
+
+def build_score_matrices(home_lambdas, away_lambdas, max_goals=MAX_GOALS):
+    """
+    Matrici dei risultati per un batch di coppie (lambda_casa, lambda_ospite)
+    in un solo passaggio vettoriale. Shape (N, max_goals + 1, max_goals + 1).
+    """
+    matrices = poisson_pmf(home_lambdas, max_goals)[:, :, None] * poisson_pmf(away_lambdas, max_goals)[:, None, :]
+
+    # Normalizzazione (tronchiamo a max_goals, la somma sarebbe < 1.0)
+    totals = matrices.sum(axis=(1, 2), keepdims=True)
+    np.divide(matrices, totals, out=matrices, where=totals > 0)
+    return matrices
+
+
+# ------------------------------------------------------------------
+# Mercati (ultimi due assi = goal casa, goal ospite)
+# ------------------------------------------------------------------
+
+def prob_1x2(matrices):
+    """ (P1, PX, P2) """
+    diff, _ = _goal_grids(matrices.shape[-1])
+    return (
+        (matrices * (diff > 0)).sum(axis=(-2, -1)),
+        (matrices * (diff == 0)).sum(axis=(-2, -1)),
+        (matrices * (diff < 0)).sum(axis=(-2, -1)),
+    )
+
+
+def prob_gg_ng(matrices):
+    """ (P Goal, P No Goal) """
+    size = matrices.shape[-1]
+    both = (np.arange(size)[:, None] > 0) & (np.arange(size)[None, :] > 0)
+    p_gg = (matrices * both).sum(axis=(-2, -1))
+    return p_gg, matrices.sum(axis=(-2, -1)) - p_gg
+
+
+def prob_asian_handicap(matrices, line):
+    """
+    (P vinta, P rimborso, P persa) per la squadra di casa con handicap 'line' (es. -0.5, -1, +0.25).
+    Le linee a quarto (.25/.75) dividono la puntata sulle due linee adiacenti:
+    le probabilità restituite sono la media delle due metà.
+    """
+    if (line * 4) % 2 == 1:
+        halves = [prob_asian_handicap(matrices, line - 0.25), prob_asian_handicap(matrices, line + 0.25)]
+        return tuple((a + b) / 2 for a, b in zip(*halves))
+
+    diff, _ = _goal_grids(matrices.shape[-1])
+    adjusted = diff + line
+    return (
+        (matrices * (adjusted > 0)).sum(axis=(-2, -1)),
+        (matrices * (adjusted == 0)).sum(axis=(-2, -1)),
+        (matrices * (adjusted < 0)).sum(axis=(-2, -1)),
+    )
+
+
+class ScoreMatrix:
+    """
+    Matrice dei risultati di una singola partita con accesso ai mercati.
+    Usare for_prediction() per condividere la stessa matrice tra tutti i
+    calcoli di una Prediction, prime() per calcolare in blocco quelle di un gruppo
+    (OpportunityService.refresh).
+    """
+
+    CACHE_ATTR = '_score_matrix'
+
+    def __init__(self, home_lambda, away_lambda, max_goals=MAX_GOALS, matrix=None):
+        self.home_lambda = float(home_lambda)
+        self.away_lambda = float(away_lambda)
+        self.matrix = matrix if matrix is not None else build_score_matrices([self.home_lambda], [self.away_lambda], max_goals)[0]
+        self._1x2 = None
+
+    @classmethod
+    def batch(cls, home_lambdas, away_lambdas, max_goals=MAX_GOALS):
+        """ Una ScoreMatrix per ogni coppia di lambda, calcolate in un solo passaggio. """
+        matrices = build_score_matrices(home_lambdas, away_lambdas, max_goals)
+        return [cls(h, a, matrix=m) for h, a, m in zip(home_lambdas, away_lambdas, matrices)]
+
+    @classmethod
+    def prime(cls, predictions):
+        """
+        Memoizza sulle Prediction le matrici mancanti (o non più valide), calcolate
+        in un solo passaggio vettoriale: le chiamate successive a for_prediction le riusano.
+        """
+        missing = [p for p in predictions if cls._cached(p) is None]
+        if not missing:
+            return
+        matrices = cls.batch([float(p.home_goals) for p in missing], [float(p.away_goals) for p in missing])
+        for prediction, matrix in zip(missing, matrices):
+            setattr(prediction, cls.CACHE_ATTR, matrix)
+
+    @classmethod
+    def _cached(cls, prediction):
+        cached = getattr(prediction, cls.CACHE_ATTR, None)
+        if cached is None or (cached.home_lambda, cached.away_lambda) != (float(prediction.home_goals), float(prediction.away_goals)):
+            return None
+        return cached
+
+    @classmethod
+    def for_prediction(cls, prediction):
+        """ Matrice memoizzata sull'istanza Prediction (ricalcolata se cambiano i goal previsti). """
+        cached = cls._cached(prediction)
+        if cached is None:
+            cached = cls(prediction.home_goals, prediction.away_goals)
+            setattr(prediction, cls.CACHE_ATTR, cached)
+        return cached
+
+    def prob_1x2(self):
+        if self._1x2 is None:
+            self._1x2 = tuple(float(p) for p in prob_1x2(self.matrix))
+        return self._1x2
+
+    def prob_gg_ng(self):
+        return tuple(float(p) for p in prob_gg_ng(self.matrix))
+
+    def prob_asian_handicap(self, line):
+        return tuple(float(p) for p in prob_asian_handicap(self.matrix, line))
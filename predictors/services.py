@@ -1,78 +1,105 @@
-from .models import Match, Prediction, TeamFormSnapshot
-from .utils import generate_slip, get_multi_market_opportunities
+import hashlib
+import threading
+from contextlib import contextmanager
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Q, Max, Count, Value, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import (
+    Match, Prediction, TeamFormSnapshot, BettingOpportunity, Rivalry,
+    MatchLineup, MatchAbsence, PlayerMatchStat, Player, MatchAccuracy, RoundAccuracy,
+    OddsMovement, LeagueState,
+)
+from .utils import (
+    generate_slip, get_multi_market_opportunities, get_match_comparison_data,
+    get_probable_starters, detect_probable_formation,
+    score_match_accuracy, average_accuracy_metrics, ACCURACY_METRIC_SCORES,
+)
+from .tactical_engine import TacticalEngine
+from .score_matrix import ScoreMatrix
 from django.core.cache import cache
+from .current_state import current_round, form_sequences
+from .async_queries import gather
+from .detail_cache import CACHE_KEY as DETAIL_CACHE_KEY, invalidate_match_detail
 
 class DashboardService:
+    """
+    Contesto della dashboard, diviso in gruppi di query indipendenti:
+    get_dashboard_context li esegue in serie, aget_dashboard_context (vista async
+    sotto ASGI) in parallelo con predictors.async_queries.gather.
+    """
     @staticmethod
     def get_dashboard_context():
-        # 1. Ottimizzazione Query Matches
-        # Identify next gameweek
-        next_match = Match.objects.filter(status='SCHEDULED').order_by('date_time').first()
-        target_round = next_match.round_number if next_match else None
-
-        upcoming_query = Match.objects.none()
-        if target_round:
-            upcoming_query = Match.objects.filter(
-                status='SCHEDULED', 
+        upcoming_matches = DashboardService._upcoming_matches()
+        recent_matches = DashboardService._recent_matches()
+        if not upcoming_matches and not recent_matches:
+            return {'upcoming_matches': [], 'recent_matches': [], 'schedina': []}
+
+        predictions = DashboardService._predictions(upcoming_matches + recent_matches, upcoming_matches)
+        latest_forms = DashboardService._forms(upcoming_matches)
+        return DashboardService._context(upcoming_matches, recent_matches, predictions, latest_forms)
+
+    @staticmethod
+    async def aget_dashboard_context():
+        """ Come get_dashboard_context, con i gruppi indipendenti in parallelo (due fasi). """
+        upcoming_matches, recent_matches = await gather(
+            DashboardService._upcoming_matches, DashboardService._recent_matches
+        )
+        if not upcoming_matches and not recent_matches:
+            return {'upcoming_matches': [], 'recent_matches': [], 'schedina': []}
+
+        predictions, latest_forms = await gather(
+            lambda: DashboardService._predictions(upcoming_matches + recent_matches, upcoming_matches),
+            lambda: DashboardService._forms(upcoming_matches),
+        )
+        return await sync_to_async(DashboardService._context)(upcoming_matches, recent_matches, predictions, latest_forms)
+
+    @staticmethod
+    def _upcoming_matches():
+        # Solo la prossima giornata: il numero arriva dallo stato del campionato nella stessa query
+        target_round = LeagueState.objects.filter(pk=1).values('current_round')
+        return list(
+            Match.objects.filter(
+                status='SCHEDULED',
                 predictions__isnull=False,
-                round_number=target_round # Show ONLY this round
+                round_number=Subquery(target_round),
             ).select_related('home_team', 'away_team').order_by('date_time')
-        
-        recent_query = Match.objects.filter(status='FINISHED').select_related('home_team', 'away_team').order_by('-date_time')[:5]
-        
-        upcoming_matches = list(upcoming_query)
-        recent_matches = list(recent_query)
-        
-        # 2. Bulk Fetch Dati Correlati
-        all_matches = upcoming_matches + recent_matches
-        if not all_matches:
-            return {'upcoming_matches': [], 'recent_matches': [], 'schedina': []}
+        )
+
+    @staticmethod
+    def _recent_matches():
+        return list(Match.objects.filter(status='FINISHED').select_related('home_team', 'away_team').order_by('-date_time')[:5])
 
-        all_match_ids = [m.id for m in all_matches]
-        
-        # Mappa Predizioni
+    @staticmethod
+    def _predictions(matches, upcoming_matches):
+        """ (predictions_map, opportunities_map): previsioni delle partite e opportunità materializzate di quelle da giocare. """
         predictions_map = {
-            p.match_id: p 
-            for p in Prediction.objects.filter(match_id__in=all_match_ids)
+            p.match_id: p
+            for p in Prediction.objects.filter(match_id__in=[m.id for m in matches])
         }
+        upcoming_preds = [predictions_map[m.id] for m in upcoming_matches if m.id in predictions_map]
+        return predictions_map, OpportunityService.get_map(upcoming_preds)
 
-        # Mappa Snapshots (Solo Upcoming)
-        upcoming_ids = [m.id for m in upcoming_matches]
-        snapshots_map = {}
-        if upcoming_ids:
-            snaps = TeamFormSnapshot.objects.filter(match_id__in=upcoming_ids)
-            for s in snaps:
-                if s.match_id not in snapshots_map: snapshots_map[s.match_id] = {}
-                snapshots_map[s.match_id][s.team_id] = s
-
-        # Mappa Form Sequences (Ultime)
+    @staticmethod
+    def _forms(upcoming_matches):
         team_ids = {m.home_team_id for m in upcoming_matches} | {m.away_team_id for m in upcoming_matches}
-        latest_forms = {}
-        if team_ids:
-            # FIX: Filter out empty sequences to avoid future "ghost" snapshots
-            recent_snaps = TeamFormSnapshot.objects.filter(
-                team_id__in=team_ids
-            ).exclude(form_sequence="").order_by('team_id', '-match__date_time')
-            
-            # Prendiamo solo il primo per ogni team (simulato via Python per semplicità DB)
-            seen_teams = set()
-            for snap in recent_snaps:
-                if snap.team_id not in seen_teams:
-                    # REVERSE STRING: DB stores "Newest->Oldest", we want "Oldest->Newest" for display (Left->Right)
-                    latest_forms[snap.team_id] = snap.form_sequence
-                    seen_teams.add(snap.team_id)
-
-        # 3. Pack Data
+        return form_sequences(team_ids) if team_ids else {}
+
+    @staticmethod
+    def _context(upcoming_matches, recent_matches, predictions, latest_forms):
+        predictions_map, opportunities_map = predictions
         upcoming_data = DashboardService._pack_matches(
-            upcoming_matches, predictions_map, snapshots_map, latest_forms, is_upcoming=True
+            upcoming_matches, predictions_map, latest_forms, is_upcoming=True,
+            opportunities_map=opportunities_map
         )
         recent_data = DashboardService._pack_matches(
-            recent_matches, predictions_map, {}, {}, is_upcoming=False
+            recent_matches, predictions_map, {}, is_upcoming=False
         )
 
-        # 4. Schedina
+        # Schedina
         upcoming_preds = [predictions_map[m.id] for m in upcoming_matches if m.id in predictions_map]
-        schedina = generate_slip(upcoming_preds)
+        schedina = generate_slip(upcoming_preds, opportunities_map=opportunities_map)
 
         return {
             'upcoming_matches': upcoming_data,
@@ -81,7 +108,7 @@ class DashboardService:
         }
 
     @staticmethod
-    def _pack_matches(matches, predictions_map, snapshots_map, forms_map, is_upcoming):
+    def _pack_matches(matches, predictions_map, forms_map, is_upcoming, opportunities_map=None):
         data = []
         for m in matches:
             pred = predictions_map.get(m.id)
@@ -92,10 +119,7 @@ class DashboardService:
                 item['away_form'] = forms_map.get(m.away_team_id, "")
                 
                 if pred:
-                    match_snaps = snapshots_map.get(m.id, {})
-                    home_snap = match_snaps.get(m.home_team_id)
-                    away_snap = match_snaps.get(m.away_team_id)
-                    item['opportunities'] = get_multi_market_opportunities(pred, home_snap, away_snap)
+                    item['opportunities'] = (opportunities_map or {}).get(pred.id, [])
 
             data.append(item)
         return data
@@ -103,37 +127,575 @@ class DashboardService:
 class DataStatusService:
     """
     Centralizza la logica del 'Semaforo' per la qualità dei dati.
+    Lo stato è calcolato e salvato sul MatchResult a ogni save() (data_status,
+    missing_metrics): qui viene solo letto, anche in blocco con una query.
     """
     @staticmethod
     def analyze_match_data_status(match):
         """
         Ritorna (color, missing_count).
-        Color: 'green', 'yellow', 'red'
+        Color: 'green', 'yellow', 'red' (nessun risultato)
         """
-        status = 'red'
-        missing_count = 0
-        
-        if hasattr(match, 'result'):
-            res = match.result
-            if res.home_goals is not None:
-                status = 'yellow' # Risultato base presente
-                
-                # Controllo statistiche avanzate
-                key_metrics = ['xg', 'possession', 'corner', 'falli']
-                zeros = 0
-                
-                # Controlliamo entrambi i JSON
-                stats_sources = [res.home_stats or {}, res.away_stats or {}]
-                for source in stats_sources:
-                    for k in key_metrics:
-                        val = source.get(k)
-                        # Consideriamo mancante se nullo o zero (spesso indica dato non scaricato)
-                        if not val or float(val) == 0:
-                            zeros += 1
-                
-                if zeros == 0:
-                    status = 'green'
-                else:
-                    missing_count = zeros
-        
-        return status, missing_count
+        result = getattr(match, 'result', None)
+        if result is None:
+            return 'red', 0
+        return result.data_status, result.missing_metrics
+
+    @staticmethod
+    def annotate(matches):
+        """ Aggiunge data_status_color e missing_count alle partite nella stessa query. """
+        return matches.annotate(
+            data_status_color=Coalesce('result__data_status', Value('red')),
+            missing_count=Coalesce('result__missing_metrics', Value(0)),
+        )
+
+    @staticmethod
+    def incomplete_rounds():
+        """
+        Giornate (di tutte le stagioni) con partite terminate senza risultato (rosse)
+        o con statistiche mancanti (gialle), in una query sull'indice di data_status.
+        """
+        return list(
+            Match.objects.filter(status='FINISHED').exclude(result__data_status='green')
+            .values('season_id', 'season__year_start', 'season__year_end', 'round_number')
+            .annotate(
+                red=Count('id', filter=Q(result__isnull=True)),
+                yellow=Count('id', filter=Q(result__data_status='yellow')),
+            )
+            .order_by('-season__year_start', 'round_number')
+        )
+
+
+class OpportunityService:
+    """
+    Opportunità di scommessa materializzate nella tabella BettingOpportunity.
+
+    Vengono calcolate una volta quando predict_upcoming scrive le Prediction e
+    ricalcolate solo quando cambiano i loro input: quote (OddsMovement),
+    BettingConfiguration o AccuracyProfile (vedi predictors.signals).
+    Dashboard, schedina e dettaglio partita leggono solo le righe salvate.
+    """
+    _state = threading.local()
+
+    @staticmethod
+    def compute(predictions):
+        """ Opportunità delle Prediction indicate calcolate in memoria, senza scrivere. {prediction_id: [dict]} """
+        # Matrici dei risultati di tutte le previsioni in un solo passaggio (1X2, GG/NG, value bet)
+        ScoreMatrix.prime(predictions)
+        return {pred.id: get_multi_market_opportunities(pred) for pred in predictions}
+
+    @staticmethod
+    def refresh(predictions):
+        """ Ricalcola e salva le opportunità delle Prediction indicate. Restituisce {prediction_id: [dict]}. """
+        predictions = [p for p in predictions if p is not None]
+        if not predictions:
+            return {}
+
+        result = OpportunityService.compute(predictions)
+        rows = []
+        for pred in predictions:
+            rows.extend(
+                BettingOpportunity(
+                    prediction_id=pred.id,
+                    match_id=pred.match_id,
+                    rank=rank,
+                    label=op['label'],
+                    category=op['category'],
+                    stat_type=op['stat_type'],
+                    market_type=op.get('market_type') or '',
+                    score=op['score'],
+                    raw_score=op['raw_score'],
+                    multiplier=op['multiplier'],
+                    reasoning=op['reasoning'],
+                )
+                for rank, op in enumerate(result[pred.id])
+            )
+
+        prediction_ids = list(result)
+        with transaction.atomic():
+            BettingOpportunity.objects.filter(prediction_id__in=prediction_ids).delete()
+            BettingOpportunity.objects.bulk_create(rows, batch_size=500)
+            Prediction.objects.filter(id__in=prediction_ids).update(opportunities_updated_at=timezone.now())
+            MatchDetailAssembler.invalidate({pred.match_id for pred in predictions})
+        return result
+
+    @staticmethod
+    def get_map(predictions):
+        """
+        {prediction_id: [dict]} letto dalla tabella con una query.
+        Le Prediction mai calcolate (o invalidate) vengono calcolate in memoria senza
+        scrivere: la tabella la ripopola il ricalcolo dopo il commit (invalidate), non la lettura.
+        """
+        predictions = [p for p in predictions if p is not None]
+        opportunities_map = {p.id: [] for p in predictions}
+        for op in BettingOpportunity.objects.filter(prediction_id__in=list(opportunities_map)).order_by('prediction_id', 'rank'):
+            opportunities_map[op.prediction_id].append(op.as_dict())
+
+        stale = [p for p in predictions if p.opportunities_updated_at is None]
+        if stale:
+            opportunities_map.update(OpportunityService.compute(stale))
+        return opportunities_map
+
+    @staticmethod
+    def invalidate(match_ids=None):
+        """
+        Ricalcola subito dopo il commit le opportunità delle partite indicate o, senza
+        match_ids (configurazione o profili di accuratezza cambiati), di tutte le partite
+        in programma. Senza match_ids le partite giocate conservano le opportunità proposte allora.
+        """
+        state = OpportunityService._state
+        if getattr(state, 'depth', 0):
+            # Dentro deferred_refresh(): si accumula e si ricalcola una volta sola all'uscita
+            if match_ids is None or state.pending is None:
+                state.pending = None
+            else:
+                state.pending.update(match_ids)
+            return
+
+        def run():
+            if match_ids is None:
+                # Configurazione o profili di accuratezza cambiati: le cache non sono più valide
+                cache.delete_many(['betting_config', 'accuracy_profiles'])
+                predictions = Prediction.objects.filter(match__status='SCHEDULED')
+            else:
+                predictions = Prediction.objects.filter(match_id__in=list(match_ids))
+            OpportunityService.refresh(predictions.select_related('match'))
+
+        transaction.on_commit(run)
+
+    @staticmethod
+    @contextmanager
+    def deferred_refresh():
+        """ Raggruppa le invalidazioni (es. update_accuracy) in un unico ricalcolo all'uscita. """
+        state = OpportunityService._state
+        if not getattr(state, 'depth', 0):
+            state.pending = set()
+        state.depth = getattr(state, 'depth', 0) + 1
+        try:
+            yield
+        except Exception:
+            state.depth -= 1
+            raise
+        state.depth -= 1
+        if state.depth == 0:
+            pending, state.pending = state.pending, set()
+            if pending is None or pending:
+                OpportunityService.invalidate(pending)
+
+
+class MatchDetailAssembler:
+    """
+    Contesto della pagina match_detail in un numero fisso di query
+    (una per tipo di dato, per entrambe le squadre insieme).
+
+    Il contesto della partita è in cache per match (CACHE_KEY) e viene
+    invalidato solo quando cambiano previsione, formazioni, risultato, quote o
+    assenze di quella partita (predictors.signals, OpportunityService.refresh);
+    le scritture bulk, che non inviano segnali (calculate_features, EloEngine,
+    predict_upcoming), chiamano detail_cache.invalidate_match_detail.
+    La forma delle squadre dipende dalle altre partite: è letta a parte (una query).
+    """
+    CACHE_KEY = DETAIL_CACHE_KEY
+    CACHE_TIMEOUT = 3600  # rete di sicurezza: formazioni probabili/rose cambiano senza segnali
+    ROLE_PRIORITY = {'GK': 1, 'DEF': 2, 'MID': 3, 'FWD': 4}
+
+    @staticmethod
+    def get_context(match_id):
+        """ Contesto completo per il template; None se la partita non esiste. """
+        key = MatchDetailAssembler.CACHE_KEY.format(match_id)
+        context = cache.get(key)
+        if context is None:
+            context = MatchDetailAssembler.assemble(match_id)
+            if context is None:
+                return None
+            cache.set(key, context, MatchDetailAssembler.CACHE_TIMEOUT)
+        return MatchDetailAssembler._with_forms(context)
+
+    @staticmethod
+    async def aget_context(match_id):
+        """ Come get_context; se il contesto non è in cache i gruppi di query girano in parallelo. """
+        key = MatchDetailAssembler.CACHE_KEY.format(match_id)
+        context = await sync_to_async(cache.get)(key)
+        if context is None:
+            context = await MatchDetailAssembler.aassemble(match_id)
+            if context is None:
+                return None
+            await sync_to_async(cache.set)(key, context, MatchDetailAssembler.CACHE_TIMEOUT)
+        return await sync_to_async(MatchDetailAssembler._with_forms)(context)
+
+    @staticmethod
+    def _with_forms(context):
+        match = context['match']
+        forms = form_sequences([match.home_team_id, match.away_team_id])
+        return dict(
+            context,
+            home_form=forms.get(match.home_team_id) or "",
+            away_form=forms.get(match.away_team_id) or "",
+        )
+
+    @staticmethod
+    def invalidate(match_ids):
+        """ Elimina il contesto in cache delle partite indicate (dopo il commit). """
+        invalidate_match_detail(match_ids)
+
+    @staticmethod
+    def assemble(match_id):
+        match = MatchDetailAssembler._match(match_id)
+        if match is None:
+            return None
+        groups = MatchDetailAssembler._query_groups(match)
+        return MatchDetailAssembler._context(match, *(group() for group in groups))
+
+    @staticmethod
+    async def aassemble(match_id):
+        match = await sync_to_async(MatchDetailAssembler._match)(match_id)
+        if match is None:
+            return None
+        results = await gather(*MatchDetailAssembler._query_groups(match))
+        return await sync_to_async(MatchDetailAssembler._context)(match, *results)
+
+    @staticmethod
+    def _match(match_id):
+        return Match.objects.select_related('home_team', 'away_team', 'referee', 'result').filter(id=match_id).first()
+
+    @staticmethod
+    def _query_groups(match):
+        """ Gruppi di query indipendenti tra loro, nell'ordine degli argomenti di _context. """
+        return (
+            lambda: MatchDetailAssembler._prediction(match),
+            lambda: {s.team_id: s for s in TeamFormSnapshot.objects.filter(match=match)},
+            lambda: MatchDetailAssembler._rivalry(match),
+            lambda: MatchDetailAssembler._lineups(match),
+            lambda: MatchDetailAssembler._absences(match),
+        )
+
+    @staticmethod
+    def _prediction(match):
+        """ (ultima previsione, top 3 opportunità materializzate). """
+        prediction = Prediction.objects.filter(match=match).order_by('-created_at').first()
+        top_bets = OpportunityService.get_map([prediction])[prediction.id][:3] if prediction else []
+        return prediction, top_bets
+
+    @staticmethod
+    def _rivalry(match):
+        home_id, away_id = match.home_team_id, match.away_team_id
+        return Rivalry.objects.filter(
+            Q(team1_id=home_id, team2_id=away_id) |
+            Q(team1_id=away_id, team2_id=home_id)
+        ).first()
+
+    @staticmethod
+    def _lineups(match):
+        """ Formazioni (pre-match salvate, poi titolari effettivi, poi stima), moduli e report tattico. """
+        home_id, away_id = match.home_team_id, match.away_team_id
+        lineups_db = {}
+        for lineup in MatchLineup.objects.filter(match=match).order_by('-last_updated'):
+            lineups_db.setdefault(lineup.team_id, lineup)
+
+        is_probable_lineup = any(
+            l.starting_xi and l.status == 'PROBABLE' for l in lineups_db.values()
+        )
+        modules = {team_id: l.formation for team_id, l in lineups_db.items()}
+        lineup_ids = {team_id: l.starting_xi for team_id, l in lineups_db.items() if l.starting_xi}
+
+        displays = {}
+        missing = [team_id for team_id in (home_id, away_id) if team_id not in lineup_ids]
+        if missing:
+            played = {}
+            for stat in PlayerMatchStat.objects.filter(match=match, team_id__in=missing, is_starter=True).select_related('player'):
+                played.setdefault(stat.team_id, []).append(stat)
+            for team_id in missing:
+                if team_id in played:
+                    displays[team_id] = played[team_id]
+                    continue
+                # Nessun dato: formazione stimata dalle ultime partite
+                team = match.home_team if team_id == home_id else match.away_team
+                is_probable_lineup = True
+                pids = get_probable_starters(team, match.date_time)
+                modules[team_id] = detect_probable_formation(team, match.date_time)
+                lineup_ids[team_id] = pids
+                if team_id not in lineups_db:
+                    lineups_db[team_id] = MatchLineup(match=match, team=team, formation=modules[team_id], starting_xi=pids)
+
+        # Giocatori di entrambe le formazioni in una query
+        to_fetch = {team_id: ids for team_id, ids in lineup_ids.items() if team_id not in displays}
+        all_ids = {pid for ids in to_fetch.values() for pid in ids}
+        players = list(Player.objects.filter(id__in=all_ids)) if all_ids else []
+        for team_id, ids in to_fetch.items():
+            wanted = set(ids)
+            team_players = [p for p in players if p.id in wanted]
+            team_players.sort(key=lambda p: MatchDetailAssembler.ROLE_PRIORITY.get(p.primary_position, 99))
+            displays[team_id] = [
+                {'player': p, 'position': p.primary_position, 'is_starter': True, 'minutes': 'Est', 'goals': 0, 'xg': 0}
+                for p in team_players
+            ]
+
+        return {
+            'home_lineup': displays.get(home_id, []),
+            'away_lineup': displays.get(away_id, []),
+            'is_probable_lineup': is_probable_lineup,
+            'home_module': modules.get(home_id, "4-3-3"),
+            'away_module': modules.get(away_id, "4-3-3"),
+            'tactical_report': TacticalEngine.analyze_matchup(lineups_db.get(home_id), lineups_db.get(away_id)),
+        }
+
+    @staticmethod
+    def _absences(match):
+        absences = {match.home_team_id: [], match.away_team_id: []}
+        for absence in MatchAbsence.objects.filter(match=match).select_related('player'):
+            absences.setdefault(absence.team_id, []).append(absence)
+        return absences
+
+    @staticmethod
+    def _context(match, prediction, snaps, rivalry, lineups, absences):
+        prediction, top_bets = prediction
+        return {
+            'match': match,
+            'prediction': prediction,
+            'comparison_data': get_match_comparison_data(match, prediction),
+            'home_snap': snaps.get(match.home_team_id),
+            'away_snap': snaps.get(match.away_team_id),
+            'rivalry': rivalry,
+            **lineups,
+            'home_absences': absences[match.home_team_id],
+            'away_absences': absences[match.away_team_id],
+            'top_bets': top_bets,
+        }
+
+
+class AccuracyRollupService:
+    """
+    Accuratezza precalcolata per la pagina Performance.
+    MatchAccuracy: una riga per partita giocata con previsione (ultima per created_at).
+    RoundAccuracy: medie per (stagione, giornata), ricalcolate solo per le giornate toccate.
+    La pagina legge solo queste righe: il costo non cresce con lo storico.
+    Aggiornato dai segnali di Prediction e MatchResult (predictors.signals).
+    """
+    SCORE_FIELDS = list(ACCURACY_METRIC_SCORES.values()) + ['score', 'color', 'is_correct_1x2']
+    ROUND_FIELDS = ['matches_count', 'global_score_avg'] + list(ACCURACY_METRIC_SCORES) + ['updated_at']
+
+    @staticmethod
+    def refresh_matches(match_ids):
+        """ Ricalcola le righe delle partite indicate e i rollup delle loro giornate. """
+        match_ids = list(set(match_ids))
+        if not match_ids:
+            return
+        with transaction.atomic():
+            rounds = set(MatchAccuracy.objects.filter(match_id__in=match_ids).values_list('match__season_id', 'round_number'))
+            rows = AccuracyRollupService._build_rows(
+                Match.objects.filter(id__in=match_ids),
+                Prediction.objects.filter(match_id__in=match_ids),
+            )
+            MatchAccuracy.objects.filter(match_id__in=match_ids).delete()
+            MatchAccuracy.objects.bulk_create(rows, batch_size=500)
+            AccuracyRollupService.refresh_rounds(rounds | {(row.match.season_id, row.round_number) for row in rows})
+
+    @staticmethod
+    def refresh_rounds(rounds):
+        """ Ricalcola i rollup delle giornate indicate, come coppie (season_id, round_number), in ordine di data. """
+        rounds = set(rounds)
+        if not rounds:
+            return
+        scores_by_round = {key: [] for key in rounds}
+        rows = MatchAccuracy.objects.filter(
+            match__season_id__in={season_id for season_id, _ in rounds},
+            round_number__in={round_number for _, round_number in rounds},
+        ).order_by('match__date_time').values('match__season_id', 'round_number', *ACCURACY_METRIC_SCORES.values())
+        for row in rows:
+            key = (row['match__season_id'], row['round_number'])
+            if key in scores_by_round:
+                scores_by_round[key].append(row)
+
+        now = timezone.now()
+        rollups = [
+            RoundAccuracy(season_id=season_id, round_number=r, matches_count=len(scores), updated_at=now, **average_accuracy_metrics(scores))
+            for (season_id, r), scores in scores_by_round.items() if scores
+        ]
+        for season_id, r in [key for key, scores in scores_by_round.items() if not scores]:
+            RoundAccuracy.objects.filter(season_id=season_id, round_number=r).delete()
+        RoundAccuracy.objects.bulk_create(
+            rollups,
+            update_conflicts=True,
+            unique_fields=['season', 'round_number'],
+            update_fields=AccuracyRollupService.ROUND_FIELDS,
+        )
+
+    @staticmethod
+    def latest_season_id():
+        """ Stagione più recente con almeno un rollup (None se la tabella è vuota). """
+        return RoundAccuracy.objects.order_by('-season__year_start').values_list('season_id', flat=True).first()
+
+    @staticmethod
+    def get_rounds(season_id):
+        """ Rollup delle giornate di una stagione (popolati dalla migrazione 0027, poi incrementali). """
+        return list(RoundAccuracy.objects.filter(season_id=season_id))
+
+    @staticmethod
+    def round_detail(season_id, round_number):
+        """ Righe di dettaglio di una giornata nel formato di calculate_accuracy_metrics()['matches_detail']. """
+        rows = MatchAccuracy.objects.filter(match__season_id=season_id, round_number=round_number).select_related(
+            'match__home_team', 'match__away_team', 'match__result', 'prediction'
+        ).order_by('match__date_time')
+        return [
+            {
+                'match': row.match,
+                'prediction': row.prediction,
+                'result': row.match.result,
+                'score_1x2': row.score_1x2,
+                'score_goals': row.score_goals,
+                'score': row.score,
+                'color': row.color,
+                'is_correct_1x2': row.is_correct_1x2,
+            }
+            for row in rows
+        ]
+
+    @staticmethod
+    def _build_rows(matches, predictions):
+        latest = {}
+        for pred in predictions.order_by('created_at', 'id'):
+            latest[pred.match_id] = pred
+
+        rows = []
+        for match in matches.filter(status='FINISHED', result__isnull=False).select_related('result'):
+            pred = latest.get(match.id)
+            if pred is None:
+                continue
+            scores = score_match_accuracy(pred, match.result)
+            rows.append(MatchAccuracy(
+                match=match,
+                prediction=pred,
+                round_number=match.round_number,
+                **{field: scores[field] for field in AccuracyRollupService.SCORE_FIELDS}
+            ))
+        return rows
+
+
+class PredictionApiService:
+    """
+    Payload dell'API JSON di sola lettura (predictors.api): previsioni, snapshot,
+    quote, opportunità e schedina, per giornata o per singola partita.
+    version() è la query leggera usata per ETag/Last-Modified: il payload completo
+    viene costruito solo quando il client non ha già la versione corrente.
+    Le opportunità da ricalcolare sono calcolate in memoria senza scriverle
+    (OpportunityService.get_map): la richiesta successiva trova lo stesso ETag.
+    """
+    SCHEMA_VERSION = 1  # da incrementare se cambia la forma del JSON
+
+    @staticmethod
+    def next_round():
+        """ (season_id, round_number) della prossima giornata da giocare (come la dashboard), o None. """
+        return current_round()
+
+    @staticmethod
+    def version(matches):
+        """
+        (etag, last_modified) di un insieme di partite in una query: per partita data/stato,
+        ultima previsione e opportunità, numero e ultimo aggiornamento delle quote.
+        Gli snapshot esposti (solo partite da giocare) sono scritti insieme alle previsioni.
+        """
+        rows = list(matches.annotate(
+            pred_updated=Max('predictions__updated_at'),
+            pred_count=Count('predictions', distinct=True),
+            opp_updated=Max('predictions__opportunities_updated_at'),
+            odds_updated=Max('odds__last_updated'),
+            odds_count=Count('odds', distinct=True),
+        ).order_by('date_time', 'id').values_list(
+            'id', 'date_time', 'status', 'pred_updated', 'pred_count', 'opp_updated', 'odds_updated', 'odds_count'
+        ))
+        digest = hashlib.sha1(repr((PredictionApiService.SCHEMA_VERSION, rows)).encode()).hexdigest()
+        stamps = [stamp for row in rows for stamp in (row[3], row[5], row[6]) if stamp is not None]
+        return f'"{digest}"', max(stamps) if stamps else None
+
+    @staticmethod
+    def build(matches, with_slip=False):
+        """ {'matches': [...]} (+ 'slip') per le partite indicate, con un numero fisso di query. """
+        groups = PredictionApiService._query_groups(matches)
+        return PredictionApiService._payload(*(group() for group in groups), with_slip=with_slip)
+
+    @staticmethod
+    async def abuild(matches, with_slip=False):
+        """ Come build, con i gruppi di query in parallelo (viste async). """
+        results = await gather(*PredictionApiService._query_groups(matches))
+        return await sync_to_async(PredictionApiService._payload)(*results, with_slip=with_slip)
+
+    @staticmethod
+    def _query_groups(matches):
+        """
+        Gruppi di query indipendenti (le partite entrano come sottoquery, non come id già letti),
+        nell'ordine degli argomenti di _payload.
+        """
+        return (
+            lambda: list(matches.select_related('home_team', 'away_team').order_by('date_time', 'id')),
+            lambda: PredictionApiService._predictions(matches),
+            lambda: PredictionApiService._snapshots(matches),
+            lambda: PredictionApiService._odds(matches),
+        )
+
+    @staticmethod
+    def _predictions(matches):
+        """ (ultima previsione per partita come match_detail, opportunità materializzate). """
+        predictions_map = {}
+        for pred in Prediction.objects.filter(match__in=matches).select_related('match').order_by('created_at', 'id'):
+            predictions_map[pred.match_id] = pred
+        return predictions_map, OpportunityService.get_map(list(predictions_map.values()))
+
+    @staticmethod
+    def _snapshots(matches):
+        snapshots_map = {}
+        for snap in TeamFormSnapshot.objects.filter(match__in=matches.filter(status='SCHEDULED')):
+            snapshots_map.setdefault(snap.match_id, {})[snap.team_id] = snap
+        return snapshots_map
+
+    @staticmethod
+    def _odds(matches):
+        odds_map = {}
+        for odds in OddsMovement.objects.filter(match__in=matches).order_by('bookmaker', 'id'):
+            odds_map.setdefault(odds.match_id, []).append(odds)
+        return odds_map
+
+    @staticmethod
+    def _payload(matches, predictions, snapshots_map, odds_map, with_slip=False):
+        predictions_map, opportunities_map = predictions
+        payload = {'matches': []}
+        for m in matches:
+            pred = predictions_map.get(m.id)
+            snaps = snapshots_map.get(m.id, {})
+            payload['matches'].append({
+                'id': m.id,
+                'season_id': m.season_id,
+                'round': m.round_number,
+                'date_time': m.date_time,
+                'status': m.status,
+                'home_team': PredictionApiService._team(m.home_team),
+                'away_team': PredictionApiService._team(m.away_team),
+                'prediction': PredictionApiService._values(pred, exclude=('id', 'match')) if pred else None,
+                'snapshots': {
+                    'home': PredictionApiService._values(snaps.get(m.home_team_id), exclude=('id', 'match', 'team')),
+                    'away': PredictionApiService._values(snaps.get(m.away_team_id), exclude=('id', 'match', 'team')),
+                } if m.status == 'SCHEDULED' else None,
+                'odds': [PredictionApiService._values(o, exclude=('id', 'match')) for o in odds_map.get(m.id, [])],
+                'opportunities': opportunities_map.get(pred.id, []) if pred else [],
+            })
+
+        if with_slip:
+            scheduled_preds = [p for p in predictions_map.values() if p.match.status == 'SCHEDULED']
+            payload['slip'] = [
+                {'match_id': pick['match'].id, 'tip': pick['tip'], 'score': pick['score']}
+                for pick in generate_slip(scheduled_preds, opportunities_map=opportunities_map)
+            ]
+        return payload
+
+    @staticmethod
+    def _team(team):
+        return {'id': team.id, 'name': team.name, 'short_name': team.short_name}
+
+    @staticmethod
+    def _values(obj, exclude=()):
+        if obj is None:
+            return None
+        return {
+            field.name: field.value_from_object(obj)
+            for field in obj._meta.concrete_fields
+            if field.name not in exclude
+        }
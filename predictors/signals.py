@@ -0,0 +1,103 @@
+import copy
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import (
+    BettingConfiguration, AccuracyProfile, OddsMovement,
+    Match, Prediction, MatchResult, MatchLineup, MatchAbsence, TeamFormSnapshot,
+)
+from .services import OpportunityService, MatchDetailAssembler, AccuracyRollupService
+from .standings import StandingsLedger
+from .team_stats import TeamSeasonStats
+from .current_state import CurrentState
+from .rolling_state import forget_match, record_match
+
+
+# Input delle BettingOpportunity materializzate: se cambiano, si ricalcola
+
+@receiver([post_save, post_delete], sender=BettingConfiguration)
+@receiver([post_save, post_delete], sender=AccuracyProfile)
+def opportunities_inputs_changed(sender, **kwargs):
+    OpportunityService.invalidate()
+
+
+@receiver([post_save, post_delete], sender=OddsMovement)
+def opportunities_odds_changed(sender, instance, **kwargs):
+    OpportunityService.invalidate(match_ids=[instance.match_id])
+    MatchDetailAssembler.invalidate([instance.match_id])
+
+
+@receiver(post_save, sender=Prediction)
+def opportunities_prediction_saved(sender, instance, **kwargs):
+    # Previsione scritta a mano (admin): predict_upcoming scrive in bulk e ricalcola da sé
+    OpportunityService.invalidate(match_ids=[instance.match_id])
+
+
+# Contesto in cache di match_detail: invalidato solo per la partita toccata
+
+@receiver([post_save, post_delete], sender=Prediction)
+@receiver([post_save, post_delete], sender=MatchResult)
+@receiver([post_save, post_delete], sender=MatchLineup)
+@receiver([post_save, post_delete], sender=MatchAbsence)
+@receiver([post_save, post_delete], sender=TeamFormSnapshot)
+def match_detail_changed(sender, instance, **kwargs):
+    MatchDetailAssembler.invalidate([instance.match_id])
+
+
+# Rollup di accuratezza (pagina Performance): solo la partita e la sua giornata
+
+@receiver([post_save, post_delete], sender=Prediction)
+@receiver([post_save, post_delete], sender=MatchResult)
+def accuracy_inputs_changed(sender, instance, **kwargs):
+    match_id = instance.match_id
+    transaction.on_commit(lambda: AccuracyRollupService.refresh_matches([match_id]))
+
+
+# Classifica per giornata: dalla giornata della partita in poi (es. modifica da admin)
+
+@receiver([post_save, post_delete], sender=MatchResult)
+def standings_result_changed(sender, instance, **kwargs):
+    match = instance.match
+    transaction.on_commit(lambda: StandingsLedger.on_result_saved(match))
+
+
+# Statistiche per stagione delle due squadre della partita (pagina squadra)
+
+@receiver([post_save, post_delete], sender=MatchResult)
+def team_stats_result_changed(sender, instance, **kwargs):
+    match = instance.match
+    transaction.on_commit(lambda: TeamSeasonStats.on_result_saved(match))
+
+
+# Stato rolling delle due squadre (ultime partite lette dalle feature delle previsioni).
+# Anche il Match conta: chi salva il risultato spesso mette FINISHED solo dopo.
+
+@receiver([post_save, post_delete], sender=MatchResult)
+def rolling_state_result_changed(sender, instance, **kwargs):
+    match = instance.match
+    transaction.on_commit(lambda: record_match(match))
+
+
+@receiver(post_save, sender=Match)
+def rolling_state_match_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: record_match(instance))
+
+
+@receiver(post_delete, sender=Match)
+def rolling_state_match_deleted(sender, instance, **kwargs):
+    # Copia: a fine cancellazione Django azzera la pk dell'istanza, prima del commit
+    match = copy.copy(instance)
+    transaction.on_commit(lambda: forget_match(match))
+
+
+# Stato corrente delle due squadre (forma, ultima/prossima partita) e giornata corrente
+
+@receiver([post_save, post_delete], sender=MatchResult)
+def current_state_result_changed(sender, instance, **kwargs):
+    match = instance.match
+    transaction.on_commit(lambda: CurrentState.on_result_saved(match))
+
+
+@receiver([post_save, post_delete], sender=Match)
+def current_state_match_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: CurrentState.on_match_saved(instance))
@@ -0,0 +1,213 @@
+"""
+Classifica per stagione e giornata (StandingEntry).
+
+Il ledger contiene, per ogni giornata, la classifica con tutte le partite
+giocate fino a quella giornata compresa: "classifica alla giornata R" è una
+sola lettura indicizzata (season, round_number). Quando si salva un risultato
+(segnale di MatchResult) vengono riscritte solo le giornate da quella della
+partita in poi; negli import massivi StandingsLedger.deferred() raggruppa i
+risultati in un ricalcolo per stagione.
+
+Le feature (posizione e distanza dalla vetta prima della partita) non leggono il
+ledger: una partita rinviata vi conta nella giornata originale, anche se giocata
+settimane dopo. Usano la classifica alla data (StandingsTimeline), costruita solo
+con le partite giocate prima del calcio d'inizio.
+"""
+import bisect
+import threading
+from contextlib import contextmanager
+from django.db import transaction
+from django.db.models import Subquery
+from predictors.models import Match, Season, StandingEntry
+
+TOTAL_FIELDS = ('played', 'won', 'drawn', 'lost', 'gf', 'ga', 'points')
+
+
+def _apply_result(totals, home_id, away_id, home_goals, away_goals, winner):
+    """ Aggiunge un risultato ai totali per squadra. """
+    for team_id, gf, ga, outcome in (
+        (home_id, home_goals, away_goals, {'1': 'won', 'X': 'drawn', '2': 'lost'}[winner]),
+        (away_id, away_goals, home_goals, {'1': 'lost', 'X': 'drawn', '2': 'won'}[winner]),
+    ):
+        t = totals.setdefault(team_id, dict.fromkeys(TOTAL_FIELDS, 0))
+        t['played'] += 1
+        t[outcome] += 1
+        t['gf'] += gf
+        t['ga'] += ga
+        t['points'] += {'won': 3, 'drawn': 1, 'lost': 0}[outcome]
+
+
+def _rank(totals):
+    """ Righe della classifica: punti, differenza reti, goal fatti (come la vecchia vista), poi id squadra. """
+    ranking = sorted(
+        totals.items(),
+        key=lambda item: (-item[1]['points'], -(item[1]['gf'] - item[1]['ga']), -item[1]['gf'], item[0])
+    )
+    leader_points = ranking[0][1]['points']
+    return [
+        dict(t, team_id=team_id, position=position, points_gap_top=leader_points - t['points'])
+        for position, (team_id, t) in enumerate(ranking, start=1)
+    ]
+
+
+def compute_tables(team_ids, results):
+    """
+    Classifiche progressive (funzione pura).
+    results: (round_number, home_id, away_id, home_goals, away_goals, winner) delle partite finite.
+    Restituisce {round_number: [riga]} per ogni giornata tra la prima e l'ultima giocata;
+    ogni riga è un dict con team_id, position, points_gap_top e i TOTAL_FIELDS.
+    """
+    by_round = {}
+    for row in results:
+        by_round.setdefault(row[0], []).append(row)
+    if not by_round:
+        return {}
+
+    totals = {team_id: dict.fromkeys(TOTAL_FIELDS, 0) for team_id in team_ids}
+    tables = {}
+    for round_number in range(min(by_round), max(by_round) + 1):
+        for row in by_round.get(round_number, []):
+            _apply_result(totals, *row[1:])
+        tables[round_number] = _rank(totals)
+    return tables
+
+
+class StandingsTimeline:
+    """
+    Classifica alla data di una stagione (in memoria): dopo ogni data con partite
+    giocate, {team_id: (posizione, punti dalla vetta)}. Stesso ordinamento del ledger.
+    """
+
+    def __init__(self, team_ids, results):
+        """ results: (date_time, home_id, away_id, home_goals, away_goals, winner) delle partite finite. """
+        totals = {team_id: dict.fromkeys(TOTAL_FIELDS, 0) for team_id in team_ids}
+        self.dates, self.tables = [], []
+        results = sorted(results, key=lambda row: row[0])
+        for i, (date_time, *row) in enumerate(results):
+            _apply_result(totals, *row)
+            # Partite alla stessa ora: la classifica si legge solo dopo l'ultima
+            if i + 1 == len(results) or results[i + 1][0] != date_time:
+                self.dates.append(date_time)
+                self.tables.append({r['team_id']: (r['position'], r['points_gap_top']) for r in _rank(totals)})
+
+    def before(self, team_id, date_limit):
+        """ (posizione, punti dalla vetta) con le sole partite giocate prima di date_limit, None se nessuna. """
+        idx = bisect.bisect_left(self.dates, date_limit)
+        return self.tables[idx - 1].get(team_id) if idx > 0 else None
+
+    @classmethod
+    def for_seasons(cls, season_ids, until=None):
+        """ {season_id: StandingsTimeline} in una query; until esclude le partite da quella data in poi. """
+        team_ids, results = {}, {}
+        for season_id, home_id, away_id, status, date_time, home_goals, away_goals, winner in Match.objects.filter(
+            season_id__in=season_ids
+        ).values_list(
+            'season_id', 'home_team_id', 'away_team_id', 'status', 'date_time',
+            'result__home_goals', 'result__away_goals', 'result__winner',
+        ):
+            team_ids.setdefault(season_id, set()).update((home_id, away_id))
+            # Come il ledger: partite finite con risultato
+            if status == 'FINISHED' and winner is not None and (until is None or date_time < until):
+                results.setdefault(season_id, []).append((date_time, home_id, away_id, home_goals, away_goals, winner))
+        return {season_id: cls(teams, results.get(season_id, [])) for season_id, teams in team_ids.items()}
+
+
+class StandingsLedger:
+    """ Aggiornamento e lettura delle StandingEntry di una stagione. """
+
+    BATCH_SIZE = 500
+    _state = threading.local()
+
+    def __init__(self, season_id):
+        self.season_id = season_id
+
+    @classmethod
+    def on_result_saved(cls, match):
+        """ Riscrive la classifica della stagione dalla giornata della partita in poi. """
+        pending = getattr(cls._state, 'pending', None)
+        if pending is not None:
+            pending[match.season_id] = min(pending.get(match.season_id, match.round_number), match.round_number)
+            return
+        cls(match.season_id).update(from_round=match.round_number)
+
+    @classmethod
+    @contextmanager
+    def deferred(cls):
+        """
+        Import massivi: i risultati salvati nel blocco non riscrivono la classifica uno
+        per uno; all'uscita ogni stagione toccata viene ricalcolata una volta sola,
+        dalla giornata più bassa in poi.
+        """
+        if getattr(cls._state, 'pending', None) is not None:
+            yield
+            return
+        cls._state.pending = {}
+        try:
+            yield
+        finally:
+            pending, cls._state.pending = cls._state.pending, None
+            for season_id, from_round in pending.items():
+                cls(season_id).update(from_round=from_round)
+
+    def update(self, from_round=None):
+        """
+        Ricalcola le classifiche (una query sui risultati della stagione, in memoria)
+        e riscrive solo le giornate >= from_round (tutte se None).
+        Restituisce il numero di righe scritte.
+        """
+        matches = Match.objects.filter(season_id=self.season_id)
+        team_ids = set()
+        for home_id, away_id in matches.values_list('home_team_id', 'away_team_id'):
+            team_ids.update((home_id, away_id))
+        results = matches.filter(status='FINISHED', result__isnull=False).values_list(
+            'round_number', 'home_team_id', 'away_team_id', 'result__home_goals', 'result__away_goals', 'result__winner'
+        )
+        tables = compute_tables(team_ids, results)
+
+        rows = [
+            StandingEntry(season_id=self.season_id, round_number=round_number, **row)
+            for round_number, table in tables.items()
+            if from_round is None or round_number >= from_round
+            for row in table
+        ]
+
+        with transaction.atomic():
+            stale = StandingEntry.objects.filter(season_id=self.season_id)
+            if from_round is not None:
+                stale = stale.filter(round_number__gte=from_round)
+            stale.delete()
+            StandingEntry.objects.bulk_create(rows, batch_size=self.BATCH_SIZE)
+        return len(rows)
+
+    @classmethod
+    def rebuild_all(cls):
+        """ Ricostruisce le classifiche di tutte le stagioni (import esterni, ricalcolo feature). """
+        return sum(cls(season_id).update() for season_id in Season.objects.values_list('id', flat=True))
+
+    def table(self, round_number=None):
+        """
+        Classifica alla giornata indicata (ultima disponibile se None o oltre l'ultima),
+        in una sola query: la giornata viene risolta con una subquery sull'indice.
+        """
+        rounds = StandingEntry.objects.filter(season_id=self.season_id)
+        if round_number is not None:
+            rounds = rounds.filter(round_number__lte=round_number)
+        resolved = rounds.order_by('-round_number').values('round_number')[:1]
+        return list(
+            StandingEntry.objects.filter(season_id=self.season_id, round_number=Subquery(resolved))
+            .select_related('team').order_by('position')
+        )
+
+    @staticmethod
+    def current_season():
+        season = Season.objects.filter(is_current=True).first()
+        return season or Season.objects.last()
+
+
+def standing_before(team_id, season_id, date_limit):
+    """
+    (posizione, punti dalla vetta) della squadra con le sole partite della stagione
+    giocate prima di date_limit (None se nessuna). Una query sulle partite della stagione.
+    """
+    timeline = StandingsTimeline.for_seasons([season_id], until=date_limit).get(season_id)
+    return timeline.before(team_id, date_limit) if timeline else None
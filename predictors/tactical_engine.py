@@ -64,8 +64,8 @@ class TacticalEngine:
         if not player_ids:
             return 50.0
             
-        attrs = PlayerAttributes.objects.filter(player_id__in=player_ids)
-        if not attrs.exists():
+        attrs = list(PlayerAttributes.objects.filter(player_id__in=player_ids).select_related('player'))
+        if not attrs:
             return 60.0
             
         total_score = 0.0
@@ -1,54 +1,52 @@
-from django.core.cache import cache
 from django.core.management import call_command
+from predictors.impact import ResultImpact
+from predictors.models import Match
+from predictors.pipeline_dag import PIPELINE
+from predictors.pipeline_progress import PipelineTracker
 
-def run_pipeline_task():
+# Fasi della pipeline completa: (comando, messaggio, peso nella percentuale complessiva).
+# Dipendenze e input delle fasi sono in pipeline_dag.PIPELINE
+PIPELINE_STAGES = PIPELINE.stage_rows()
+
+SCRAPING_STAGES = [
+    ('scrape_understat_gameweek', '📡 Scaricamento dati da Understat...', 1),
+]
+
+def run_pipeline_task(run_id=None, force=False):
     """
     Task asincrono per l'esecuzione della pipeline completa ML.
-    Eseguito tramite Django Q worker.
+    Eseguito tramite Django Q worker. Avanzamento e tempi in PipelineRun (run_id creato dalla vista).
+    Le fasi con input invariati dall'ultima esecuzione vengono saltate (force=True le esegue tutte).
     """
+    tracker = PipelineTracker.for_run(run_id, 'pipeline', PIPELINE_STAGES)
     try:
-        cache.set('pipeline_status', {'state': 'running', 'progress': 5, 'message': 'Inizializzazione...'}, timeout=3600)
-        
-        # 1. Update Fixtures
-        cache.set('pipeline_status', {'state': 'running', 'progress': 10, 'message': '📡 Scaricamento dati API (Match e Risultati)...'}, timeout=3600)
-        call_command('update_fixtures')
-        
-        # 2. Calculate Features
-        cache.set('pipeline_status', {'state': 'running', 'progress': 30, 'message': '🧮 Calcolo statistiche avanzate e snapshot...'}, timeout=3600)
-        call_command('calculate_features')
-        
-        # 3. Calculate ELO
-        cache.set('pipeline_status', {'state': 'running', 'progress': 50, 'message': '📈 Aggiornamento Rating ELO storico...'}, timeout=3600)
-        call_command('calculate_elo')
-        
-        # 4. Train Model
-        cache.set('pipeline_status', {'state': 'running', 'progress': 70, 'message': '🧠 Addestramento Intelligenza Artificiale (XGBoost)...'}, timeout=3600)
-        call_command('train_model')
-        
-        # 5. Predict
-        cache.set('pipeline_status', {'state': 'running', 'progress': 90, 'message': '🔮 Generazione nuove previsioni...'}, timeout=3600)
-        call_command('predict_upcoming')
-        
-        # Finish
-        cache.set('pipeline_status', {'state': 'completed', 'progress': 100, 'message': '✅ Aggiornamento completato con successo!'}, timeout=3600)
-        
+        outcomes = PIPELINE.run(tracker, force=force)
+        skipped = sum(1 for outcome in outcomes.values() if outcome == 'skipped')
+        suffix = f" ({skipped} fasi saltate: input invariati)" if skipped else ""
+        tracker.finish(f'✅ Aggiornamento completato con successo!{suffix}')
+
     except Exception as e:
-        cache.set('pipeline_status', {'state': 'error', 'progress': 0, 'message': f'❌ Errore: {str(e)}'}, timeout=3600)
+        tracker.fail(f'❌ Errore: {str(e)}')
 
-def run_scraping_task(gameweek):
+def run_scraping_task(gameweek, run_id=None):
     """
     Task asincrono per lo scraping di una specifica giornata.
     Eseguito tramite Django Q worker.
     """
+    tracker = PipelineTracker.for_run(run_id, 'scraping', SCRAPING_STAGES)
     try:
-        cache.set('scraping_status', {'state': 'running', 'progress': 5, 'message': f'Avvio scraping giornata {gameweek}...'}, timeout=3600)
-        
-        cache.set('scraping_status', {'state': 'running', 'progress': 20, 'message': '📡 Scaricamento dati da Understat...'}, timeout=3600)
-        
-        # Eseguiamo il comando
-        call_command('scrape_understat_gameweek', gameweek=int(gameweek))
-        
-        cache.set('scraping_status', {'state': 'completed', 'progress': 100, 'message': f'✅ Dati giornata {gameweek} scaricati!'}, timeout=3600)
-        
+        with tracker.stage('scrape_understat_gameweek'):
+            # Eseguiamo il comando
+            call_command('scrape_understat_gameweek', gameweek=int(gameweek))
+
+        tracker.finish(f'✅ Dati giornata {gameweek} scaricati!')
+
     except Exception as e:
-        cache.set('scraping_status', {'state': 'error', 'progress': 0, 'message': f'❌ Errore: {str(e)}'}, timeout=3600)
+        tracker.fail(f'❌ Errore: {str(e)}')
+
+def propagate_results_task(match_ids):
+    """
+    Task asincrono dopo la correzione manuale di un risultato: ricalcola solo
+    snapshot, ELO e previsioni che dipendono dalle partite indicate.
+    """
+    ResultImpact.propagate(list(Match.objects.filter(id__in=match_ids)))
@@ -0,0 +1,176 @@
+"""
+Statistiche di squadra per stagione (TeamSeasonAggregate), divise casa/trasferta.
+
+La pagina squadra legge poche righe già sommate (una per stagione) invece di
+aggregare tutte le partite giocate a ogni richiesta. Quando si salva un
+risultato (segnale di MatchResult) vengono ricalcolate solo le righe delle due
+squadre per quella stagione.
+"""
+from datetime import datetime
+from django.db import transaction
+from django.db.models import Q, Sum
+from predictors.models import Match, TeamSeasonAggregate
+
+SIDE_FIELDS = ('played', 'won', 'drawn', 'lost', 'gf', 'ga', 'xg_for', 'xg_against')
+AGGREGATE_FIELDS = tuple(f"{side}_{field}" for side in ('home', 'away') for field in SIDE_FIELDS)
+
+# Colonne lette per ogni partita terminata con risultato
+RESULT_COLUMNS = (
+    'season_id', 'home_team_id', 'away_team_id',
+    'result__home_goals', 'result__away_goals', 'result__winner',
+    'result__home_stats', 'result__away_stats',
+)
+
+
+def _xg(stats):
+    return float((stats or {}).get('xg') or 0.0)
+
+
+def compute_aggregates(results, team_ids=None):
+    """
+    Totali casa/trasferta per (team_id, season_id) (funzione pura).
+    results: tuple nell'ordine di RESULT_COLUMNS. team_ids: se indicato, solo quelle squadre.
+    """
+    totals = {}
+    for season_id, home_id, away_id, home_goals, away_goals, winner, home_stats, away_stats in results:
+        home_xg, away_xg = _xg(home_stats), _xg(away_stats)
+        for side, team_id, gf, ga, xg_for, xg_against, outcome in (
+            ('home', home_id, home_goals, away_goals, home_xg, away_xg, {'1': 'won', 'X': 'drawn', '2': 'lost'}[winner]),
+            ('away', away_id, away_goals, home_goals, away_xg, home_xg, {'1': 'lost', 'X': 'drawn', '2': 'won'}[winner]),
+        ):
+            if team_ids is not None and team_id not in team_ids:
+                continue
+            t = totals.setdefault((team_id, season_id), dict.fromkeys(AGGREGATE_FIELDS, 0))
+            t[f'{side}_played'] += 1
+            t[f'{side}_{outcome}'] += 1
+            t[f'{side}_gf'] += gf
+            t[f'{side}_ga'] += ga
+            t[f'{side}_xg_for'] += xg_for
+            t[f'{side}_xg_against'] += xg_against
+    return totals
+
+
+class TeamSeasonStats:
+    """ Aggiornamento delle TeamSeasonAggregate. """
+
+    BATCH_SIZE = 500
+
+    @classmethod
+    def on_result_saved(cls, match):
+        """ Ricalcola le righe delle due squadre della partita per la sua stagione. """
+        cls.update(match.season_id, [match.home_team_id, match.away_team_id])
+
+    @classmethod
+    def update(cls, season_id, team_ids):
+        """ Una query sulle partite delle squadre nella stagione, poi riscrive le loro righe. """
+        team_ids = set(team_ids)
+        results = Match.objects.filter(
+            Q(home_team_id__in=team_ids) | Q(away_team_id__in=team_ids),
+            season_id=season_id, status='FINISHED', result__isnull=False,
+        ).values_list(*RESULT_COLUMNS)
+        totals = compute_aggregates(results, team_ids)
+
+        with transaction.atomic():
+            TeamSeasonAggregate.objects.filter(season_id=season_id, team_id__in=team_ids).delete()
+            TeamSeasonAggregate.objects.bulk_create([
+                TeamSeasonAggregate(team_id=team_id, season_id=season_id, **fields)
+                for (team_id, _), fields in totals.items()
+            ])
+
+    @classmethod
+    def rebuild_all(cls):
+        """ Ricostruisce tutte le righe (import esterni, ricalcolo feature). Restituisce il numero di righe. """
+        results = Match.objects.filter(status='FINISHED', result__isnull=False).values_list(*RESULT_COLUMNS)
+        totals = compute_aggregates(results.iterator())
+        with transaction.atomic():
+            TeamSeasonAggregate.objects.all().delete()
+            TeamSeasonAggregate.objects.bulk_create([
+                TeamSeasonAggregate(team_id=team_id, season_id=season_id, **fields)
+                for (team_id, season_id), fields in totals.items()
+            ], batch_size=cls.BATCH_SIZE)
+        return len(totals)
+
+
+def team_totals(team_id):
+    """
+    Totali di carriera della squadra (somma delle sue righe per stagione, una query):
+    complessivi + 'home'/'away' con medie a partita.
+    """
+    sums = TeamSeasonAggregate.objects.filter(team_id=team_id).aggregate(
+        **{field: Sum(field) for field in AGGREGATE_FIELDS}
+    )
+    sums = {field: value or 0 for field, value in sums.items()}
+
+    def side_stats(prefixes):
+        stats = {field: sum(sums[f"{p}_{field}"] for p in prefixes) for field in SIDE_FIELDS}
+        played = stats['played']
+        stats['gd'] = stats['gf'] - stats['ga']
+        for field in ('gf', 'ga', 'xg_for', 'xg_against'):
+            stats[f'avg_{field}'] = round(stats[field] / played, 2) if played else 0
+        stats['xg_for'] = round(stats['xg_for'], 2)
+        stats['xg_against'] = round(stats['xg_against'], 2)
+        return stats
+
+    stats = side_stats(('home', 'away'))
+    # Nomi usati dal template della pagina squadra
+    stats.update(wins=stats['won'], draws=stats['drawn'], losses=stats['lost'])
+    stats['home'] = side_stats(('home',))
+    stats['away'] = side_stats(('away',))
+    return stats
+
+
+def _cursor(match):
+    return f"{match.date_time.isoformat()}_{match.id}"
+
+
+def _parse_cursor(value):
+    """ (datetime, id) dal cursore 'isoformat_id'; None se non valido. """
+    try:
+        stamp, match_id = value.rsplit('_', 1)
+        when = datetime.fromisoformat(stamp)
+        return when, int(match_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def calendar_page(team_id, before=None, after=None, page_size=20):
+    """
+    Una pagina delle partite giocate dalla squadra, dalla più recente (paginazione keyset su (data, id)).
+    before: cursore dell'ultima partita della pagina precedente (pagine più vecchie);
+    after: cursore della prima partita della pagina successiva (pagine più recenti).
+    Due query indicizzate (casa/trasferta) limitate a page_size + 1 righe: il costo non
+    dipende dalla lunghezza dello storico.
+    Restituisce {'matches', 'older', 'newer'} con i cursori per le pagine adiacenti (None se assenti).
+    """
+    position = _parse_cursor(after) if after else _parse_cursor(before) if before else None
+    forward = bool(after) and position is not None  # verso le più recenti
+
+    def side(field):
+        qs = Match.objects.filter(**{field: team_id}, status='FINISHED')
+        if position is not None:
+            when, match_id = position
+            if forward:
+                qs = qs.filter(Q(date_time__gt=when) | Q(date_time=when, id__gt=match_id))
+            else:
+                qs = qs.filter(Q(date_time__lt=when) | Q(date_time=when, id__lt=match_id))
+        order = ('date_time', 'id') if forward else ('-date_time', '-id')
+        return list(
+            qs.select_related('result', 'home_team', 'away_team').order_by(*order)[:page_size + 1]
+        )
+
+    rows = sorted(side('home_team_id') + side('away_team_id'), key=lambda m: (m.date_time, m.id), reverse=not forward)
+    has_more = len(rows) > page_size
+    if forward and not has_more:
+        # Raggiunte le più recenti: prima pagina piena invece di una pagina corta
+        return calendar_page(team_id, page_size=page_size)
+    rows = rows[:page_size]
+    if forward:
+        rows.reverse()
+
+    if not rows:
+        return {'matches': [], 'older': None, 'newer': None}
+    return {
+        'matches': rows,
+        'older': _cursor(rows[-1]) if (has_more or forward) else None,
+        'newer': _cursor(rows[0]) if position is not None else None,
+    }
@@ -1,3 +1,1332 @@
-from django.test import TestCase
+import datetime
+import io
+import math
+import random
+import time
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from predictors.models import (
+    League, Match, MatchResult, Player, PlayerMatchStat, Rivalry, Season, Team, TeamEloHistory, TeamFormSnapshot,
+)
 
-# Create your tests here.
+
+def build_league(seed=1, n_teams=6, seasons=(2023, 2024), scheduled_rounds=2):
+    """
+    Campionato sintetico: andata e ritorno per ogni stagione, risultati con statistiche
+    e presenze dei giocatori. Le ultime scheduled_rounds giornate dell'ultima stagione
+    restano da giocare. Restituisce (lega, stagioni, squadre).
+    """
+    rng = random.Random(seed)
+    league = League.objects.create(name='Serie A', country='IT')
+    teams = [Team.objects.create(name=f'Team {i}') for i in range(n_teams)]
+    Rivalry.objects.create(team1=teams[0], team2=teams[1], intensity=9)
+    rosters = {
+        team.id: [
+            Player.objects.create(name=f'{team.name} p{k}', understat_id=f'{team.id}-{k}', current_team=team,
+                                  primary_position=('GK', 'DEF', 'MID', 'FWD')[min(k, 3)])
+            for k in range(12)
+        ]
+        for team in teams
+    }
+
+    start = timezone.make_aware(datetime.datetime(2023, 8, 20, 18, 0))
+    created = []
+    for index, year in enumerate(seasons):
+        season = Season.objects.create(league=league, year_start=year, year_end=year + 1, is_current=index == len(seasons) - 1)
+        created.append(season)
+        ids = list(range(n_teams))
+        schedule = []
+        for leg in range(2):
+            for _ in range(n_teams - 1):
+                pairs = [(ids[i], ids[n_teams - 1 - i]) for i in range(n_teams // 2)]
+                schedule.append([(b, a) for a, b in pairs] if leg else pairs)
+                ids = [ids[0], ids[-1]] + ids[1:-1]
+
+        base = start + datetime.timedelta(days=365 * index)
+        for round_number, pairs in enumerate(schedule, 1):
+            for slot, (home, away) in enumerate(pairs):
+                to_play = index == len(seasons) - 1 and round_number > len(schedule) - scheduled_rounds
+                match = Match.objects.create(
+                    season=season, home_team=teams[home], away_team=teams[away], round_number=round_number,
+                    date_time=base + datetime.timedelta(days=7 * round_number, hours=slot),
+                    status='SCHEDULED' if to_play else 'FINISHED',
+                )
+                if to_play:
+                    continue
+                home_goals, away_goals = rng.randint(0, 4), rng.randint(0, 3)
+                MatchResult.objects.create(
+                    match=match, home_goals=home_goals, away_goals=away_goals,
+                    winner='1' if home_goals > away_goals else ('2' if away_goals > home_goals else 'X'),
+                    home_stats=_random_stats(rng), away_stats=_random_stats(rng),
+                )
+                for team in (teams[home], teams[away]):
+                    for n, player in enumerate(rosters[team.id]):
+                        PlayerMatchStat.objects.create(
+                            player=player, match=match, team=team, is_starter=n < 11,
+                            minutes=90 if n < 11 else 15, xg=round(rng.uniform(0, 0.6), 3),
+                        )
+    return league, created, teams
+
+
+def _random_stats(rng):
+    return {
+        'xg': round(rng.uniform(0.2, 3), 2), 'possession': rng.randint(30, 70), 'corner': rng.randint(0, 10),
+        'falli': rng.randint(5, 20), 'tiri_totali': rng.randint(3, 20), 'tiri_porta': rng.randint(1, 9),
+        'gialli': rng.randint(0, 5),
+    }
+
+
+def calculate_all():
+    """ Feature, ELO e stati derivati come li lascia la pipeline notturna. """
+    from django.core.management import call_command
+    call_command('calculate_features', stdout=_null())
+    call_command('calculate_elo', stdout=_null())
+
+
+def _null():
+    return io.StringIO()
+
+
+def legacy_calculate_features():
+    """ Il calcolo partita per partita del vecchio calculate_features (riferimento del motore batch). """
+    from predictors.features import SNAPSHOT_FIELD_MAP, get_team_features_at_date
+    matches = Match.objects.filter(status='FINISHED', result__isnull=False).select_related(
+        'season', 'home_team', 'away_team'
+    ).order_by('date_time')
+    for match in matches:
+        for team in (match.home_team, match.away_team):
+            feats = get_team_features_at_date(
+                team=team, date_limit=match.date_time, season=match.season,
+                current_match_home_team=match.home_team, current_match_away_team=match.away_team,
+                use_actual_starters=True, current_match=match,
+            )
+            TeamFormSnapshot.objects.update_or_create(
+                match=match, team=team, defaults={field: feats[key] for key, field in SNAPSHOT_FIELD_MAP.items()},
+            )
+
+
+async def gather_in_request_thread(*groups):
+    """
+    predictors.async_queries.gather in serie nel thread della richiesta: i thread del pool
+    hanno connessioni proprie e non vedono i dati non committati di un TestCase.
+    """
+    from asgiref.sync import sync_to_async
+    return await sync_to_async(lambda: [group() for group in groups])()
+
+
+def snapshot_values():
+    from predictors.features import SNAPSHOT_FIELD_MAP
+    fields = list(SNAPSHOT_FIELD_MAP.values())
+    return {(row[0], row[1]): row[2:] for row in TeamFormSnapshot.objects.values_list('match_id', 'team_id', *fields)}
+
+
+class BatchFeatureEngineTests(TestCase):
+    """ Il motore batch deve produrre gli stessi snapshot del calcolo partita per partita. """
+
+    @classmethod
+    def setUpTestData(cls):
+        build_league()
+
+    def assertSameSnapshots(self, expected, actual):
+        self.assertEqual(expected.keys(), actual.keys())
+        for key, row in expected.items():
+            for a, b in zip(row, actual[key]):
+                if isinstance(a, float) or isinstance(b, float):
+                    self.assertTrue(math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9), (key, row, actual[key]))
+                else:
+                    self.assertEqual(a, b, key)
+
+    def test_batch_matches_legacy_per_match_loop(self):
+        from predictors.elo_index import EloTimeline
+        from predictors.feature_engine import BatchFeatureEngine
+
+        legacy_calculate_features()
+        expected = snapshot_values()
+        self.assertEqual(len(expected), 2 * Match.objects.filter(status='FINISHED').count())
+
+        TeamFormSnapshot.objects.all().delete()
+        EloTimeline.invalidate()
+        BatchFeatureEngine(force=True).run()
+        self.assertSameSnapshots(expected, snapshot_values())
+
+    def test_probable_starters_fallback_is_preloaded(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from predictors.elo_index import EloTimeline
+        from predictors.feature_engine import BatchFeatureEngine
+
+        # Partite senza titolari registrati e qualche giocatore indisponibile: serve la formazione probabile
+        finished = list(Match.objects.filter(status='FINISHED').order_by('date_time').values_list('id', flat=True))
+        PlayerMatchStat.objects.filter(match_id__in=finished[10::3]).update(is_starter=False)
+        players = list(Player.objects.order_by('pk').values_list('pk', flat=True))
+        Player.objects.filter(pk__in=players[::5]).update(status='INJURED')
+
+        legacy_calculate_features()
+        expected = snapshot_values()
+        TeamFormSnapshot.objects.all().delete()
+        EloTimeline.invalidate()
+        with CaptureQueriesContext(connection) as queries:
+            BatchFeatureEngine(force=True).run()
+        self.assertSameSnapshots(expected, snapshot_values())
+        player_queries = [q for q in queries.captured_queries if 'FROM "predictors_player"' in q['sql']]
+        self.assertEqual(len(player_queries), 1)
+
+    def test_sharded_run_matches_sequential(self):
+        from predictors.feature_engine import BatchFeatureEngine, FeatureShards, compute_shard
+
+        BatchFeatureEngine(force=True).run()
+        expected = snapshot_values()
+        TeamFormSnapshot.objects.all().delete()
+        # Gli shard girano nel processo del test (i processi del pool non vedono il database di test)
+        def run_inline(shards, jobs, collect):
+            for job in jobs:
+                collect(compute_shard(job))
+        with mock.patch.object(FeatureShards, '_run_pool', run_inline), mock.patch('os.cpu_count', return_value=4):
+            summary = BatchFeatureEngine(force=True).run(workers=2, shard_size=10)
+        self.assertGreater(summary['shards'], 1)
+        self.assertSameSnapshots(expected, snapshot_values())
+
+    def test_cluster_coordinator_computes_unclaimed_shards(self):
+        from django.conf import settings
+        from predictors.feature_engine import BatchFeatureEngine
+
+        BatchFeatureEngine(force=True).run()
+        expected = snapshot_values()
+        TeamFormSnapshot.objects.all().delete()
+        # Tutti i worker occupati: nessun task shard viene mai eseguito
+        cluster = dict(settings.Q_CLUSTER, workers=3, timeout=0)
+        with self.settings(Q_CLUSTER=cluster), \
+                mock.patch('multiprocessing.current_process', return_value=mock.Mock(daemon=True)), \
+                mock.patch('django_q.tasks.async_task') as async_task, \
+                mock.patch('django_q.tasks.fetch_group', return_value=[]), \
+                mock.patch('django_q.tasks.delete_group'):
+            summary = BatchFeatureEngine(force=True).run(workers=2, shard_size=10)
+        self.assertEqual(async_task.call_count, summary['shards'])
+        self.assertGreater(summary['shards'], 1)
+        self.assertSameSnapshots(expected, snapshot_values())
+
+    def test_forced_rerun_is_idempotent(self):
+        from django.core.management import call_command
+        calculate_all()
+        expected = snapshot_values()
+        call_command('calculate_features', force=True, stdout=_null())
+        call_command('calculate_elo', stdout=_null())
+        self.assertSameSnapshots(expected, snapshot_values())
+
+
+class EloEngineTests(TestCase):
+    """ Storico ELO incrementale e riallineamento degli snapshot. """
+
+    @classmethod
+    def setUpTestData(cls):
+        build_league()
+        calculate_all()
+
+    def assertSnapshotsSynced(self):
+        elo_before = {(m, t): elo for m, t, elo in TeamEloHistory.objects.values_list('match_id', 'team_id', 'elo_before')}
+        for match_id, team_id, elo in TeamFormSnapshot.objects.filter(match__status='FINISHED').values_list('match_id', 'team_id', 'elo_rating'):
+            self.assertEqual(elo, elo_before[(match_id, team_id)])
+
+    def test_corrected_result_replays_from_its_date(self):
+        from predictors.elo_engine import EloEngine
+        self.assertSnapshotsSynced()
+
+        result = MatchResult.objects.select_related('match').order_by('match__date_time')[10]
+        result.home_goals, result.away_goals, result.winner = 0, 5, '2'
+        result.save()
+
+        summary = EloEngine().run()
+        self.assertEqual(summary['replay_from'], result.match.date_time)
+        self.assertSnapshotsSynced()
+
+        # Lo stesso risultato di un ricalcolo completo da 1500
+        incremental = list(TeamEloHistory.objects.order_by('match_id', 'team_id').values_list('elo_after', flat=True))
+        EloEngine(full=True).run()
+        full = list(TeamEloHistory.objects.order_by('match_id', 'team_id').values_list('elo_after', flat=True))
+        self.assertEqual(len(incremental), len(full))
+        for a, b in zip(incremental, full):
+            self.assertAlmostEqual(a, b, places=9)
+
+
+class RollingStateTests(TestCase):
+    """ Stato rolling aggiornato dai segnali: le feature delle previsioni coincidono con lo storico. """
+
+    @classmethod
+    def setUpTestData(cls):
+        from predictors.rolling_state import rebuild_rolling_states
+        cls.league, cls.seasons, cls.teams = build_league()
+        rebuild_rolling_states()
+
+    def assertRollingMatchesHistory(self):
+        from predictors import features
+        from predictors.rolling_state import get_rolling_matches
+        upcoming = Match.objects.filter(status='SCHEDULED').select_related(
+            'season', 'home_team', 'away_team',
+        ).order_by('date_time').last()
+        for team in self.teams:
+            kwargs = dict(
+                team=team, date_limit=upcoming.date_time, season=upcoming.season,
+                current_match_home_team=upcoming.home_team, current_match_away_team=upcoming.away_team,
+            )
+            self.assertIsNotNone(get_rolling_matches(team, upcoming.season, upcoming.date_time))
+            rolling = features.get_team_features_at_date(**kwargs)
+            with mock.patch.object(features, 'get_rolling_matches', return_value=None):
+                history = features.get_team_features_at_date(**kwargs)
+            self.assertEqual(rolling, history, team)
+
+    def latest_result(self):
+        return MatchResult.objects.filter(match__season=self.seasons[-1]).select_related('match').order_by('-match__date_time').first()
+
+    def test_created_result(self):
+        match = Match.objects.filter(status='SCHEDULED').order_by('date_time').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            MatchResult.objects.create(match=match, home_goals=3, away_goals=1, winner='1',
+                                       home_stats={'xg': 2.4}, away_stats={'xg': 0.7})
+            match.status = 'FINISHED'
+            match.save()
+        self.assertRollingMatchesHistory()
+
+    def test_edited_result(self):
+        result = self.latest_result()
+        result.home_goals, result.away_goals, result.winner = 0, 4, '2'
+        result.home_stats = dict(result.home_stats, xg=0.1)
+        with self.captureOnCommitCallbacks(execute=True):
+            result.save()  # come l'admin: nessuna chiamata esplicita
+        self.assertRollingMatchesHistory()
+
+    def test_deleted_result(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.latest_result().delete()
+        self.assertRollingMatchesHistory()
+
+    def test_deleted_match(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.latest_result().match.delete()
+        self.assertRollingMatchesHistory()
+
+
+class TrainingSetCacheTests(TestCase):
+    """ Checksum per partita e riuso della cache colonnare. """
+
+    @classmethod
+    def setUpTestData(cls):
+        build_league()
+        calculate_all()
+
+    def setUp(self):
+        import tempfile
+        from predictors.training_set import TrainingSetCache
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(__import__('shutil').rmtree, self.root, True)
+        self.cache = TrainingSetCache(root=self.root)
+
+    def test_in_place_stat_correction_changes_checksum(self):
+        result = MatchResult.objects.select_related('match').order_by('match__date_time').first()
+        before = self.cache.fetch_checksums()[result.match_id]
+
+        # Stesso numero di cifre: la lunghezza del JSON non cambia
+        result.home_stats['corner'] = 7 if result.home_stats['corner'] != 7 else 5
+        result.save()
+
+        after = self.cache.fetch_checksums()[result.match_id]
+        self.assertEqual(before[:2], after[:2])
+        self.assertNotEqual(before[2], after[2])
+
+    def test_reload_extracts_only_changed_rows(self):
+        from predictors.constants import TARGET_COLUMNS
+        first = self.cache.load()
+        self.assertEqual(self.cache.stats['extracted'], len(first))
+
+        result = MatchResult.objects.select_related('match').order_by('match__date_time').first()
+        result.away_stats['tiri_totali'] = 12 if result.away_stats['tiri_totali'] != 12 else 15
+        result.save()
+
+        cache = type(self.cache)(root=self.root)
+        second = cache.load()
+        self.assertEqual(cache.stats['extracted'], 1)
+        self.assertEqual(cache.stats['removed'], 1)
+        row = list(second.match_ids).index(result.match_id)
+        column = TARGET_COLUMNS.index('away_total_shots')
+        self.assertEqual(second.targets[row][column], result.away_stats['tiri_totali'])
+
+        # Dati invariati: cache riusata senza estrazioni
+        cache = type(self.cache)(root=self.root)
+        cache.load()
+        self.assertTrue(cache.stats['cache_hit'])
+
+
+class ResultImpactTests(TestCase):
+    """ ResultImpact.propagate dopo una correzione porta allo stesso stato del ricalcolo completo. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.league, cls.seasons, cls.teams = build_league()
+        calculate_all()
+
+    @staticmethod
+    def state():
+        from predictors.models import StandingEntry
+        elo = list(TeamEloHistory.objects.order_by('match_id', 'team_id').values_list(
+            'match_id', 'team_id', 'elo_before', 'elo_after'))
+        standings = list(StandingEntry.objects.order_by('season', 'round_number', 'position').values_list(
+            'season_id', 'round_number', 'team_id', 'position', 'points', 'gf', 'ga', 'points_gap_top'))
+        return snapshot_values(), elo, standings
+
+    def assertSameValues(self, first, second, msg=None):
+        self.assertEqual(len(first), len(second), msg)
+        for a, b in zip(first, second):
+            if isinstance(a, float) or isinstance(b, float):
+                self.assertAlmostEqual(a, b, places=6, msg=msg)
+            else:
+                self.assertEqual(a, b, msg)
+
+    def assertSameState(self, first, second):
+        snapshots, elo, standings = first
+        expected_snapshots, expected_elo, expected_standings = second
+        self.assertEqual(snapshots.keys(), expected_snapshots.keys())
+        for key, values in snapshots.items():
+            self.assertSameValues(values, expected_snapshots[key], key)
+        self.assertEqual(len(elo), len(expected_elo))
+        for row, expected in zip(elo, expected_elo):
+            self.assertSameValues(row, expected, row[:2])
+        self.assertEqual(standings, expected_standings)
+
+    def test_propagate_matches_full_recompute(self):
+        from django.core.management import call_command
+        from predictors.features import SNAPSHOT_FIELD_MAP
+        from predictors.impact import ResultImpact
+
+        season = self.seasons[-1]
+        match = Match.objects.filter(season=season, round_number=4).select_related('result').first()
+        before = snapshot_values()
+
+        # Risultato corretto a metà stagione (come edit_match_stats: salvataggio, poi il task)
+        result = match.result
+        result.home_goals, result.away_goals = result.away_goals + 3, result.home_goals
+        result.winner = '1'
+        result.home_stats = dict(result.home_stats, xg=result.home_stats['xg'] + 1.5)
+        with self.captureOnCommitCallbacks(execute=True):
+            result.save()
+
+        affected = []
+        original = ResultImpact.affected_snapshots
+
+        def spy(impact):
+            affected.append(original(impact))
+            return affected[-1]
+
+        with mock.patch.object(ResultImpact, 'affected_snapshots', autospec=True, side_effect=spy):
+            with self.captureOnCommitCallbacks(execute=True):
+                ResultImpact.propagate([match])
+        propagated = self.state()
+        self.assertNotEqual(propagated[0], before)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('calculate_features', force=True, stdout=_null())
+            call_command('calculate_elo', full=True, stdout=_null())
+        self.assertSameState(propagated, self.state())
+
+        # Fuori da affected_snapshots cambia al più elo_rating (riscritto da EloEngine)
+        affected = affected[0]
+        self.assertTrue(affected)
+        fields = list(SNAPSHOT_FIELD_MAP.values())
+        kept = [i for i, field in enumerate(fields) if field != 'elo_rating']
+        outside = [key for key in before if key not in affected]
+        self.assertTrue(outside)
+        for key in outside:
+            self.assertEqual([propagated[0][key][i] for i in kept], [before[key][i] for i in kept], key)
+
+
+class ModelVersionTests(TestCase):
+    """ train_model salta i dati invariati; --force e rollback_model gestiscono le versioni. """
+
+    @classmethod
+    def setUpTestData(cls):
+        build_league()
+        calculate_all()
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from predictors.model_store import ModelStore
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, True)
+        override = self.settings(ML_MODELS_DIR=root)
+        override.enable()
+        self.addCleanup(override.disable)
+        ModelStore.invalidate()
+
+    def train(self, **options):
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('train_model', cpu_budget=1, workers=1, stdout=out, **options)
+        return out.getvalue()
+
+    def active(self):
+        from predictors.model_store import ModelStore
+        return ModelStore.active_registry()
+
+    def test_in_place_stat_correction_triggers_retrain(self):
+        self.train()
+        first = self.active()
+        self.assertIn('invariati', self.train())
+
+        result = MatchResult.objects.order_by('pk').first()
+        result.home_stats['corner'] = 7 if result.home_stats['corner'] != 7 else 5
+        result.save()
+
+        self.assertNotIn('invariati', self.train())
+        self.assertNotEqual(self.active().pk, first.pk)
+
+    def test_force_retrains_unchanged_data(self):
+        self.train()
+        first = self.active()
+        self.assertNotIn('invariati', self.train(force=True))
+        second = self.active()
+        self.assertNotEqual(second.pk, first.pk)
+        self.assertEqual(second.fingerprint, first.fingerprint)
+        first.refresh_from_db()
+        self.assertFalse(first.is_active)
+        self.assertIsNone(first.rolled_back_at)
+
+    def test_rollback_reactivates_previous_version_and_retires_current(self):
+        from django.core.management import call_command
+        self.train()
+        first = self.active()
+        self.train(force=True)
+        second = self.active()
+
+        call_command('rollback_model', stdout=_null())
+        self.assertEqual(self.active().pk, first.pk)
+        second.refresh_from_db()
+        self.assertFalse(second.is_active)
+        self.assertIsNotNone(second.rolled_back_at)
+        # Stessi dati: né la versione attiva né quella ritirata vengono riaddestrate
+        self.assertIn('invariati', self.train())
+        self.assertEqual(self.active().pk, first.pk)
+
+        # Riattivata esplicitamente, la versione ritirata torna valida
+        call_command('rollback_model', second.version, stdout=_null())
+        second.refresh_from_db()
+        self.assertTrue(second.is_active)
+        self.assertIsNone(second.rolled_back_at)
+
+    def test_activate_requires_artifacts(self):
+        import os
+        import shutil
+        from django.core.management import CommandError, call_command
+        from predictors.model_store import ModelStore
+        self.train()
+        first = self.active()
+        self.train(force=True)
+        shutil.rmtree(os.path.join(ModelStore.models_root(), first.artifact_dir))
+
+        with self.assertRaises(FileNotFoundError):
+            ModelStore.activate(first)
+        with self.assertRaises(CommandError):
+            call_command('rollback_model', first.version, stdout=_null())
+        self.assertNotEqual(self.active().pk, first.pk)
+
+
+class ModelStoreTests(TestCase):
+    """ ModelStore.get passa alla nuova versione attiva dopo il ricontrollo e ripiega sul pickle legacy. """
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        from predictors.model_store import ModelStore
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        override = self.settings(ML_MODELS_DIR=self.root, BASE_DIR=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        # Stato di classe isolato: get() parte senza modelli caricati
+        for attr, value in (('_models', None), ('_version', None), ('_last_check', 0.0)):
+            patcher = mock.patch.object(ModelStore, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.clock = 1000.0
+        patcher = mock.patch('predictors.model_store.time.monotonic', side_effect=lambda: self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def fitted(value):
+        """ Regressore minimo che predice sempre value. """
+        import numpy as np
+        from xgboost import XGBRegressor
+        model = XGBRegressor(n_estimators=1, max_depth=1, base_score=value, learning_rate=0)
+        model.fit(np.zeros((4, 1)), np.full(4, value))
+        return model
+
+    @staticmethod
+    def predicted(models_dict):
+        import numpy as np
+        return round(float(models_dict['home_goals'].predict(np.zeros((1, 1)))[0]), 3)
+
+    def test_new_active_version_is_picked_up_after_check_interval(self):
+        from predictors.model_store import ModelStore
+        first = ModelStore.publish({'home_goals': self.fitted(1.0)})
+        self.assertEqual(self.predicted(ModelStore.get()), 1.0)
+        self.assertEqual(ModelStore.version(), first.version)
+
+        second = ModelStore.publish({'home_goals': self.fitted(2.0)})
+        # publish invalida solo il processo che addestra: gli altri vedono la nuova versione al ricontrollo
+        ModelStore._last_check = self.clock
+        self.clock += ModelStore.CHECK_INTERVAL - 1
+        self.assertEqual(self.predicted(ModelStore.get()), 1.0)
+        self.assertEqual(ModelStore.version(), first.version)
+
+        self.clock += 2
+        self.assertEqual(self.predicted(ModelStore.get()), 2.0)
+        self.assertEqual(ModelStore.version(), second.version)
+
+    def test_failed_load_keeps_current_version(self):
+        import os
+        import shutil
+        from predictors.model_store import ModelStore
+        first = ModelStore.publish({'home_goals': self.fitted(1.0)})
+        ModelStore.get()
+        second = ModelStore.publish({'home_goals': self.fitted(2.0)})
+        shutil.rmtree(os.path.join(self.root, second.artifact_dir))
+
+        self.clock += ModelStore.CHECK_INTERVAL + 1
+        with self.assertLogs('predictors.model_store', 'ERROR'):
+            self.assertEqual(self.predicted(ModelStore.get()), 1.0)
+        self.assertEqual(ModelStore.version(), first.version)
+
+    def test_legacy_pickle_without_active_version(self):
+        import joblib
+        import os
+        from predictors.model_store import ModelStore
+        with self.assertLogs('predictors.model_store', 'WARNING'):
+            self.assertIsNone(ModelStore.get())
+
+        joblib.dump({'home_goals': self.fitted(3.0)}, os.path.join(self.root, ModelStore.LEGACY_PATH_NAME))
+        self.clock += ModelStore.CHECK_INTERVAL + 1
+        models_dict = ModelStore.get()
+        self.assertEqual(self.predicted(models_dict), 3.0)
+        self.assertIsNone(ModelStore.version())
+
+        # Una versione pubblicata prende il posto del pickle al controllo successivo
+        registry = ModelStore.publish({'home_goals': self.fitted(1.0)})
+        self.assertEqual(self.predicted(ModelStore.get()), 1.0)
+        self.assertEqual(ModelStore.version(), registry.version)
+
+
+class StubModel:
+    """ Modello deterministico al posto di XGBoost: combinazione lineare di alcune feature. """
+
+    def __init__(self, *columns, fail_on=None):
+        self.columns = columns
+        self.fail_on = fail_on  # home_elo della riga che fa fallire predict
+
+    def predict(self, X):
+        if self.fail_on is not None and (X['home_elo'] == self.fail_on).any():
+            raise ValueError('feature non valide')
+        return [sum(float(row[column]) for column in self.columns) / 400 for _, row in X.iterrows()]
+
+
+class PredictUpcomingTests(TestCase):
+    """ La predizione a giornata intera coincide con quella partita per partita e aggiorna le righe esistenti. """
+
+    @classmethod
+    def setUpTestData(cls):
+        from predictors.current_state import CurrentState
+        build_league()
+        calculate_all()
+        CurrentState.update()
+
+    def setUp(self):
+        from predictors.model_store import ModelStore
+        self.models = {
+            'home_goals': StubModel('home_elo', 'home_avg_gf'),
+            'away_goals': StubModel('away_elo'),
+            'home_corners': StubModel('home_elo', 'away_elo', 'home_last_5_pts'),
+        }
+        patcher = mock.patch.object(ModelStore, 'get', side_effect=lambda: self.models)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def predict(self, *match_ids):
+        from django.core.management import call_command
+        options = {'match_ids': list(match_ids)} if match_ids else {}
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('predict_upcoming', stdout=_null(), **options)
+
+    def round_matches(self):
+        from predictors.current_state import current_round
+        return list(Match.objects.filter(status='SCHEDULED', round_number=current_round()[1]).order_by('id'))
+
+    def per_match_predictions(self, matches):
+        """ Il vecchio percorso: una riga di feature e una chiamata predict per partita e target. """
+        import pandas as pd
+        from predictors.management.commands.predict_upcoming import Command
+        expected = {}
+        for match in matches:
+            row = Command().get_pre_match_features(match)
+            row.pop('home_form_sequence')
+            row.pop('away_form_sequence')
+            X_input = pd.DataFrame([row])
+            expected[match.id] = {
+                target: int(round(max(0, model.predict(X_input)[0]))) for target, model in self.models.items()
+            }
+        return expected
+
+    def saved_predictions(self):
+        from predictors.models import Prediction
+        return {
+            pred['match_id']: {target: pred[target] for target in self.models}
+            for pred in Prediction.objects.values('match_id', *self.models)
+        }
+
+    def test_round_matches_per_match_path(self):
+        matches = self.round_matches()
+        self.predict()
+        self.assertEqual(self.saved_predictions(), self.per_match_predictions(matches))
+
+    def test_rerun_updates_existing_rows(self):
+        from predictors.models import Prediction
+        self.predict()
+        ids = sorted(Prediction.objects.values_list('id', flat=True))
+        snapshots = TeamFormSnapshot.objects.count()
+
+        self.models['home_goals'] = StubModel('home_elo', 'away_elo')
+        with mock.patch.object(Prediction.objects, 'bulk_update', wraps=Prediction.objects.bulk_update) as bulk_update:
+            self.predict()
+        self.assertEqual(len(bulk_update.call_args.args[0]), len(ids))
+        self.assertEqual(sorted(Prediction.objects.values_list('id', flat=True)), ids)
+        self.assertEqual(self.saved_predictions(), self.per_match_predictions(self.round_matches()))
+        self.assertEqual(TeamFormSnapshot.objects.count(), snapshots)
+
+    def test_snapshots_are_upserted(self):
+        match = self.round_matches()[0]
+        self.predict()
+        snapshots = TeamFormSnapshot.objects.filter(match=match)
+        fresh = dict(snapshots.values_list('team_id', 'elo_rating'))
+        total = TeamFormSnapshot.objects.count()
+        snapshots.update(elo_rating=1, form_sequence='stale')
+
+        self.predict()
+        self.assertEqual(TeamFormSnapshot.objects.count(), total)
+        self.assertEqual(dict(snapshots.values_list('team_id', 'elo_rating')), fresh)
+        self.assertFalse(snapshots.filter(form_sequence='stale').exists())
+
+    def test_match_ids_limits_the_run(self):
+        from predictors.models import Prediction
+        match = Match.objects.filter(status='SCHEDULED').order_by('-round_number', 'id').first()
+        self.predict(match.id)
+        self.assertEqual(list(Prediction.objects.values_list('match_id', flat=True)), [match.id])
+        self.assertEqual(self.saved_predictions(), self.per_match_predictions([match]))
+
+    def test_failing_match_falls_back_only_for_that_match(self):
+        from predictors.management.commands.predict_upcoming import PREDICTION_DEFAULTS, Command
+        matches = self.round_matches()
+        expected = self.per_match_predictions(matches)
+        bad = matches[0]
+        self.models['home_corners'].fail_on = Command().get_pre_match_features(bad)['home_elo']
+
+        with self.assertLogs('predictors.management.commands.predict_upcoming', 'ERROR') as logs:
+            self.predict()
+        self.assertTrue(any('home_corners' in line and f'id {bad.id}' in line for line in logs.output))
+
+        expected[bad.id]['home_corners'] = PREDICTION_DEFAULTS['home_corners']
+        self.assertEqual(self.saved_predictions(), expected)
+
+
+class WarmStartPlanTests(SimpleTestCase):
+    """ plan_warm_start: quando si può ripartire dalla versione precedente. """
+
+    def plan(self, previous, current, max_new_ratio=0.1):
+        from types import SimpleNamespace
+        from predictors.training_scheduler import plan_warm_start
+        training_set = SimpleNamespace(match_ids=list(current), checksums=[(cs, cs, cs) for cs in current.values()])
+        return plan_warm_start(training_set, list(previous), [(cs, cs, cs) for cs in previous.values()], max_new_ratio)
+
+    def test_unchanged_rows(self):
+        rows = {i: float(i) for i in range(20)}
+        self.assertEqual(self.plan(rows, rows), ('unchanged', None))
+
+    def test_small_delta_is_warm(self):
+        previous = {i: float(i) for i in range(20)}
+        mode, new_rows = self.plan(previous, previous | {20: 20.0, 21: 21.0}, max_new_ratio=0.1)
+        self.assertEqual(mode, 'warm')
+        self.assertEqual(new_rows.tolist(), [20, 21])
+
+    def test_over_ratio_is_cold(self):
+        previous = {i: float(i) for i in range(20)}
+        self.assertEqual(self.plan(previous, previous | {i: float(i) for i in range(20, 25)}), ('cold', None))
+
+    def test_changed_row_is_cold(self):
+        previous = {i: float(i) for i in range(20)}
+        self.assertEqual(self.plan(previous, previous | {3: 99.0, 20: 20.0}), ('cold', None))
+
+
+def legacy_goal_markets(home_lambda, away_lambda, max_goals=10):
+    """ Il vecchio ciclo per cella su poisson_probability: ((P1, PX, P2), (P GG, P NG)) normalizzate. """
+    from predictors.utils import poisson_probability
+    p1 = px = p2 = gg = 0.0
+    for i in range(max_goals + 1):
+        for j in range(max_goals + 1):
+            joint = poisson_probability(i, home_lambda) * poisson_probability(j, away_lambda)
+            if i > j:
+                p1 += joint
+            elif i == j:
+                px += joint
+            else:
+                p2 += joint
+            if i > 0 and j > 0:
+                gg += joint
+    total = p1 + px + p2
+    return (p1 / total, px / total, p2 / total), (gg / total, (total - gg) / total)
+
+
+class ScoreMatrixTests(SimpleTestCase):
+    """ Matrice dei risultati vettoriale: stessi mercati del ciclo per cella. """
+
+    LAMBDAS = [(0.0, 0.0), (0.3, 2.9), (1.45, 1.1), (2.2, 0.6), (4.5, 3.8)]
+
+    def test_markets_match_legacy_loop(self):
+        from predictors.score_matrix import ScoreMatrix
+        matrices = ScoreMatrix.batch([h for h, _ in self.LAMBDAS[1:]], [a for _, a in self.LAMBDAS[1:]])
+        for (home, away), batched in zip(self.LAMBDAS[1:], matrices):
+            expected_1x2, expected_gg = legacy_goal_markets(home, away)
+            for matrix in (ScoreMatrix(home, away), batched):
+                for a, b in zip(matrix.prob_1x2() + matrix.prob_gg_ng(), expected_1x2 + expected_gg):
+                    self.assertAlmostEqual(a, b, places=12)
+
+    def test_truncated_matrix_sums_to_one(self):
+        from predictors.score_matrix import build_score_matrices
+        matrices = build_score_matrices([h for h, _ in self.LAMBDAS], [a for _, a in self.LAMBDAS])
+        for total in matrices.sum(axis=(1, 2)):
+            self.assertAlmostEqual(total, 1.0, places=12)
+
+    def test_quarter_line_handicap_splits_stake(self):
+        from predictors.score_matrix import ScoreMatrix
+        matrix = ScoreMatrix(1.6, 1.2)
+        p1, px, p2 = matrix.prob_1x2()
+        # -0.25 = metà su 0 (pareggio rimborsato) e metà su -0.5 (pareggio perso)
+        win, push, loss = matrix.prob_asian_handicap(-0.25)
+        self.assertAlmostEqual(win, p1, places=12)
+        self.assertAlmostEqual(push, px / 2, places=12)
+        self.assertAlmostEqual(loss, p2 + px / 2, places=12)
+        for line in (-0.75, 0.25, 1.75):
+            halves = [matrix.prob_asian_handicap(line - 0.25), matrix.prob_asian_handicap(line + 0.25)]
+            for value, a, b in zip(matrix.prob_asian_handicap(line), *halves):
+                self.assertAlmostEqual(value, (a + b) / 2, places=12)
+            self.assertAlmostEqual(sum(matrix.prob_asian_handicap(line)), 1.0, places=12)
+
+    def test_prime_shares_batched_matrices(self):
+        from predictors import score_matrix
+        from predictors.models import Prediction
+        from predictors.score_matrix import ScoreMatrix
+        predictions = [Prediction(home_goals=h, away_goals=a) for h, a in self.LAMBDAS]
+        with mock.patch.object(score_matrix, 'build_score_matrices', wraps=score_matrix.build_score_matrices) as build:
+            ScoreMatrix.prime(predictions)
+            for prediction in predictions:
+                ScoreMatrix.for_prediction(prediction).prob_1x2()
+        build.assert_called_once()
+
+
+class OpportunityInvalidationTests(TestCase):
+    """ Le opportunità materializzate seguono configurazione e quote delle sole partite interessate. """
+
+    @classmethod
+    def setUpTestData(cls):
+        from predictors.models import Prediction
+        build_league()
+        cls.played = Prediction.objects.create(match=Match.objects.filter(status='FINISHED').first(), home_goals=2, away_goals=1)
+        cls.upcoming = Prediction.objects.create(match=Match.objects.filter(status='SCHEDULED').first(), home_goals=1, away_goals=1)
+
+    def test_config_change_refreshes_only_upcoming(self):
+        from predictors.models import BettingConfiguration, Prediction
+        from predictors.services import OpportunityService
+        OpportunityService.refresh([self.played, self.upcoming])
+        played_at = Prediction.objects.get(pk=self.played.pk).opportunities_updated_at
+        upcoming_at = Prediction.objects.get(pk=self.upcoming.pk).opportunities_updated_at
+
+        config = BettingConfiguration.objects.first() or BettingConfiguration()
+        config.min_confidence_score += 1
+        with self.captureOnCommitCallbacks(execute=True):
+            config.save()
+
+        self.assertEqual(Prediction.objects.get(pk=self.played.pk).opportunities_updated_at, played_at)
+        self.assertGreater(Prediction.objects.get(pk=self.upcoming.pk).opportunities_updated_at, upcoming_at)
+
+    def test_match_invalidation_refreshes_played_match_after_commit(self):
+        from predictors.models import Prediction
+        from predictors.services import OpportunityService
+        OpportunityService.refresh([self.played])
+        played_at = Prediction.objects.get(pk=self.played.pk).opportunities_updated_at
+        with self.captureOnCommitCallbacks(execute=True):
+            OpportunityService.invalidate([self.played.match_id])
+        self.assertGreater(Prediction.objects.get(pk=self.played.pk).opportunities_updated_at, played_at)
+
+    def test_get_map_computes_stale_predictions_without_writing(self):
+        from predictors.models import BettingOpportunity, Prediction
+        from predictors.services import OpportunityService
+        stale = Prediction.objects.select_related('match').get(pk=self.upcoming.pk)
+        self.assertIsNone(stale.opportunities_updated_at)
+
+        with mock.patch.object(OpportunityService, 'refresh') as refresh:
+            opportunities_map = OpportunityService.get_map([stale])
+        refresh.assert_not_called()
+        self.assertFalse(BettingOpportunity.objects.filter(prediction=stale).exists())
+        self.assertIsNone(Prediction.objects.get(pk=stale.pk).opportunities_updated_at)
+        self.assertEqual(opportunities_map, OpportunityService.refresh([stale]))
+
+    def test_saved_prediction_is_refreshed_after_commit(self):
+        from predictors.models import BettingOpportunity, Prediction
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upcoming.home_corners = 9
+            self.upcoming.save()
+        self.assertIsNotNone(Prediction.objects.get(pk=self.upcoming.pk).opportunities_updated_at)
+        self.assertTrue(BettingOpportunity.objects.filter(prediction=self.upcoming).exists())
+
+
+class MatchDetailCacheTests(TestCase):
+    """ Le scritture bulk (senza segnali) scartano il contesto in cache di match_detail. """
+
+    @classmethod
+    def setUpTestData(cls):
+        build_league()
+        calculate_all()
+
+    def test_feature_rebuild_invalidates_cached_context(self):
+        from django.core.cache import cache
+        from predictors.feature_engine import BatchFeatureEngine
+        from predictors.services import MatchDetailAssembler
+
+        # Prima partita giocata: ELO iniziale identico allo storico, sync_snapshots non la tocca
+        match = Match.objects.filter(status='FINISHED').order_by('date_time').first()
+        key = MatchDetailAssembler.CACHE_KEY.format(match.id)
+        MatchDetailAssembler.get_context(match.id)
+        self.assertIsNotNone(cache.get(key))
+
+        # Snapshot alterato senza segnali: il ricalcolo forzato lo riscrive
+        TeamFormSnapshot.objects.filter(match=match).update(avg_xg_last_5=9.0)
+        with self.captureOnCommitCallbacks(execute=True):
+            BatchFeatureEngine(force=True, match_ids=[match.id], replay_history=True).run()
+        self.assertIsNone(cache.get(key))
+
+
+class AccuracyRollupTests(TestCase):
+    """ Rollup per (stagione, giornata) aggiornati una volta per risultato. """
+
+    @classmethod
+    def setUpTestData(cls):
+        build_league(n_teams=4, scheduled_rounds=0)
+
+    def predict_round(self, round_number):
+        from predictors.models import Prediction
+        with self.captureOnCommitCallbacks(execute=True):
+            for match in Match.objects.filter(round_number=round_number):
+                Prediction.objects.create(match=match, home_goals=1, away_goals=1, home_corners=5, away_corners=4)
+
+    def test_same_round_of_two_seasons_kept_apart(self):
+        from predictors.models import RoundAccuracy
+        from predictors.services import AccuracyRollupService
+
+        self.predict_round(1)
+        rollups = RoundAccuracy.objects.filter(round_number=1)
+        self.assertEqual(sorted(r.season.year_start for r in rollups), [2023, 2024])
+        self.assertEqual([r.matches_count for r in rollups], [2, 2])
+
+        latest = AccuracyRollupService.latest_season_id()
+        self.assertEqual(Season.objects.get(id=latest).year_start, 2024)
+        detail = AccuracyRollupService.round_detail(latest, 1)
+        self.assertEqual({row['match'].season_id for row in detail}, {latest})
+
+    def test_result_ingest_refreshes_accuracy_once(self):
+        from predictors.services import AccuracyRollupService
+
+        self.predict_round(1)
+        match = Match.objects.filter(round_number=1).select_related('result').first()
+        match.result.home_goals += 1
+        with mock.patch.object(AccuracyRollupService, 'refresh_matches') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                match.result.save()
+                match.save()  # come gli scraper: FINISHED dopo il risultato
+        refresh.assert_called_once_with([match.id])
+
+
+class StandingsLedgerTests(TestCase):
+    """ Classifica per giornata: totali progressivi, un ricalcolo per risultato, import raggruppati. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.league, cls.seasons, cls.teams = build_league(n_teams=4)
+
+    def ledger_rows(self):
+        from predictors.models import StandingEntry
+        return list(StandingEntry.objects.order_by('season', 'round_number', 'position').values_list(
+            'season_id', 'round_number', 'team_id', 'position', 'played', 'points', 'gf', 'ga', 'points_gap_top'))
+
+    def test_table_totals_match_results(self):
+        from predictors.standings import StandingsLedger
+
+        season = self.seasons[0]
+        StandingsLedger(season.id).update()
+        table = StandingsLedger(season.id).table(3)
+        points = {team.id: 0 for team in self.teams}
+        for match in Match.objects.filter(season=season, round_number__lte=3).select_related('result'):
+            winner = match.result.winner
+            points[match.home_team_id] += {'1': 3, 'X': 1, '2': 0}[winner]
+            points[match.away_team_id] += {'1': 0, 'X': 1, '2': 3}[winner]
+
+        self.assertEqual({row.team_id: row.points for row in table}, points)
+        self.assertTrue(all(row.played == 3 and row.round_number == 3 for row in table))
+        self.assertEqual([row.position for row in table], [1, 2, 3, 4])
+        self.assertEqual(sorted(row.points for row in table)[::-1], [row.points for row in table])
+
+    def test_result_ingest_updates_ledger_once(self):
+        from predictors.standings import StandingsLedger
+
+        match = Match.objects.filter(season=self.seasons[0], round_number=2).select_related('result').first()
+        match.result.home_goals, match.result.away_goals, match.result.winner = 5, 0, '1'
+        with mock.patch.object(StandingsLedger, 'update', autospec=True) as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                match.result.save()
+                match.save()  # come gli scraper: FINISHED dopo il risultato
+        update.assert_called_once()
+        self.assertEqual(update.call_args.kwargs, {'from_round': 2})
+
+    def test_deferred_import_recomputes_each_season_once(self):
+        from predictors.standings import StandingsLedger
+
+        StandingsLedger.rebuild_all()
+        expected = self.ledger_rows()
+        results = list(MatchResult.objects.select_related('match'))
+        MatchResult.objects.all().delete()
+
+        with mock.patch.object(StandingsLedger, 'update', autospec=True, side_effect=StandingsLedger.update) as update:
+            with StandingsLedger.deferred(), self.captureOnCommitCallbacks(execute=True):
+                for result in results:
+                    result.pk = None
+                    result.save()
+        self.assertEqual(sorted(call.args[0].season_id for call in update.call_args_list), sorted(s.id for s in self.seasons))
+        self.assertEqual(self.ledger_rows(), expected)
+
+    def test_postponed_match_counts_from_play_date(self):
+        from predictors.features import get_team_features_at_date
+        from predictors.models import StandingEntry
+
+        season = self.seasons[0]
+        postponed = Match.objects.filter(season=season, round_number=2).select_related('result').first()
+        postponed.result.home_goals, postponed.result.away_goals, postponed.result.winner = 6, 0, '1'
+        with self.captureOnCommitCallbacks(execute=True):
+            postponed.result.save()
+            # Recuperata dopo la quinta giornata: nel ledger resta nella giornata 2
+            postponed.date_time = Match.objects.filter(season=season, round_number=5).latest('date_time').date_time + datetime.timedelta(days=1)
+            postponed.save()
+        calculate_all()
+
+        def table_at(date_limit):
+            totals = {team.id: [0, 0, 0] for team in self.teams}  # punti, differenza reti, goal fatti
+            for match in Match.objects.filter(season=season, status='FINISHED', date_time__lt=date_limit).select_related('result'):
+                for team_id, gf, ga in ((match.home_team_id, match.result.home_goals, match.result.away_goals),
+                                        (match.away_team_id, match.result.away_goals, match.result.home_goals)):
+                    totals[team_id][0] += 3 if gf > ga else (1 if gf == ga else 0)
+                    totals[team_id][1] += gf - ga
+                    totals[team_id][2] += gf
+            ranking = sorted(totals, key=lambda team_id: (-totals[team_id][0], -totals[team_id][1], -totals[team_id][2], team_id))
+            leader = totals[ranking[0]][0]
+            return {team_id: (position, leader - totals[team_id][0]) for position, team_id in enumerate(ranking, start=1)}
+
+        leaked = 0
+        for snap in TeamFormSnapshot.objects.filter(match__season=season, match__round_number__gte=3).select_related('match'):
+            match = snap.match
+            expected = table_at(match.date_time)[snap.team_id]
+            self.assertEqual((snap.league_position, snap.points_gap_top), expected, match)
+            ledger = StandingEntry.objects.filter(
+                season=season, team_id=snap.team_id, round_number__lt=match.round_number,
+            ).order_by('-round_number').values_list('position', 'points_gap_top').first()
+            leaked += ledger != expected
+
+            feats = get_team_features_at_date(
+                team=snap.team, date_limit=match.date_time, season=season,
+                current_match_home_team=match.home_team, current_match_away_team=match.away_team,
+                use_actual_starters=True, current_match=match,
+            )
+            self.assertEqual((feats['league_position'], feats['points_gap_top']), expected, match)
+        # Il ledger per giornata avrebbe anticipato il risultato rinviato
+        self.assertTrue(leaked)
+
+
+class TieredCacheTests(TestCase):
+    """ Due processi simulati (due livelli locali) sulla stessa tabella della DatabaseCache. """
+
+    def process(self):
+        from django.core.cache import caches
+        from predictors.cache_backend import LocalTier, TieredDatabaseCache
+        shared = caches['default']
+        backend = TieredDatabaseCache(shared._table, {'OPTIONS': {}})
+        # Sincronizzazione periodica disattivata: conta solo quello che fa la scrittura
+        backend._local = LocalTier(max_entries=100, timeout=60, sync_interval=3600)
+        return backend
+
+    def test_write_after_foreign_bump_drops_stale_local_copies(self):
+        a, b = self.process(), self.process()
+        a.set('tier:1', 'old')
+        self.assertEqual(a.get('tier:1'), 'old')
+
+        b.set('tier:1', 'new')
+        a.set('tier:2', 'other')  # A non deve coprire l'invalidazione di B
+        self.assertEqual(a.get('tier:1'), 'new')
+        self.assertEqual(a.get('tier:2'), 'other')
+
+    def test_version_never_moves_backwards(self):
+        from predictors.cache_backend import VERSION_KEY_PREFIX
+        a = self.process()
+        a.set(VERSION_KEY_PREFIX + 'tier', 10 ** 30, None)
+        a.set('tier:1', 'value')
+        self.assertGreater(a._read_versions(['tier'])['tier'], 10 ** 30)
+
+    def test_local_copy_capped_at_shared_expiry(self):
+        a, b = self.process(), self.process()
+        b.set('tier:short', 'value', 5)
+        self.assertEqual(a.get('tier:short'), 'value')
+        _, expires, _ = a._local.entries[a.make_and_validate_key('tier:short')]
+        self.assertLessEqual(expires - time.monotonic(), 5)
+
+
+class EventStreamTests(TestCase):
+    """ Lo stream SSE si chiude da solo: esecuzione ferma in coda o durata massima raggiunta. """
+
+    def collect(self, run, **limits):
+        from predictors import pipeline_progress
+        with mock.patch.multiple(pipeline_progress, POLL_INTERVAL=0, **limits):
+            return list(pipeline_progress.event_stream(run.pk, asynchronous=False))
+
+    def test_queued_run_without_worker_is_reported_as_stalled(self):
+        from predictors.models import PipelineRun
+        run = PipelineRun.objects.create(kind='pipeline')
+        chunks = self.collect(run, QUEUED_TIMEOUT=0)
+        self.assertEqual(len(chunks), 1)
+        self.assertTrue(chunks[0].startswith('event: stalled'))
+
+    def test_stream_ends_after_max_lifetime(self):
+        from predictors.models import PipelineRun
+        run = PipelineRun.objects.create(kind='pipeline', state='running')
+        self.assertEqual(self.collect(run, STREAM_MAX_LIFETIME=0), [])
+
+
+class PipelineDagTests(TestCase):
+    """ Impronte delle fasi: contenuto degli input e valore letto prima dell'esecuzione. """
+
+    @classmethod
+    def setUpTestData(cls):
+        build_league()
+        calculate_all()
+
+    def setUp(self):
+        from predictors.pipeline_dag import PIPELINE
+        from predictors.pipeline_progress import PipelineTracker
+        self.tracker = PipelineTracker(PipelineTracker.create('pipeline', PIPELINE.stage_rows()))
+        self.stage = PIPELINE.stages['calculate_elo']
+
+    def run_stage(self, command=None):
+        from predictors import pipeline_dag
+        with mock.patch.object(pipeline_dag, 'call_command', side_effect=command), \
+                mock.patch.object(pipeline_dag, 'connections'):
+            return pipeline_dag.PipelineDAG._run_stage(self.tracker, self.stage, False)
+
+    def correct_corner(self):
+        result = MatchResult.objects.order_by('pk').first()
+        result.home_stats['corner'] = 7 if result.home_stats['corner'] != 7 else 5
+        result.save()
+
+    def test_same_length_stat_correction_changes_inputs(self):
+        from predictors.pipeline_dag import features_inputs, fingerprint, train_inputs
+        before = [fingerprint(inputs()) for inputs in (features_inputs, train_inputs)]
+        self.correct_corner()
+        after = [fingerprint(inputs()) for inputs in (features_inputs, train_inputs)]
+        self.assertNotEqual(before[0], after[0])
+        self.assertNotEqual(before[1], after[1])
+
+    def test_unchanged_inputs_are_skipped(self):
+        self.assertEqual(self.run_stage(), 'completed')
+        self.assertEqual(self.run_stage(), 'skipped')
+
+    def test_own_writes_do_not_restart_the_stage(self):
+        def rewrite_elo(name):
+            TeamFormSnapshot.objects.filter(match__status='FINISHED').update(elo_rating=1234.5)
+
+        self.assertEqual(self.run_stage(rewrite_elo), 'completed')
+        self.assertEqual(self.run_stage(), 'skipped')
+
+    def test_inputs_written_during_the_run_restart_the_stage(self):
+        # Un'altra fase (o un processo) corregge un risultato mentre la fase gira
+        self.assertEqual(self.run_stage(lambda name: self.correct_corner()), 'completed')
+        self.assertEqual(self.run_stage(), 'completed')
+        self.assertEqual(self.run_stage(), 'skipped')
+
+
+class StageMetricsTests(TestCase):
+    """ Metriche delle fasi: forme di query senza controllo delle transazioni, CPU dei figli solo se attribuibile. """
+
+    def setUp(self):
+        from predictors.pipeline_dag import PIPELINE
+        from predictors.pipeline_progress import PipelineTracker
+        self.tracker = PipelineTracker(PipelineTracker.create('pipeline', PIPELINE.stage_rows()))
+
+    def test_transaction_statements_are_not_query_shapes(self):
+        from predictors.pipeline_progress import QueryCounter
+        counter = QueryCounter()
+        for sql in ('BEGIN', 'SAVEPOINT "s1_x1"', 'SELECT 1 FROM t WHERE id = 5', 'RELEASE SAVEPOINT "s1_x1"', 'COMMIT'):
+            counter(lambda *args: None, sql, None, False, {})
+        self.assertEqual(counter.count, 5)
+        self.assertEqual([shape['sql'] for shape in counter.top()], ['SELECT N FROM t WHERE id = N'])
+
+    def test_child_cpu_counted_only_for_stages_running_alone(self):
+        from itertools import count
+        from predictors import pipeline_progress
+        children = count(0.0, 100.0)
+        with mock.patch.object(pipeline_progress, '_children_cpu', lambda: next(children)):
+            with self.tracker.stage('train_model'):
+                pass
+            with self.tracker.stage('fetch_odds'):
+                with self.tracker.stage('calculate_features'):
+                    pass
+
+        cpu = {stage.name: stage.cpu_time for stage in self.tracker.run.stages.all()}
+        self.assertGreaterEqual(cpu['train_model'], 100.0)
+        self.assertLess(cpu['fetch_odds'], 100.0)
+        self.assertLess(cpu['calculate_features'], 100.0)
+
+
+class TeamSeasonStatsTests(TestCase):
+    """ Statistiche per stagione: totali corretti, un solo ricalcolo per risultato. """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.league, cls.seasons, cls.teams = build_league(n_teams=4, scheduled_rounds=0)
+
+    def test_result_ingest_updates_aggregates_once(self):
+        from predictors.models import TeamSeasonAggregate
+        from predictors.team_stats import TeamSeasonStats
+
+        TeamSeasonStats.rebuild_all()
+        match = Match.objects.filter(season=self.seasons[1]).select_related('result').first()
+        before = TeamSeasonAggregate.objects.get(team_id=match.home_team_id, season=match.season).home_gf
+        match.result.home_goals += 2
+        with mock.patch.object(TeamSeasonStats, 'update', wraps=TeamSeasonStats.update) as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                match.result.save()
+                match.save()  # come gli scraper: FINISHED dopo il risultato
+        update.assert_called_once_with(match.season_id, [match.home_team_id, match.away_team_id])
+        self.assertEqual(TeamSeasonAggregate.objects.get(team_id=match.home_team_id, season=match.season).home_gf, before + 2)
+
+
+class PredictionApiTests(TestCase):
+    """ ETag stabile: la lettura non scrive le opportunità (né prima né dopo aver calcolato la versione). """
+
+    @classmethod
+    def setUpTestData(cls):
+        from predictors.models import Prediction
+        cls.league, cls.seasons, cls.teams = build_league(n_teams=4)
+        cls.round_number = Match.objects.filter(status='SCHEDULED').order_by('round_number').first().round_number
+        for match in Match.objects.filter(season=cls.seasons[-1], round_number=cls.round_number):
+            # Opportunità mai calcolate: la lettura le calcola in memoria senza salvarle
+            Prediction.objects.create(match=match, home_goals=2, away_goals=1, home_corners=6, away_corners=3)
+
+    @mock.patch('predictors.services.gather', gather_in_request_thread)
+    def test_repeated_request_with_etag_gets_304(self):
+        from predictors.models import Prediction
+        url = f'/api/rounds/{self.round_number}/?season={self.seasons[-1].id}'
+
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first.json()['matches'][0]['opportunities'])
+        self.assertFalse(Prediction.objects.filter(opportunities_updated_at__isnull=False).exists())
+
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+
+class CurrentStateTests(TestCase):
+    """ Giornata corrente e prossime partite seguono anche le partite create, rinviate o eliminate. """
+
+    @classmethod
+    def setUpTestData(cls):
+        from predictors.current_state import CurrentState
+        cls.league, cls.seasons, cls.teams = build_league(n_teams=4, scheduled_rounds=0)
+        CurrentState.update()
+
+    @mock.patch('predictors.services.gather', gather_in_request_thread)
+    def test_new_scheduled_match_becomes_current_round(self):
+        from predictors.current_state import current_round, team_state
+        season = self.seasons[-1]
+        self.assertIsNone(current_round())
+
+        last = Match.objects.filter(season=season).order_by('-date_time').first()
+        with self.captureOnCommitCallbacks(execute=True):
+            match = Match.objects.create(
+                season=season, home_team=self.teams[0], away_team=self.teams[1], round_number=last.round_number + 1,
+                date_time=last.date_time + datetime.timedelta(days=7), status='SCHEDULED',
+            )
+        self.assertEqual(current_round(), (season.id, match.round_number))
+        self.assertEqual(team_state(self.teams[0].id).next_match_id, match.id)
+        self.assertEqual(self.client.get('/api/rounds/next/').status_code, 200)
+
+        # Rinviata: nessuna partita da giocare
+        with self.captureOnCommitCallbacks(execute=True):
+            match.status = 'POSTPONED'
+            match.save()
+        self.assertIsNone(current_round())
+        self.assertIsNone(team_state(self.teams[0].id).next_match_id)
+
+    def test_deferred_updates_touched_teams_once(self):
+        from predictors.current_state import CurrentState, current_round
+        season = self.seasons[-1]
+        last = Match.objects.filter(season=season).order_by('-date_time').first()
+        with mock.patch.object(CurrentState, 'update', wraps=CurrentState.update) as update:
+            with CurrentState.deferred(), self.captureOnCommitCallbacks(execute=True):
+                for home, away in ((0, 1), (2, 3)):
+                    Match.objects.create(
+                        season=season, home_team=self.teams[home], away_team=self.teams[away], round_number=last.round_number + 1,
+                        date_time=last.date_time + datetime.timedelta(days=7, hours=home), status='SCHEDULED',
+                    )
+        update.assert_called_once_with({team.id for team in self.teams})
+        self.assertEqual(current_round(), (season.id, last.round_number + 1))
+
+
+class AsyncQueriesTests(TransactionTestCase):
+    """ I gruppi di query in parallelo (thread con connessioni proprie) danno lo stesso payload della versione in serie. """
+
+    def setUp(self):
+        from predictors.models import Prediction
+        self.league, self.seasons, self.teams = build_league(n_teams=4)
+        for match in Match.objects.filter(status='SCHEDULED'):
+            Prediction.objects.create(match=match, home_goals=1, away_goals=0, home_corners=5, away_corners=2)
+
+    def test_gather_matches_sequential_build(self):
+        from asgiref.sync import async_to_sync
+        from predictors.services import PredictionApiService
+
+        for matches in (Match.objects.filter(status='SCHEDULED'), Match.objects.filter(season=self.seasons[0], round_number=2)):
+            PredictionApiService.version(matches)  # come l'API: opportunità salvate prima del payload
+            expected = PredictionApiService.build(matches, with_slip=True)
+            self.assertTrue(expected['matches'])
+            self.assertEqual(async_to_sync(PredictionApiService.abuild)(matches, with_slip=True), expected)
+
+    def test_gather_reuses_pool_connections(self):
+        from asgiref.sync import async_to_sync
+        from django.db.backends.signals import connection_created
+        from predictors import async_queries
+        from predictors.services import DashboardService
+
+        opened = []
+        receiver = lambda sender, connection, **kwargs: opened.append(connection)
+        connection_created.connect(receiver)
+        self.addCleanup(connection_created.disconnect, receiver)
+
+        expected = DashboardService.get_dashboard_context()
+        for _ in range(5):
+            self.assertEqual(
+                async_to_sync(DashboardService.aget_dashboard_context)()['upcoming_matches'], expected['upcoming_matches'],
+            )
+        # Cinque viste da due fasi di due gruppi: al massimo una connessione per thread del pool, non venti
+        self.assertLessEqual(len(opened), async_queries.POOL_SIZE)
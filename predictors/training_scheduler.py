@@ -0,0 +1,170 @@
+"""
+Addestramento multi-target in parallelo.
+
+I target vengono addestrati in un pool di processi con un budget fisso di
+CPU (workers x thread per fit = budget). La matrice di training non viene
+copiata: ogni processo mappa gli stessi file .npy della cache del training
+set (predictors.training_set), quindi le pagine sono condivise dal sistema.
+
+Warm start: se rispetto alla versione attiva sono state solo aggiunte partite
+(nessuna riga già usata è cambiata) e le nuove sono poche, ogni target
+riparte dal modello precedente e aggiunge WARM_START_ROUNDS alberi invece di
+rifare 2 addestramenti completi. La validazione in quel caso è il MAE del
+modello precedente sulle sole partite nuove (mai viste in training).
+"""
+import hashlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error
+from sklearn.model_selection import train_test_split
+from xgboost import XGBRegressor
+from predictors.constants import FEATURE_COLUMNS, TARGET_COLUMNS
+
+MODEL_PARAMS = {
+    'n_estimators': 200,
+    'learning_rate': 0.05,
+    'max_depth': 3,
+    'random_state': 42,
+}
+
+WARM_START_ROUNDS = 25
+WARM_START_MAX_NEW_RATIO = 0.1  # oltre il 10% di righe nuove si riaddestra da zero
+WARM_START_MAX_TREES = 400      # oltre questa dimensione il modello viene riaddestrato da zero
+
+
+def training_fingerprint(data_fingerprint):
+    """ Impronta di un addestramento: dati (TrainingSetCache.fingerprint) e iperparametri. """
+    params = (sorted(MODEL_PARAMS.items()), WARM_START_ROUNDS, WARM_START_MAX_NEW_RATIO, WARM_START_MAX_TREES)
+    return hashlib.sha1(repr((data_fingerprint, params)).encode()).hexdigest()
+
+
+# Matrice condivisa del processo worker (memory-map dei file della cache)
+_shared = {}
+
+
+def _init_worker(directory):
+    _shared['X'] = pd.DataFrame(np.load(os.path.join(directory, 'features.npy'), mmap_mode='r'), columns=FEATURE_COLUMNS, copy=False)
+    _shared['y'] = pd.DataFrame(np.load(os.path.join(directory, 'targets.npy'), mmap_mode='r'), columns=TARGET_COLUMNS, copy=False)
+
+
+def _fit_target(job):
+    """ Addestra un target (eseguito nel processo worker). """
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    X, y = _shared['X'], _shared['y'][job['target']]
+
+    previous = None
+    if job['warm_start_from'] and job['new_rows'] is not None and len(job['new_rows']):
+        previous = XGBRegressor()
+        previous.load_model(job['warm_start_from'])
+        booster = previous.get_booster()
+        if booster.num_boosted_rounds() + WARM_START_ROUNDS > WARM_START_MAX_TREES:
+            previous = None
+        elif booster.feature_names != FEATURE_COLUMNS:
+            # Feature cambiate rispetto alla versione precedente: si riparte da zero
+            previous = None
+
+    if previous is not None:
+        # MAE out-of-sample: modello precedente sulle sole partite nuove
+        new_rows = job['new_rows']
+        mae = mean_absolute_error(y.iloc[new_rows], previous.predict(X.iloc[new_rows]))
+
+        full_model = XGBRegressor(**dict(MODEL_PARAMS, n_estimators=WARM_START_ROUNDS), n_jobs=job['n_jobs'])
+        full_model.fit(X, y, xgb_model=previous.get_booster())
+    else:
+        model = XGBRegressor(**MODEL_PARAMS, n_jobs=job['n_jobs'])
+        model.fit(X.iloc[job['train_idx']], y.iloc[job['train_idx']])
+        mae = mean_absolute_error(y.iloc[job['test_idx']], model.predict(X.iloc[job['test_idx']]))
+
+        full_model = XGBRegressor(**MODEL_PARAMS, n_jobs=job['n_jobs'])
+        full_model.fit(X, y)
+
+    return {
+        'target': job['target'],
+        'model': full_model,
+        'mae': mae,
+        'mode': 'warm' if previous is not None else 'cold',
+        'wall': time.perf_counter() - wall_start,
+        'cpu': time.process_time() - cpu_start,
+    }
+
+
+def plan_warm_start(training_set, previous_ids, previous_checksums, max_new_ratio=WARM_START_MAX_NEW_RATIO):
+    """
+    (modalità, righe nuove) rispetto alla versione precedente:
+    - ('unchanged', None): stesse righe con gli stessi checksum, niente da aggiungere;
+    - ('warm', indici): sono state solo aggiunte partite, poche rispetto al totale;
+    - ('cold', None): righe già usate cambiate o rimosse, oppure troppe righe nuove.
+    """
+    current = {
+        match_id: tuple(cs)
+        for match_id, cs in zip(np.asarray(training_set.match_ids).tolist(), np.asarray(training_set.checksums).tolist())
+    }
+    for match_id, cs in zip(np.asarray(previous_ids).tolist(), np.asarray(previous_checksums).tolist()):
+        if current.get(match_id) != tuple(cs):
+            return 'cold', None
+
+    previous = set(np.asarray(previous_ids).tolist())
+    new_rows = [i for i, match_id in enumerate(np.asarray(training_set.match_ids).tolist()) if match_id not in previous]
+    if not new_rows:
+        return 'unchanged', None
+    if len(new_rows) > max_new_ratio * len(current):
+        return 'cold', None
+    return 'warm', np.array(new_rows, dtype=np.int64)
+
+
+class TrainingScheduler:
+    """
+    Esegue l'addestramento dei target in un pool di processi.
+    cpu_budget: thread totali (default: tutti i core); workers: processi paralleli.
+    """
+
+    def __init__(self, training_set, cpu_budget=None, workers=None, warm_start_paths=None, new_rows=None):
+        self.training_set = training_set
+        self.cpu_budget = max(1, cpu_budget or os.cpu_count() or 1)
+        self.workers = max(1, min(workers or self.cpu_budget, self.cpu_budget, len(TARGET_COLUMNS)))
+        if multiprocessing.current_process().daemon:
+            # Worker Django-Q (processo daemon): non può creare processi figli
+            self.workers = 1
+        self.threads_per_fit = max(1, self.cpu_budget // self.workers)
+        # Warm start: {target: file del modello precedente} + indici delle righe nuove
+        self.warm_start_paths = warm_start_paths or {}
+        self.new_rows = new_rows
+
+    def jobs(self):
+        # Split per validazione (20% test), identico per tutti i target
+        train_idx, test_idx = train_test_split(np.arange(len(self.training_set)), test_size=0.2, random_state=42)
+        for target in TARGET_COLUMNS:
+            yield {
+                'target': target,
+                'n_jobs': self.threads_per_fit,
+                'train_idx': train_idx,
+                'test_idx': test_idx,
+                'warm_start_from': self.warm_start_paths.get(target),
+                'new_rows': self.new_rows,
+            }
+
+    def run(self, on_result=None):
+        """ Addestra tutti i target. on_result(result) viene chiamato appena un target termina. """
+        results = {}
+
+        def collect(result):
+            results[result['target']] = result
+            if on_result:
+                on_result(result)
+
+        if self.workers == 1:
+            # Un solo worker: stessi job in sequenza nel processo corrente, con tutto il budget di thread
+            _init_worker(self.training_set.directory)
+            for job in self.jobs():
+                collect(_fit_target(job))
+        else:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.training_set.directory,)) as pool:
+                futures = [pool.submit(_fit_target, job) for job in self.jobs()]
+                for future in as_completed(futures):
+                    collect(future.result())
+
+        return [results[target] for target in TARGET_COLUMNS]
@@ -0,0 +1,286 @@
+"""
+Cache colonnare del training set di train_model.
+
+Il training set (una riga per partita finita con entrambi gli snapshot) è
+salvato su disco come array float32 .npy e caricato in memory-map:
+retraining senza ri-estrazione e senza copie in RAM.
+
+Ogni partita ha un checksum (una query per tutte le partite): somma pesata
+dei campi degli snapshot calcolata dal DB e hash dei target letti dal
+risultato (gol e statistiche del JSON, quindi anche una correzione che non
+cambia la lunghezza del testo, es. corner 5 -> 7). Il
+fingerprint del set è l'hash dei checksum: se non cambia, la cache è valida
+così com'è; se cambia, si estraggono solo le righe delle partite nuove o
+modificate e si riscrive una nuova versione della cache.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import Case, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast
+from predictors.models import Match, TeamFormSnapshot
+from predictors.constants import SNAPSHOT_FEATURES, FEATURE_COLUMNS, TARGET_COLUMNS
+
+SCHEMA_VERSION = 2
+
+
+def _targets_from_result(home_goals, away_goals, h_stats, a_stats):
+    h_stats = h_stats or {}
+    a_stats = a_stats or {}
+    return [
+        home_goals,
+        h_stats.get('possession', h_stats.get('possesso', 50)),
+        h_stats.get('tiri_totali', 0),
+        h_stats.get('tiri_porta', 0),
+        h_stats.get('corner', 0),
+        h_stats.get('falli', 0),
+        h_stats.get('gialli', 0),
+        h_stats.get('offsides', h_stats.get('fuorigioco', 0)),
+
+        away_goals,
+        a_stats.get('possession', a_stats.get('possesso', 50)),
+        a_stats.get('tiri_totali', 0),
+        a_stats.get('tiri_porta', 0),
+        a_stats.get('corner', 0),
+        a_stats.get('falli', 0),
+        a_stats.get('gialli', 0),
+        a_stats.get('offsides', a_stats.get('fuorigioco', 0)),
+    ]
+
+
+class TrainingSet:
+    """ Training set caricato (array in memory-map) con accesso come DataFrame. """
+
+    def __init__(self, match_ids, dates, features, targets, checksums=None, directory=None):
+        self.match_ids = match_ids
+        self.dates = dates
+        self.features = features
+        self.targets = targets
+        self.checksums = checksums
+        # Cartella dei file .npy: altri processi possono mapparli senza copie
+        self.directory = directory
+
+    def __len__(self):
+        return len(self.match_ids)
+
+    def feature_frame(self):
+        return pd.DataFrame(self.features, columns=FEATURE_COLUMNS, copy=False)
+
+    def target_frame(self):
+        return pd.DataFrame(self.targets, columns=TARGET_COLUMNS, copy=False)
+
+
+class TrainingSetCache:
+    """
+    Cache versionata su disco: <root>/<fingerprint>/{match_ids,dates,checksums,features,targets}.npy
+    più meta.json; il file CURRENT indica la versione valida (aggiornato con os.replace).
+    """
+
+    ARRAYS = ('match_ids', 'dates', 'checksums', 'features', 'targets')
+    CURRENT_FILE = 'CURRENT'
+
+    def __init__(self, root=None):
+        self.root = str(root or os.path.join(str(getattr(settings, 'ML_MODELS_DIR', os.path.join(settings.BASE_DIR, 'ml_models'))), 'training_set'))
+        self.stats = {'rows': 0, 'extracted': 0, 'removed': 0, 'cache_hit': False}
+
+    # ------------------------------------------------------------------
+    # Checksum (una query aggregata)
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _snapshot_checksum(side_filter):
+        # Pesi diversi per campo: uno scambio di valori tra colonne cambia il checksum
+        expr = None
+        for weight, (_, field) in enumerate(SNAPSHOT_FEATURES, start=1):
+            term = Cast(F(f"form_snapshots__{field}"), FloatField()) * Value(float(weight * 7919 + 1))
+            expr = term if expr is None else expr + term
+        return Sum(Case(When(side_filter, then=expr), default=None, output_field=FloatField()))
+
+    def fetch_checksums(self):
+        """ {match_id: (checksum_casa, checksum_ospite, checksum_risultato)} per le partite con entrambi gli snapshot. """
+        rows = Match.objects.filter(
+            status='FINISHED', result__isnull=False
+        ).annotate(
+            home_cs=self._snapshot_checksum(Q(form_snapshots__team_id=F('home_team_id'))),
+            away_cs=self._snapshot_checksum(Q(form_snapshots__team_id=F('away_team_id'))),
+        ).filter(
+            home_cs__isnull=False, away_cs__isnull=False
+        ).values_list(
+            'id', 'home_cs', 'away_cs',
+            'result__home_goals', 'result__away_goals', 'result__home_stats', 'result__away_stats',
+        )
+
+        return {
+            match_id: (home_cs, away_cs, self.result_checksum(home_goals, away_goals, h_stats, a_stats))
+            for match_id, home_cs, away_cs, home_goals, away_goals, h_stats, a_stats in rows
+        }
+
+    @staticmethod
+    def result_checksum(home_goals, away_goals, h_stats, a_stats):
+        """ Hash dei 16 target della partita come float (52 bit: esatto in float64, come gli altri checksum). """
+        targets = _targets_from_result(home_goals, away_goals, h_stats, a_stats)
+        digest = hashlib.md5(repr(targets).encode()).digest()
+        return float(int.from_bytes(digest[:8], 'big') >> 12)
+
+    @staticmethod
+    def fingerprint(checksums):
+        digest = hashlib.sha1(f"v{SCHEMA_VERSION}|{','.join(FEATURE_COLUMNS)}|{','.join(TARGET_COLUMNS)}".encode())
+        for match_id in sorted(checksums):
+            digest.update(repr((match_id,) + tuple(checksums[match_id])).encode())
+        return digest.hexdigest()
+
+    # ------------------------------------------------------------------
+    # Estrazione colonnare
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def extract(match_ids):
+        """ Righe (id, date, features, targets) per le partite indicate (None = tutte), come array. """
+        if match_ids is not None:
+            match_ids = list(match_ids)
+        if match_ids == []:
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype='datetime64[us]'),
+                    np.empty((0, len(FEATURE_COLUMNS)), dtype=np.float32), np.empty((0, len(TARGET_COLUMNS)), dtype=np.float32))
+
+        fields = [field for _, field in SNAPSHOT_FEATURES]
+        snapshots_qs = TeamFormSnapshot.objects.filter(match__status='FINISHED')
+        matches_qs = Match.objects.filter(status='FINISHED', result__isnull=False)
+        if match_ids is not None:
+            snapshots_qs = snapshots_qs.filter(match_id__in=match_ids)
+            matches_qs = matches_qs.filter(id__in=match_ids)
+
+        snapshots = {}
+        for row in snapshots_qs.values_list('match_id', 'team_id', *fields).iterator():
+            snapshots[(row[0], row[1])] = row[2:]
+
+        matches = matches_qs.values_list(
+            'id', 'date_time', 'home_team_id', 'away_team_id',
+            'result__home_goals', 'result__away_goals', 'result__home_stats', 'result__away_stats'
+        ).order_by('date_time', 'id')
+
+        ids, dates, features, targets = [], [], [], []
+        for match_id, date_time, home_id, away_id, home_goals, away_goals, h_stats, a_stats in matches.iterator():
+            home_snap = snapshots.get((match_id, home_id))
+            away_snap = snapshots.get((match_id, away_id))
+            if home_snap is None or away_snap is None:
+                continue
+            ids.append(match_id)
+            dates.append(np.datetime64(date_time.replace(tzinfo=None), 'us'))
+            features.append([date_time.hour, date_time.weekday(), date_time.month, *home_snap, *away_snap])
+            targets.append(_targets_from_result(home_goals, away_goals, h_stats, a_stats))
+
+        return (
+            np.array(ids, dtype=np.int64),
+            np.array(dates, dtype='datetime64[us]').reshape(-1),
+            np.array(features, dtype=np.float32).reshape(-1, len(FEATURE_COLUMNS)),
+            np.array(targets, dtype=np.float32).reshape(-1, len(TARGET_COLUMNS)),
+        )
+
+    # ------------------------------------------------------------------
+    # Caricamento / aggiornamento
+    # ------------------------------------------------------------------
+
+    def load(self, checksums=None):
+        """
+        Training set aggiornato, in memory-map. Estrae dal DB solo le partite
+        nuove o modificate rispetto alla versione in cache.
+        checksums: risultato di fetch_checksums() se già letto dal chiamante.
+        """
+        if checksums is None:
+            checksums = self.fetch_checksums()
+        fingerprint = self.fingerprint(checksums)
+
+        cached = self._read_current()
+        if cached is not None and cached['meta']['fingerprint'] == fingerprint:
+            self.stats.update(rows=len(cached['match_ids']), cache_hit=True)
+            return self._as_training_set(cached)
+
+        # Partite da ri-estrarre: nuove o con checksum diverso; da rimuovere: non più valide
+        if cached is not None:
+            old_ids = np.asarray(cached['match_ids'])
+            old_cs = np.asarray(cached['checksums'])
+            keep = np.array([
+                match_id in checksums and tuple(cs) == tuple(checksums[match_id])
+                for match_id, cs in zip(old_ids.tolist(), old_cs.tolist())
+            ], dtype=bool)
+            kept_ids = set(old_ids[keep].tolist())
+            base = {name: np.asarray(cached[name])[keep] for name in self.ARRAYS}
+            self.stats['removed'] = int(len(old_ids) - keep.sum())
+        else:
+            kept_ids = set()
+            base = None
+
+        changed_ids = None if base is None else [match_id for match_id in checksums if match_id not in kept_ids]
+        ids, dates, features, targets = self.extract(changed_ids)
+
+        # Solo le partite coperte dai checksum (entrambi gli snapshot presenti)
+        valid = np.array([match_id in checksums for match_id in ids.tolist()], dtype=bool).reshape(-1)
+        ids, dates, features, targets = ids[valid], dates[valid], features[valid], targets[valid]
+        self.stats['extracted'] = len(ids)
+
+        new_checksums = np.array([checksums[m] for m in ids.tolist()], dtype=np.float64).reshape(-1, 3)
+        arrays = {'match_ids': ids, 'dates': dates, 'checksums': new_checksums, 'features': features, 'targets': targets}
+        if base is not None:
+            arrays = {name: np.concatenate([base[name], arrays[name]]) for name in self.ARRAYS}
+
+        # Ordine cronologico (come la query originale), a parità di data per id
+        order = np.lexsort((arrays['match_ids'], arrays['dates']))
+        arrays = {name: values[order] for name, values in arrays.items()}
+
+        self._write(fingerprint, arrays)
+        self.stats['rows'] = len(arrays['match_ids'])
+        return self._as_training_set(self._read_current())
+
+    def _as_training_set(self, cached):
+        return TrainingSet(cached['match_ids'], cached['dates'], cached['features'], cached['targets'],
+                           checksums=cached['checksums'], directory=cached['directory'])
+
+    def _read_current(self):
+        try:
+            with open(os.path.join(self.root, self.CURRENT_FILE)) as f:
+                version = f.read().strip()
+            directory = os.path.join(self.root, version)
+            with open(os.path.join(directory, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta.get('schema') != SCHEMA_VERSION or meta.get('features') != FEATURE_COLUMNS or meta.get('targets') != TARGET_COLUMNS:
+                # Colonne cambiate: le righe in cache non sono riutilizzabili
+                return None
+            cached = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r') for name in self.ARRAYS}
+        except (OSError, ValueError):
+            return None
+        cached['meta'] = meta
+        cached['directory'] = directory
+        return cached
+
+    def _write(self, fingerprint, arrays):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{fingerprint[:12]}-", dir=self.root)
+        try:
+            for name in self.ARRAYS:
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), arrays[name])
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump({'schema': SCHEMA_VERSION, 'fingerprint': fingerprint, 'rows': len(arrays['match_ids']),
+                           'features': FEATURE_COLUMNS, 'targets': TARGET_COLUMNS}, f)
+
+            final_dir = os.path.join(self.root, fingerprint)
+            shutil.rmtree(final_dir, ignore_errors=True)
+            os.replace(tmp_dir, final_dir)
+
+            current_tmp = os.path.join(self.root, f".{self.CURRENT_FILE}.tmp")
+            with open(current_tmp, 'w') as f:
+                f.write(fingerprint)
+            os.replace(current_tmp, os.path.join(self.root, self.CURRENT_FILE))
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        # Le versioni precedenti non servono più
+        for entry in os.listdir(self.root):
+            path = os.path.join(self.root, entry)
+            if entry != fingerprint and not entry.startswith('.') and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import views, api
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
@@ -9,7 +9,13 @@ urlpatterns = [
     path('control-room/matches/', views.admin_matches, name='admin_matches'),
     path('control-room/pipeline-status/', views.pipeline_status, name='pipeline_status'),
     path('control-room/understat-status/', views.understat_status, name='understat_status'),
+    path('control-room/runs/<int:run_id>/events/', views.pipeline_events, name='pipeline_events'),
     path('edit-match/<int:match_id>/', views.edit_match_stats, name='edit_match'),
     path('standings/', views.standings, name='standings'),
     path('performance/', views.performance, name='performance'),
+
+    # API JSON di sola lettura (ETag / Last-Modified, 304)
+    path('api/rounds/next/', api.round_predictions, name='api_round_next'),
+    path('api/rounds/<int:round_number>/', api.round_predictions, name='api_round'),
+    path('api/matches/<int:match_id>/', api.match_prediction, name='api_match'),
 ]
\ No newline at end of file
@@ -3,8 +3,9 @@ import math
 from datetime import timedelta
 from django.db.models import Q
 from django.core.cache import cache
-from .models import TeamFormSnapshot, Team, Match, Rivalry, BettingConfiguration, PlayerMatchStat, OddsMovement, AccuracyProfile
+from .models import Team, Match, Rivalry, BettingConfiguration, PlayerMatchStat, OddsMovement, AccuracyProfile, TeamCurrentState
 from .constants import DEFAULT_MARKET_CONFIG
+from .score_matrix import ScoreMatrix
 
 # --- HELPER CONFIGURAZIONE ---
 def get_betting_config():
@@ -327,15 +328,11 @@ def calculate_advanced_metrics(last_5_matches, team, current_match_home_team=Non
     }
 
 def get_form_sequence(team):
-    """ Retrieves the form sequence for a given team. """
-    # Filter out empty sequences to avoid picking up future unprocessed matches
-    latest_snapshot = TeamFormSnapshot.objects.filter(team=team).exclude(form_sequence="").order_by('-match__date_time').first()
-    if latest_snapshot:
-        # REVERSE for display: Oldest -> Newest
-        return latest_snapshot.form_sequence
-    return ""
+    """ Retrieves the current form sequence for a given team (Newest->Oldest, from TeamCurrentState). """
+    form = TeamCurrentState.objects.filter(team=team).values_list('form_sequence', flat=True).first()
+    return form or ""
 
-from .models import TeamFormSnapshot, Team, Match, Rivalry, BettingConfiguration, PlayerMatchStat, Player
+from .models import Team, Match, Rivalry, BettingConfiguration, PlayerMatchStat, Player
 
 # ... (Codice precedente invariato) ...
 
@@ -350,18 +347,22 @@ def detect_probable_formation(team, date_limit):
         is_starter=True
     ).values('match_id').distinct().order_by('-match__date_time')[:5]
     
-    if not last_matches:
+    last_match_ids = [m['match_id'] for m in last_matches]
+    if not last_match_ids:
         return "4-3-3" # Default assoluto se zero storia
         
     formations_count = {}
+
+    # Ruoli dei titolari delle 5 partite in una sola query
+    roles_by_match = {mid: [] for mid in last_match_ids}
+    for mid, role in PlayerMatchStat.objects.filter(
+        match_id__in=last_match_ids, team=team, is_starter=True
+    ).values_list('match_id', 'player__primary_position'):
+        roles_by_match[mid].append(role)
     
-    for m in last_matches:
-        mid = m['match_id']
-        starters = PlayerMatchStat.objects.filter(match_id=mid, team=team, is_starter=True).select_related('player')
-        
+    for mid in last_match_ids:
         counts = {'DEF': 0, 'MID': 0, 'FWD': 0}
-        for s in starters:
-            role = s.player.primary_position
+        for role in roles_by_match[mid]:
             if role in counts:
                 counts[role] += 1
         
@@ -444,7 +445,15 @@ def get_probable_starters(team, date_limit, count=11):
     candidate_ids = list(player_minutes.keys())
     # FILTER: Exclude injured/suspended players
     players = Player.objects.filter(id__in=candidate_ids, status='AVAILABLE')
-    
+
+    return select_probable_starters(player_minutes, players, count)
+
+
+def select_probable_starters(player_minutes, players, count=11):
+    """
+    Parte in memoria di get_probable_starters: sceglie gli 11 tra i giocatori
+    disponibili (players) in base ai minuti {player_id: minuti} delle ultime 3 partite.
+    """
     roster = {'GK': [], 'DEF': [], 'MID': [], 'FWD': [], '?': []}
     
     for p in players:
@@ -561,32 +570,9 @@ def poisson_probability(k, lamb):
 def calculate_1x2_probabilities(home_goals_avg, away_goals_avg, max_goals=10):
     """
     Stima le probabilità percentuali di 1, X, 2 basandosi sulla distribuzione di Poisson
-    dei goal previsti per casa e trasferta.
+    dei goal previsti per casa e trasferta (matrice dei risultati vettoriale, vedi score_matrix).
     """
-    prob_1 = 0.0
-    prob_X = 0.0
-    prob_2 = 0.0
-
-    # Matrice di probabilità
-    for i in range(max_goals + 1): # Goal Casa da 0 a 10
-        prob_i = poisson_probability(i, home_goals_avg)
-        for j in range(max_goals + 1): # Goal Ospite da 0 a 10
-            prob_j = poisson_probability(j, away_goals_avg)
-            
-            joint_prob = prob_i * prob_j
-            
-            if i > j:
-                prob_1 += joint_prob
-            elif i == j:
-                prob_X += joint_prob
-            else:
-                prob_2 += joint_prob
-                
-    # Normalizzazione (poiché tronchiamo a 10 goal, la somma potrebbe essere < 1.0)
-    total_prob = prob_1 + prob_X + prob_2
-    if total_prob > 0:
-        return (prob_1 / total_prob), (prob_X / total_prob), (prob_2 / total_prob)
-    return 0.0, 0.0, 0.0
+    return ScoreMatrix(home_goals_avg, away_goals_avg, max_goals).prob_1x2()
 
 
 def calculate_confidence_score(predicted_val, target_val, volatility_factor=1.0, is_under=False, base_score=55, min_margin_for_score=0.1):
@@ -704,12 +690,14 @@ def _add_1x2_opportunities(opportunities, prediction, config, add_valid_opportun
     MULTIPLIER_1X2 = 15
     MAX_SCORE_1X2 = 95
     
+    prob_1, prob_X, prob_2 = ScoreMatrix.for_prediction(p).prob_1x2()
+
     if goal_diff > win_th: 
-        add_valid_opportunity_fn('Esito Finale: 1', 'Esito', min(BASE_SCORE_1X2 + (goal_diff * MULTIPLIER_1X2), MAX_SCORE_1X2), f"Vantaggio goal netto ({h_goals:.1f} vs {a_goals:.1f}).", '1X2')
+        add_valid_opportunity_fn('Esito Finale: 1', 'Esito', min(BASE_SCORE_1X2 + (goal_diff * MULTIPLIER_1X2), MAX_SCORE_1X2), f"Vantaggio goal netto ({h_goals:.1f} vs {a_goals:.1f}). Prob. {prob_1*100:.0f}%", '1X2')
     elif goal_diff < -win_th:
-        add_valid_opportunity_fn('Esito Finale: 2', 'Esito', min(BASE_SCORE_1X2 + (abs(goal_diff) * MULTIPLIER_1X2), MAX_SCORE_1X2), f"Vantaggio goal netto ({a_goals:.1f} vs {h_goals:.1f}).", '1X2')
+        add_valid_opportunity_fn('Esito Finale: 2', 'Esito', min(BASE_SCORE_1X2 + (abs(goal_diff) * MULTIPLIER_1X2), MAX_SCORE_1X2), f"Vantaggio goal netto ({a_goals:.1f} vs {h_goals:.1f}). Prob. {prob_2*100:.0f}%", '1X2')
     elif abs(goal_diff) < draw_th:
-        add_valid_opportunity_fn('Esito Finale: X', 'Esito', min(BASE_SCORE_1X2 + ((draw_th - abs(goal_diff)) * 50), 90), "Perfetto equilibrio previsto.", '1X2')
+        add_valid_opportunity_fn('Esito Finale: X', 'Esito', min(BASE_SCORE_1X2 + ((draw_th - abs(goal_diff)) * 50), 90), f"Perfetto equilibrio previsto. Prob. {prob_X*100:.0f}%", '1X2')
 
 
 
@@ -724,17 +712,19 @@ def _add_gg_ng_opportunities(opportunities, prediction, config, add_valid_opport
     GG_MIN_GOAL_PER_TEAM = 0.9
     NG_MAX_GOAL_WEAK_SIDE = 0.6
     NG_MAX_GOAL_STRONG_SIDE = 1.0
+
+    prob_gg, prob_ng = ScoreMatrix.for_prediction(p).prob_gg_ng()
     
     # GG
     if h_goals >= GG_MIN_GOAL_PER_TEAM and a_goals >= GG_MIN_GOAL_PER_TEAM:
         min_goals = min(h_goals, a_goals)
         score_gg = BASE_SCORE_GG + ((min_goals - (GG_MIN_GOAL_PER_TEAM - 0.1)) * MULTIPLIER_GG)
-        add_valid_opportunity_fn('Goal/NoGoal: Goal', 'Goal', min(score_gg, MAX_SCORE_GG), f"Entrambe pericolose: min {min_goals:.1f} goal previsti per lato.", 'Goal')
+        add_valid_opportunity_fn('Goal/NoGoal: Goal', 'Goal', min(score_gg, MAX_SCORE_GG), f"Entrambe pericolose: min {min_goals:.1f} goal previsti per lato. Prob. {prob_gg*100:.0f}%", 'Goal')
     
     # NG
     if (h_goals < NG_MAX_GOAL_WEAK_SIDE and a_goals < NG_MAX_GOAL_STRONG_SIDE) or (a_goals < NG_MAX_GOAL_WEAK_SIDE and h_goals < NG_MAX_GOAL_STRONG_SIDE):
         low_goal_score = (2.0 - total_goals) * 40 # This 40 is also a magic number
-        add_valid_opportunity_fn('Goal/NoGoal: No Goal', 'Goal', min(60 + low_goal_score, 90), "Previsto almeno uno zero.", 'Goal')
+        add_valid_opportunity_fn('Goal/NoGoal: No Goal', 'Goal', min(60 + low_goal_score, 90), f"Previsto almeno uno zero. Prob. {prob_ng*100:.0f}%", 'Goal')
 
 def _add_value_bet_opportunities(opportunities, prediction, config, add_valid_opportunity_fn):
     """
@@ -745,8 +735,8 @@ def _add_value_bet_opportunities(opportunities, prediction, config, add_valid_op
     if not odds:
         return
 
-    # Calcola probabilità reali del modello (Poisson)
-    prob_1, prob_X, prob_2 = calculate_1x2_probabilities(float(prediction.home_goals), float(prediction.away_goals))
+    # Calcola probabilità reali del modello (Poisson, matrice condivisa con gli altri mercati)
+    prob_1, prob_X, prob_2 = ScoreMatrix.for_prediction(prediction).prob_1x2()
     
     # Soglia minima di valore (5%)
     MIN_EDGE = 0.05
@@ -801,7 +791,8 @@ def get_multi_market_opportunities(prediction, home_snap=None, away_snap=None):
                 'raw_score': score,
                 'multiplier': multiplier,
                 'reasoning': reasoning,
-                'stat_type': internal_stat_type
+                'stat_type': internal_stat_type,
+                'market_type': market_type
             })
 
     # Call helper functions for each market type
@@ -831,9 +822,11 @@ def get_multi_market_opportunities(prediction, home_snap=None, away_snap=None):
             
     return best_opportunities
 
-def generate_slip(predictions, num_picks=None):
+def generate_slip(predictions, num_picks=None, opportunities_map=None):
     """
     Selects the absolute best picks across all matches.
+    opportunities_map: {prediction_id: [opportunità]} già materializzate
+    (OpportunityService.get_map); se assente vengono calcolate al volo.
     """
     config = get_betting_config()
     
@@ -849,7 +842,10 @@ def generate_slip(predictions, num_picks=None):
         if pred.match.id in used_matches:
             continue
 
-        opportunities = get_multi_market_opportunities(pred)
+        if opportunities_map is not None:
+            opportunities = opportunities_map.get(pred.id, [])
+        else:
+            opportunities = get_multi_market_opportunities(pred)
         if opportunities:
             best_op = opportunities[0] # Prendiamo la migliore già filtrata
             
@@ -864,6 +860,119 @@ def generate_slip(predictions, num_picks=None):
     slip_candidates.sort(key=lambda x: x['score'], reverse=True)
     return slip_candidates[:num_picks]
 
+# Chiave metrica -> punteggio per partita (vedi score_match_accuracy)
+ACCURACY_METRIC_SCORES = {
+    'acc_1x2': 'score_1x2',
+    'acc_total_goals': 'score_goals',
+    'acc_total_shots': 'score_shots',
+    'acc_shots_ot': 'score_shots_ot',
+    'acc_corners': 'score_corners',
+    'acc_fouls': 'score_fouls',
+    'acc_cards': 'score_cards',
+    'acc_offsides': 'score_offsides',
+}
+
+def score_match_accuracy(pred, res):
+    """
+    Punteggi di accuratezza (0-100) di una singola previsione rispetto al risultato.
+    Restituisce i punteggi per metrica, la media della partita e l'esito del segno.
+    """
+    # --- 1X2 Accuracy ---
+    # Predizione segno: Semplifichiamo: chi ha più goal previsti?
+    pred_winner = 'X'
+    if pred.home_goals > pred.away_goals: pred_winner = '1'
+    elif pred.away_goals > pred.home_goals: pred_winner = '2'
+    
+    score_1x2 = 100 if pred_winner == res.winner else 0
+
+    # --- Helper Accuracy Function ---
+    def get_acc(pred_val, real_val, tolerance=0.5, max_diff=5.0):
+        diff = abs(pred_val - real_val)
+        if diff <= tolerance: return 100.0
+        # Decadimento lineare fino a max_diff
+        score = max(0.0, 100.0 - ((diff / max_diff) * 100.0))
+        return score
+
+    # --- Stats Accuracy ---
+    # Goals
+    total_goals_pred = pred.home_goals + pred.away_goals
+    total_goals_real = res.home_goals + res.away_goals
+    score_goals = get_acc(total_goals_pred, total_goals_real, tolerance=0.5, max_diff=3.0)
+
+    # Shots
+    h_shots_real = (res.home_stats or {}).get('tiri_totali', 0)
+    a_shots_real = (res.away_stats or {}).get('tiri_totali', 0)
+    score_shots = get_acc(pred.home_total_shots + pred.away_total_shots, h_shots_real + a_shots_real, tolerance=2.0, max_diff=10.0)
+
+    # Shots OT
+    h_sot_real = (res.home_stats or {}).get('tiri_porta', 0)
+    a_sot_real = (res.away_stats or {}).get('tiri_porta', 0)
+    score_sot = get_acc(pred.home_shots_on_target + pred.away_shots_on_target, h_sot_real + a_sot_real, tolerance=1.5, max_diff=6.0)
+
+    # Corners
+    h_corn_real = (res.home_stats or {}).get('corner', 0)
+    a_corn_real = (res.away_stats or {}).get('corner', 0)
+    score_corners = get_acc(pred.home_corners + pred.away_corners, h_corn_real + a_corn_real, tolerance=1.5, max_diff=6.0)
+
+    # Fouls
+    h_fouls_real = (res.home_stats or {}).get('falli', 0)
+    a_fouls_real = (res.away_stats or {}).get('falli', 0)
+    score_fouls = get_acc(pred.home_fouls + pred.away_fouls, h_fouls_real + a_fouls_real, tolerance=2.0, max_diff=10.0)
+
+    # Cards
+    h_cards_real = (res.home_stats or {}).get('gialli', 0)
+    a_cards_real = (res.away_stats or {}).get('gialli', 0)
+    score_cards = get_acc(pred.home_yellow_cards + pred.away_yellow_cards, h_cards_real + a_cards_real, tolerance=1.0, max_diff=4.0)
+
+    # Offsides
+    h_off_real = (res.home_stats or {}).get('fuorigioco', 0)
+    a_off_real = (res.away_stats or {}).get('fuorigioco', 0)
+    score_offsides = get_acc(pred.home_offsides + pred.away_offsides, h_off_real + a_off_real, tolerance=1.0, max_diff=4.0)
+
+    # --- Match Average ---
+    match_avg = (score_1x2 + score_goals + score_shots + score_sot + score_corners + score_fouls + score_cards + score_offsides) / 8.0
+    
+    color_val = 'red'
+    if match_avg >= 80: color_val = 'green'
+    elif match_avg >= 60: color_val = 'yellow'
+
+    return {
+        'score_1x2': score_1x2,
+        'score_goals': score_goals,
+        'score_shots': score_shots,
+        'score_shots_ot': score_sot,
+        'score_corners': score_corners,
+        'score_fouls': score_fouls,
+        'score_cards': score_cards,
+        'score_offsides': score_offsides,
+        'score': round(match_avg, 1),
+        'color': color_val,
+        'is_correct_1x2': (pred_winner == res.winner),
+    }
+
+def average_accuracy_metrics(match_scores):
+    """
+    Medie per metrica (arrotondate a 1 decimale) e media globale da una lista
+    di punteggi per partita (output di score_match_accuracy), nell'ordine dato.
+    """
+    metrics_sum = {k: 0 for k in ACCURACY_METRIC_SCORES}
+    for scores in match_scores:
+        for k, score_key in ACCURACY_METRIC_SCORES.items():
+            metrics_sum[k] += scores[score_key]
+
+    count = len(match_scores)
+    final_metrics = {}
+    if count > 0:
+        for k, v in metrics_sum.items():
+            final_metrics[k] = round(v / count, 1)
+            
+        # Global Average (Mean of all accuracy metrics)
+        final_metrics['global_score_avg'] = round(sum(final_metrics.values()) / len(final_metrics), 1)
+    else:
+        for k in metrics_sum: final_metrics[k] = 0
+        final_metrics['global_score_avg'] = 0
+    return final_metrics
+
 def calculate_accuracy_metrics(match_data_list):
     """
     Calcola le metriche di accuratezza aggregando i risultati di una lista di match.
@@ -883,119 +992,32 @@ def calculate_accuracy_metrics(match_data_list):
             'matches_detail': []
         }
 
-    metrics_sum = {
-        'acc_1x2': 0,
-        'acc_total_goals': 0,
-        'acc_total_shots': 0,
-        'acc_shots_ot': 0,
-        'acc_corners': 0,
-        'acc_fouls': 0,
-        'acc_cards': 0,
-        'acc_offsides': 0
-    }
-    
-    count = len(match_data_list)
+    match_scores = []
     matches_detail = []
 
     for item in match_data_list:
-        match = item['match']
         pred = item['prediction']
         res = item['result']
         
         if not pred or not res:
-            count -= 1
             continue
 
-        # --- 1X2 Accuracy ---
-        # Predizione segno: Semplifichiamo: chi ha più goal previsti?
-        pred_winner = 'X'
-        if pred.home_goals > pred.away_goals: pred_winner = '1'
-        elif pred.away_goals > pred.home_goals: pred_winner = '2'
-        
-        score_1x2 = 100 if pred_winner == res.winner else 0
-        metrics_sum['acc_1x2'] += score_1x2
-
-        # --- Helper Accuracy Function ---
-        def get_acc(pred_val, real_val, tolerance=0.5, max_diff=5.0):
-            diff = abs(pred_val - real_val)
-            if diff <= tolerance: return 100.0
-            # Decadimento lineare fino a max_diff
-            score = max(0.0, 100.0 - ((diff / max_diff) * 100.0))
-            return score
-
-        # --- Stats Accuracy ---
-        # Goals
-        total_goals_pred = pred.home_goals + pred.away_goals
-        total_goals_real = res.home_goals + res.away_goals
-        score_goals = get_acc(total_goals_pred, total_goals_real, tolerance=0.5, max_diff=3.0)
-        metrics_sum['acc_total_goals'] += score_goals
-
-        # Shots
-        h_shots_real = (res.home_stats or {}).get('tiri_totali', 0)
-        a_shots_real = (res.away_stats or {}).get('tiri_totali', 0)
-        score_shots = get_acc(pred.home_total_shots + pred.away_total_shots, h_shots_real + a_shots_real, tolerance=2.0, max_diff=10.0)
-        metrics_sum['acc_total_shots'] += score_shots
-
-        # Shots OT
-        h_sot_real = (res.home_stats or {}).get('tiri_porta', 0)
-        a_sot_real = (res.away_stats or {}).get('tiri_porta', 0)
-        score_sot = get_acc(pred.home_shots_on_target + pred.away_shots_on_target, h_sot_real + a_sot_real, tolerance=1.5, max_diff=6.0)
-        metrics_sum['acc_shots_ot'] += score_sot
-
-        # Corners
-        h_corn_real = (res.home_stats or {}).get('corner', 0)
-        a_corn_real = (res.away_stats or {}).get('corner', 0)
-        score_corners = get_acc(pred.home_corners + pred.away_corners, h_corn_real + a_corn_real, tolerance=1.5, max_diff=6.0)
-        metrics_sum['acc_corners'] += score_corners
-
-        # Fouls
-        h_fouls_real = (res.home_stats or {}).get('falli', 0)
-        a_fouls_real = (res.away_stats or {}).get('falli', 0)
-        score_fouls = get_acc(pred.home_fouls + pred.away_fouls, h_fouls_real + a_fouls_real, tolerance=2.0, max_diff=10.0)
-        metrics_sum['acc_fouls'] += score_fouls
-
-        # Cards
-        h_cards_real = (res.home_stats or {}).get('gialli', 0)
-        a_cards_real = (res.away_stats or {}).get('gialli', 0)
-        score_cards = get_acc(pred.home_yellow_cards + pred.away_yellow_cards, h_cards_real + a_cards_real, tolerance=1.0, max_diff=4.0)
-        metrics_sum['acc_cards'] += score_cards
-
-        # Offsides
-        h_off_real = (res.home_stats or {}).get('fuorigioco', 0)
-        a_off_real = (res.away_stats or {}).get('fuorigioco', 0)
-        score_offsides = get_acc(pred.home_offsides + pred.away_offsides, h_off_real + a_off_real, tolerance=1.0, max_diff=4.0)
-        metrics_sum['acc_offsides'] += score_offsides
+        scores = score_match_accuracy(pred, res)
+        match_scores.append(scores)
         
         # --- Match Detail Item ---
-        match_avg = (score_1x2 + score_goals + score_shots + score_sot + score_corners + score_fouls + score_cards + score_offsides) / 8.0
-        
-        color_val = 'red'
-        if match_avg >= 80: color_val = 'green'
-        elif match_avg >= 60: color_val = 'yellow'
-        
         matches_detail.append({
-            'match': match,
+            'match': item['match'],
             'prediction': pred,
             'result': res,
-            'score_1x2': score_1x2,
-            'score_goals': score_goals,
-            'score': round(match_avg, 1),
-            'color': color_val,
-            'is_correct_1x2': (pred_winner == res.winner)
+            'score_1x2': scores['score_1x2'],
+            'score_goals': scores['score_goals'],
+            'score': scores['score'],
+            'color': scores['color'],
+            'is_correct_1x2': scores['is_correct_1x2']
         })
 
-    # --- Averages ---
-    final_metrics = {}
-    if count > 0:
-        for k, v in metrics_sum.items():
-            final_metrics[k] = round(v / count, 1)
-            
-        # Global Average (Mean of all accuracy metrics)
-        final_metrics['global_score_avg'] = round(sum(final_metrics.values()) / len(final_metrics), 1)
-    else:
-        for k in metrics_sum: final_metrics[k] = 0
-        final_metrics['global_score_avg'] = 0
-        
+    final_metrics = average_accuracy_metrics(match_scores)
     final_metrics['matches_detail'] = matches_detail # Add detail list
 
     return final_metrics
@@ -1,32 +1,50 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib import messages
 from django_q.tasks import async_task
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.urls import reverse
 from django.core.cache import cache
-from .utils import get_form_sequence, calculate_accuracy_metrics, get_probable_starters, get_match_comparison_data, get_multi_market_opportunities, detect_probable_formation
-from .models import Match, MatchResult, Prediction, Team, Season, TeamFormSnapshot, Rivalry, PlayerMatchStat, Player, MatchLineup, MatchAbsence, TopScorer
-from .tactical_engine import TacticalEngine
-from django.db.models import Q, Count, Sum
-from operator import attrgetter
+from django.db.models import Q
+from .models import Match, MatchResult, Season, Team, TopScorer, PipelineRun
 from .forms import MatchStatsForm
-from .services import DashboardService, DataStatusService
+from .services import DashboardService, DataStatusService, MatchDetailAssembler, AccuracyRollupService
+from .standings import StandingsLedger
+from .team_stats import calendar_page, team_totals
+from .current_state import current_round, team_state
+from .pipeline_progress import PipelineTracker, command_profiles, event_stream, is_query_regression, latest_status
+from .tasks import PIPELINE_STAGES, SCRAPING_STAGES
 
 def is_admin(user):
     return user.is_superuser
 
-def dashboard(request):
-    context = DashboardService.get_dashboard_context()
-    return render(request, 'predictors/dashboard.html', context)
+async def dashboard(request):
+    # Gruppi di query indipendenti in parallelo (ASGI); il template è renderizzato in un thread
+    context = await DashboardService.aget_dashboard_context()
+    return await sync_to_async(render)(request, 'predictors/dashboard.html', context)
 
 # --- STATUS ENDPOINTS ---
 def pipeline_status(request):
-    status = cache.get('pipeline_status', {'state': 'idle', 'progress': 0, 'message': 'In attesa...'})
-    return JsonResponse(status)
+    return JsonResponse(latest_status('pipeline'))
 
 def understat_status(request):
-    status = cache.get('scraping_status', {'state': 'idle', 'progress': 0, 'message': 'In attesa...'})
-    return JsonResponse(status)
+    return JsonResponse(latest_status('scraping'))
+
+@user_passes_test(is_admin)
+def pipeline_events(request, run_id):
+    """
+    Server-Sent Events con l'avanzamento di un'esecuzione (fasi, elementi elaborati, tempi, query).
+    Sotto ASGI (asgi.py) lo stream è asincrono e non occupa un thread; con runserver resta sincrono.
+    """
+    response = StreamingHttpResponse(
+        event_stream(run_id, asynchronous=isinstance(request, ASGIRequest)),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # niente buffering del proxy
+    return response
 
 # --- CONTROL ROOM ---
 @user_passes_test(is_admin)
@@ -35,17 +53,19 @@ def control_panel(request):
         action = request.POST.get('action')
         
         if action == 'run_full_pipeline':
-            async_task('predictors.tasks.run_pipeline_task')
+            run = PipelineTracker.create('pipeline', PIPELINE_STAGES)
+            async_task('predictors.tasks.run_pipeline_task', run.id, force=request.POST.get('force') == '1')
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                return JsonResponse({'status': 'started'})
+                return JsonResponse({'status': 'started', 'run_id': run.id, 'events_url': reverse('pipeline_events', args=[run.id])})
             return redirect('control_panel')
         
         elif action == 'scrape_understat_gw':
             gameweek = request.POST.get('gameweek_number')
             if gameweek and gameweek.isdigit():
-                async_task('predictors.tasks.run_scraping_task', gameweek)
+                run = PipelineTracker.create('scraping', SCRAPING_STAGES)
+                async_task('predictors.tasks.run_scraping_task', gameweek, run.id)
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-                    return JsonResponse({'status': 'started'})
+                    return JsonResponse({'status': 'started', 'run_id': run.id, 'events_url': reverse('pipeline_events', args=[run.id])})
                 messages.info(request, f"Scraping giornata {gameweek} avviato in background...")
             else:
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -54,26 +74,49 @@ def control_panel(request):
             
             return redirect('control_panel')
 
-    next_match = Match.objects.filter(status='SCHEDULED').order_by('date_time').first()
-    current_round = next_match.round_number if next_match else 1
+    league_round = current_round()
+    current_round_number = league_round[1] if league_round else 1
     
-    rounds_of_interest = [current_round - 1, current_round]
-    if current_round == 1: rounds_of_interest = [1]
-
-    matches_qs = Match.objects.filter(round_number__in=rounds_of_interest).order_by('date_time')
-    
-    pending_matches = []
-    for m in matches_qs:
-        status, missing_count = DataStatusService.analyze_match_data_status(m)
-        
-        if status != 'green' or m.status == 'SCHEDULED':
-            m.data_status_color = status
-            m.missing_count = missing_count
-            pending_matches.append(m)
+    rounds_of_interest = [current_round_number - 1, current_round_number]
+    if current_round_number == 1: rounds_of_interest = [1]
+
+    # Semaforo dati letto dal risultato (calcolato al salvataggio): una query per tutte le partite
+    matches_qs = DataStatusService.annotate(
+        Match.objects.filter(round_number__in=rounds_of_interest)
+    ).select_related('result', 'home_team', 'away_team').order_by('date_time')
+    pending_matches = list(matches_qs.filter(~Q(data_status_color='green') | Q(status='SCHEDULED')))
+
+    # Giornate con dati incompleti in tutte le stagioni
+    incomplete_rounds = DataStatusService.incomplete_rounds()
+
+    # Hit/miss della cache per prefisso (contatori del processo web che risponde)
+    cache_stats = cache.stats() if hasattr(cache, 'stats') else None
+
+    # Storico delle ultime esecuzioni della pipeline: tempi e query per fase a confronto
+    # (una esecuzione in più per confrontare anche la più vecchia mostrata)
+    recent_runs = list(PipelineRun.objects.filter(kind='pipeline').prefetch_related('stages')[:6])
+    stage_names = [name for name, _label, _weight in PIPELINE_STAGES]
+    run_stages = [{stage.name: stage for stage in run.stages.all()} for run in recent_runs]
+    run_history = []
+    for i, run in enumerate(recent_runs[:5]):
+        older = run_stages[i + 1] if i + 1 < len(run_stages) else {}
+        for name, stage in run_stages[i].items():
+            previous = older.get(name)
+            stage.regression = stage.state == 'completed' and previous is not None and previous.state == 'completed' \
+                and is_query_regression(stage.query_count, previous.query_count)
+        run_history.append({'run': run, 'stages': [run_stages[i].get(name) for name in stage_names]})
+
+    # Ultima esecuzione di ogni comando (pipeline o lanciato da solo) con le query più ripetute
+    profiles = command_profiles()
 
     return render(request, 'predictors/control_panel.html', {
         'pending_matches': pending_matches,
-        'suggested_round': current_round
+        'incomplete_rounds': incomplete_rounds,
+        'suggested_round': current_round_number,
+        'cache_stats': cache_stats,
+        'run_history': run_history,
+        'stage_names': stage_names,
+        'command_profiles': profiles,
     })
 
 @user_passes_test(is_admin)
@@ -87,11 +130,9 @@ def admin_matches(request):
         selected_round = default_round
     if selected_round < 1: selected_round = 1
 
-    matches = Match.objects.filter(round_number=selected_round).select_related('result', 'home_team', 'away_team').order_by('date_time')
-
-    for m in matches:
-        status, missing_count = DataStatusService.analyze_match_data_status(m)
-        m.data_status_color = status
+    matches = DataStatusService.annotate(
+        Match.objects.filter(round_number=selected_round)
+    ).select_related('result', 'home_team', 'away_team').order_by('date_time')
 
     return render(request, 'predictors/admin_matches.html', {
         'matches': matches,
@@ -113,7 +154,8 @@ def edit_match_stats(request, match_id):
             form.save()
             match.status = 'FINISHED'
             match.save()
-            cache.delete('performance_trend_data_v1')
+            # Snapshot, ELO e previsioni a valle: solo i record che leggono questo risultato
+            async_task('predictors.tasks.propagate_results_task', [match.id])
             messages.success(request, f"Dati salvati per {match}")
             
             if 'save_next' in request.POST:
@@ -131,316 +173,92 @@ def edit_match_stats(request, match_id):
 
     return render(request, 'predictors/edit_match.html', {'form': form, 'match': match})
 
-def match_detail(request, match_id):
-    match = get_object_or_404(Match, id=match_id)
-    prediction = Prediction.objects.filter(match=match).order_by('-created_at').first()
-    
-    try:
-        home_snap = TeamFormSnapshot.objects.filter(match=match, team=match.home_team).first()
-        away_snap = TeamFormSnapshot.objects.filter(match=match, team=match.away_team).first()
-    except:
-        home_snap = None
-        away_snap = None
-
-    rivalry = Rivalry.objects.filter(
-        Q(team1=match.home_team, team2=match.away_team) |
-        Q(team1=match.away_team, team2=match.home_team)
-    ).first()
-
-    # --- LINEUPS ---
-    # 1. Try to get stored Pre-Match Lineups
-    home_lineup_db = MatchLineup.objects.filter(match=match, team=match.home_team).order_by('-last_updated').first()
-    away_lineup_db = MatchLineup.objects.filter(match=match, team=match.away_team).order_by('-last_updated').first()
-
-    home_lineup_display = []
-    away_lineup_display = []
-    
-    home_module = home_lineup_db.formation if home_lineup_db else "4-3-3"
-    away_module = away_lineup_db.formation if away_lineup_db else "4-3-3"
-
-    def fetch_players_from_ids(ids):
-        if not ids: return []
-        players = list(Player.objects.filter(id__in=ids))
-        
-        # Sort Logic: GK -> DEF -> MID -> FWD -> ?
-        role_priority = {'GK': 1, 'DEF': 2, 'MID': 3, 'FWD': 4}
-        
-        players.sort(key=lambda p: role_priority.get(p.primary_position, 99))
-        
-        return [{'player': p, 'position': p.primary_position, 'is_starter': True, 'minutes': 'Est', 'goals': 0, 'xg': 0} for p in players]
-
-    if home_lineup_db and home_lineup_db.starting_xi:
-        home_lineup_display = fetch_players_from_ids(home_lineup_db.starting_xi)
-        # Check status from DB object
-        if home_lineup_db.status == 'PROBABLE':
-            is_probable_lineup = True
-    
-    if away_lineup_db and away_lineup_db.starting_xi:
-        away_lineup_display = fetch_players_from_ids(away_lineup_db.starting_xi)
-        # Check status from DB object
-        if away_lineup_db.status == 'PROBABLE':
-            is_probable_lineup = True
-
-    # Fallback if DB empty (keep existing logic but ensure it doesn't override True to False)
-    if not home_lineup_display:
-        home_played = PlayerMatchStat.objects.filter(match=match, team=match.home_team, is_starter=True).select_related('player')
-        if home_played.exists():
-             home_lineup_display = home_played
-        else:
-             is_probable_lineup = True
-             pids = get_probable_starters(match.home_team, match.date_time)
-             home_fmt = detect_probable_formation(match.home_team, match.date_time) # SMART DETECTION
-             
-             home_lineup_display = fetch_players_from_ids(pids)
-             home_module = home_fmt # Update display module
-             
-             if not home_lineup_db:
-                 home_lineup_db = MatchLineup(match=match, team=match.home_team, formation=home_fmt, starting_xi=pids)
-
-    if not away_lineup_display:
-        away_played = PlayerMatchStat.objects.filter(match=match, team=match.away_team, is_starter=True).select_related('player')
-        if away_played.exists():
-             away_lineup_display = away_played
-        else:
-             is_probable_lineup = True
-             pids = get_probable_starters(match.away_team, match.date_time)
-             away_fmt = detect_probable_formation(match.away_team, match.date_time) # SMART DETECTION
-             
-             away_lineup_display = fetch_players_from_ids(pids)
-             away_module = away_fmt # Update display module
-             
-             if not away_lineup_db:
-                 away_lineup_db = MatchLineup(match=match, team=match.away_team, formation=away_fmt, starting_xi=pids)
-
-    # --- TACTICAL ANALYSIS ---
-    tactical_report = TacticalEngine.analyze_matchup(home_lineup_db, away_lineup_db)
-
-    # --- ABSENCES ---
-    home_absences = MatchAbsence.objects.filter(match=match, team=match.home_team)
-    away_absences = MatchAbsence.objects.filter(match=match, team=match.away_team)
-
-    # --- COMPARISON ---
-    comparison_data = get_match_comparison_data(match, prediction)
-
-    # --- TOP BETS ---
-    top_bets = []
-    if prediction:
-        all_opportunities = get_multi_market_opportunities(prediction)
-        top_bets = all_opportunities[:3] 
-
-    context = {
-        'match': match,
-        'prediction': prediction,
-        'comparison_data': comparison_data,
-        'home_snap': home_snap,
-        'away_snap': away_snap,
-        'home_form': get_form_sequence(match.home_team),
-        'away_form': get_form_sequence(match.away_team),
-        'rivalry': rivalry,
-        'home_lineup': home_lineup_display,
-        'away_lineup': away_lineup_display,
-        'is_probable_lineup': is_probable_lineup,
-        'home_module': home_module,
-        'away_module': away_module,
-        'home_absences': home_absences, # NEW
-        'away_absences': away_absences, # NEW
-        'top_bets': top_bets,
-        'tactical_report': tactical_report,
-    }
-    return render(request, 'predictors/match_detail.html', context)
+async def match_detail(request, match_id):
+    # Tutto il contesto in poche query, in cache per partita (vedi MatchDetailAssembler)
+    context = await MatchDetailAssembler.aget_context(match_id)
+    if context is None:
+        raise Http404("Partita non trovata")
+    return await sync_to_async(render)(request, 'predictors/match_detail.html', context)
 
 def team_detail(request, team_id):
     team = get_object_or_404(Team, id=team_id)
-    
-    all_matches = Match.objects.filter(
-        Q(home_team=team) | Q(away_team=team)
-    ).select_related('result', 'home_team', 'away_team', 'season').order_by('-date_time')
-
-    played_matches = all_matches.filter(status='FINISHED')
-    upcoming_matches = all_matches.filter(status='SCHEDULED')
-
-    team_stats_aggregated = Match.objects.filter(
-        Q(home_team=team) | Q(away_team=team),
-        status='FINISHED'
-    ).aggregate(
-        played_count=Count('id'),
-        home_wins=Count('id', filter=Q(home_team=team, result__winner='1')),
-        home_draws=Count('id', filter=Q(home_team=team, result__winner='X')),
-        home_losses=Count('id', filter=Q(home_team=team, result__winner='2')),
-        away_wins=Count('id', filter=Q(away_team=team, result__winner='2')),
-        away_draws=Count('id', filter=Q(away_team=team, result__winner='X')),
-        away_losses=Count('id', filter=Q(away_team=team, result__winner='1')),
-        home_gf=Sum('result__home_goals', filter=Q(home_team=team)),
-        home_ga=Sum('result__away_goals', filter=Q(home_team=team)),
-        away_gf=Sum('result__away_goals', filter=Q(away_team=team)),
-        away_ga=Sum('result__home_goals', filter=Q(away_team=team))
-    )
 
-    stats = {
-        'played': team_stats_aggregated['played_count'] or 0,
-        'wins': (team_stats_aggregated['home_wins'] or 0) + (team_stats_aggregated['away_wins'] or 0),
-        'draws': (team_stats_aggregated['home_draws'] or 0) + (team_stats_aggregated['away_draws'] or 0),
-        'losses': (team_stats_aggregated['home_losses'] or 0) + (team_stats_aggregated['away_losses'] or 0),
-        'gf': (team_stats_aggregated['home_gf'] or 0) + (team_stats_aggregated['away_gf'] or 0),
-        'ga': (team_stats_aggregated['home_ga'] or 0) + (team_stats_aggregated['away_ga'] or 0)
-    }
-    
-    stats['gd'] = stats['gf'] - stats['ga']
+    # Totali dalle righe per stagione + calendario a pagine (keyset): costo indipendente dallo storico
+    page = calendar_page(team.id, before=request.GET.get('before'), after=request.GET.get('after'))
 
-    if stats['played'] > 0:
-        stats['avg_gf'] = round(stats['gf'] / stats['played'], 2)
-        stats['avg_ga'] = round(stats['ga'] / stats['played'], 2)
-    else:
-        stats['avg_gf'] = 0
-        stats['avg_ga'] = 0
+    stats = team_totals(team.id)
+    # ELO, forma e prossima partita dallo stato corrente (una lettura per chiave primaria)
+    state = team_state(team.id)
 
     context = {
         'team': team,
         'stats': stats,
-        'played_matches': played_matches,
-        'upcoming_matches': upcoming_matches,
-        'form': get_form_sequence(team)
+        'stats_splits': [('Casa', stats['home']), ('Trasferta', stats['away'])],
+        'played_matches': page['matches'],
+        'older_cursor': page['older'],
+        'newer_cursor': page['newer'],
+        'current_state': state,
+        'form': state.form_sequence if state else "",
     }
     return render(request, 'predictors/team_detail.html', context)
 
 def standings(request):
-    cache_key = 'standings_table_v1'
-    table = cache.get(cache_key)
-    scorers = cache.get('top_scorers_v1')
+    # Classifica dal ledger per giornata (una lettura); ?round=N per la classifica a quella giornata
+    season = StandingsLedger.current_season()
+    try:
+        round_number = int(request.GET['round']) if request.GET.get('round') else None
+    except ValueError:
+        round_number = None
+    table = StandingsLedger(season.id).table(round_number) if season else []
 
-    if table is None or scorers is None:
-        teams = Team.objects.all()
-        # ... (rest of logic remains but we assume it executes if either is None for simplicity here, ideally we separate)
-        # For brevity in this patch, we re-run table logic if scorers are missing or vice versa.
-        
-        stats = {t.id: {
-            'team': t, 'played': 0, 'points': 0, 'won': 0, 'drawn': 0, 'lost': 0,
-            'gf': 0, 'ga': 0, 'gd': 0
-        } for t in teams}
-
-        home_stats = Match.objects.filter(status='FINISHED').values('home_team').annotate(
-            played=Count('id'),
-            wins=Count('id', filter=Q(result__winner='1')),
-            draws=Count('id', filter=Q(result__winner='X')),
-            losses=Count('id', filter=Q(result__winner='2')),
-            gf=Sum('result__home_goals'),
-            ga=Sum('result__away_goals')
-        )
-
-        for entry in home_stats:
-            t_id = entry['home_team']
-            if t_id in stats:
-                s = stats[t_id]
-                s['played'] += entry['played']
-                s['won'] += entry['wins']
-                s['drawn'] += entry['draws']
-                s['lost'] += entry['losses']
-                s['gf'] += (entry['gf'] or 0)
-                s['ga'] += (entry['ga'] or 0)
-                s['points'] += (entry['wins'] * 3) + entry['draws']
-
-        away_stats = Match.objects.filter(status='FINISHED').values('away_team').annotate(
-            played=Count('id'),
-            wins=Count('id', filter=Q(result__winner='2')),
-            draws=Count('id', filter=Q(result__winner='X')),
-            losses=Count('id', filter=Q(result__winner='1')),
-            gf=Sum('result__away_goals'),
-            ga=Sum('result__home_goals')
-        )
-
-        for entry in away_stats:
-            t_id = entry['away_team']
-            if t_id in stats:
-                s = stats[t_id]
-                s['played'] += entry['played']
-                s['won'] += entry['wins']
-                s['drawn'] += entry['draws']
-                s['lost'] += entry['losses']
-                s['gf'] += (entry['gf'] or 0)
-                s['ga'] += (entry['ga'] or 0)
-                s['points'] += (entry['wins'] * 3) + entry['draws']
-
-        table = []
-        for s in stats.values():
-            s['gd'] = s['gf'] - s['ga']
-            team_obj = s['team']
-            team_obj.played = s['played']
-            team_obj.points = s['points']
-            team_obj.won = s['won']
-            team_obj.drawn = s['drawn']
-            team_obj.lost = s['lost']
-            team_obj.gf = s['gf']
-            team_obj.ga = s['ga']
-            team_obj.gd = s['gd']
-            table.append(team_obj)
-
-        table = sorted(table, key=attrgetter('points', 'gd', 'gf'), reverse=True)
-
-        for i, row in enumerate(table):
-            row.position = i + 1
-            
-        # --- MARCATORI ---
-        current_season = Season.objects.filter(is_current=True).first()
-        if not current_season: current_season = Season.objects.last()
-        
-        if current_season:
-            scorers = TopScorer.objects.filter(season=current_season).select_related('player', 'team').order_by('rank')[:15]
+    # --- MARCATORI ---
+    scorers = cache.get('top_scorers_v1')
+    if scorers is None:
+        if season:
+            scorers = list(TopScorer.objects.filter(season=season).select_related('player', 'team').order_by('rank')[:15])
         else:
             scorers = []
-            
-        cache.set(cache_key, table, 3600)
         cache.set('top_scorers_v1', scorers, 3600)
 
-    return render(request, 'predictors/standings.html', {'table': table, 'scorers': scorers})
+    return render(request, 'predictors/standings.html', {
+        'table': table,
+        'scorers': scorers,
+        'selected_round': table[0].round_number if table else None,
+    })
 
 def performance(request):
-    all_finished = Match.objects.filter(
-        status='FINISHED', 
-        predictions__isnull=False,
-        result__isnull=False
-    ).select_related('result', 'home_team', 'away_team', 'season').prefetch_related('predictions').order_by('date_time')
-
-    matches_by_round = {}
-    rounds_available = []
-    
-    for m in all_finished:
-        r = m.round_number
-        if r not in matches_by_round:
-            matches_by_round[r] = []
-            rounds_available.append(r)
-        
-        pred = m.predictions.order_by('-created_at').first()
-        matches_by_round[r].append({
-            'match': m,
-            'prediction': pred,
-            'result': m.result
-        })
-
-    rounds_available = sorted(list(set(rounds_available)))
-    
-    if not rounds_available:
+    # Solo righe precalcolate (vedi AccuracyRollupService): niente ricalcolo per richiesta.
+    # Una stagione alla volta: ?season=ID, default l'ultima con dati
+    try:
+        season_id = int(request.GET['season']) if request.GET.get('season') else None
+    except ValueError:
+        season_id = None
+    rollups = AccuracyRollupService.get_rounds(season_id) if season_id else []
+    if not rollups:
+        season_id = AccuracyRollupService.latest_season_id()
+        rollups = AccuracyRollupService.get_rounds(season_id) if season_id else []
+    if not rollups:
         return render(request, 'predictors/performance.html', {'no_data': True})
-
-    def calculate_trends():
-        data = []
-        for r in rounds_available:
-            metrics = calculate_accuracy_metrics(matches_by_round[r])
-            
-            data.append({
-                'round': r,
-                'global_avg': metrics['global_score_avg'],
-                'acc_1x2': metrics['acc_1x2'],
-                'acc_goals': metrics['acc_total_goals'], 
-                'acc_shots': metrics['acc_total_shots'],
-                'acc_shots_ot': metrics['acc_shots_ot'],
-                'acc_corners': metrics['acc_corners'],
-                'acc_fouls': metrics['acc_fouls'],
-                'acc_cards': metrics['acc_cards'],
-                'acc_offsides': metrics['acc_offsides']
-            })
-        return data
-
-    trend_data = cache.get_or_set('performance_trend_data_v1', calculate_trends, 3600)
+    season = Season.objects.get(id=season_id)
+
+    rounds_available = [r.round_number for r in rollups]
+    rollups_by_round = {r.round_number: r for r in rollups}
+
+    trend_data = [
+        {
+            'round': r.round_number,
+            'global_avg': r.global_score_avg,
+            'acc_1x2': r.acc_1x2,
+            'acc_goals': r.acc_total_goals, 
+            'acc_shots': r.acc_total_shots,
+            'acc_shots_ot': r.acc_shots_ot,
+            'acc_corners': r.acc_corners,
+            'acc_fouls': r.acc_fouls,
+            'acc_cards': r.acc_cards,
+            'acc_offsides': r.acc_offsides
+        }
+        for r in rollups
+    ]
 
     try:
         default_round = rounds_available[-1]
@@ -448,20 +266,29 @@ def performance(request):
     except ValueError:
         selected_round = rounds_available[-1]
 
-    if selected_round not in matches_by_round:
+    if selected_round not in rollups_by_round:
         selected_round = rounds_available[-1]
 
-    current_metrics = calculate_accuracy_metrics(matches_by_round[selected_round])
+    current = rollups_by_round[selected_round]
+    current_metrics = {
+        'global_score_avg': current.global_score_avg,
+        'acc_1x2': current.acc_1x2,
+        'acc_total_goals': current.acc_total_goals,
+        'acc_total_shots': current.acc_total_shots,
+        'acc_shots_ot': current.acc_shots_ot,
+        'acc_corners': current.acc_corners,
+        'acc_fouls': current.acc_fouls,
+        'acc_cards': current.acc_cards,
+        'acc_offsides': current.acc_offsides,
+        'matches_detail': AccuracyRollupService.round_detail(season_id, selected_round),
+    }
     
-    try:
-        curr_idx = rounds_available.index(selected_round)
-        prev_r = rounds_available[curr_idx - 1] if curr_idx > 0 else None
-        next_r = rounds_available[curr_idx + 1] if curr_idx < len(rounds_available) - 1 else None
-    except ValueError:
-        prev_r = None
-        next_r = None
+    curr_idx = rounds_available.index(selected_round)
+    prev_r = rounds_available[curr_idx - 1] if curr_idx > 0 else None
+    next_r = rounds_available[curr_idx + 1] if curr_idx < len(rounds_available) - 1 else None
 
     context = {
+        'season': season,
         'trend_data': trend_data,
         'current_metrics': current_metrics,
         'selected_round': selected_round,
@@ -90,6 +90,13 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST', 'localhost'),
         'PORT': os.getenv('DB_PORT', '5432'),
+        # Sotto ASGI (uvicorn) ogni richiesta gira in un thread diverso: le connessioni
+        # persistenti resterebbero aperte nei thread e si accumulerebbero. Come indica la
+        # documentazione di Django, 0 (connessione chiusa a fine richiesta). I gruppi di
+        # async_queries.gather usano invece un pool fisso di thread con connessioni
+        # persistenti (async_queries.CONN_MAX_AGE).
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -132,6 +139,10 @@ STATIC_URL = 'static/'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Modelli ML versionati (scritti da train_model, letti da predictors.model_store)
+ML_MODELS_DIR = BASE_DIR / 'ml_models'
+
 STATICFILES_DIRS = [
     BASE_DIR / "static",
 ]
@@ -142,10 +153,17 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # --- CACHE CONFIGURATION ---
 # Essential for sharing status between Web Process and Background Worker
+# DatabaseCache condivisa + LRU in memoria per processo (predictors.cache_backend):
+# le chiavi lette spesso non costano una query a ogni get.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'BACKEND': 'predictors.cache_backend.TieredDatabaseCache',
         'LOCATION': 'django_cache',
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 500,  # voci nel livello in memoria di ogni processo
+            'LOCAL_TIMEOUT': 60,       # durata massima (s) di una voce in memoria
+            'SYNC_INTERVAL': 2,        # secondi tra due controlli delle versioni condivise
+        },
     }
 }
 
@@ -153,7 +171,8 @@ CACHES = {
 # Task Queue System configuration
 Q_CLUSTER = {
     'name': 'ventusbet_cluster',
-    'workers': 1,  # Keep it simple for local/MVP
+    # Con più worker i ricalcoli pesanti (calculate_features) si dividono in shard paralleli
+    'workers': int(os.getenv('Q_WORKERS', '1')),
     'recycle': 500,
     'timeout': 1800, # 30 minutes timeout for heavy ML tasks
     'retry': 1860,   # Must be larger than timeout